@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Recall-vs-exact benchmark for approximate local index search.
+
+Builds a flat LocalVectorIndex and approximate variants over the same
+vectors (either synthetic clustered vectors or a copy of an existing local
+index) and reports recall@k and mean query latency for each IVF nprobe
+setting, plus recall, latency and memory footprint for each quantization.
+
+Usage:
+    python -m benchmarks.ann_recall --rows 200000 --nprobe 1 4 8 16 32
+    python -m benchmarks.ann_recall --quantization int8 pq --nprobe
+    python -m benchmarks.ann_recall --index-dir ./vector_data/my-index
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.embedding_service import EMBEDDING_DIMENSION  # noqa: E402
+from services.local_vector_store import LocalVectorIndex  # noqa: E402
+
+
+def synthetic_vectors(rows, dimension, clusters=256, seed=0):
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((rows, dimension)).astype(
+        np.float32
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_index(path, vectors, index_type, **options):
+    index = LocalVectorIndex(path, dimension=vectors.shape[1], index_type="flat")
+    batch = 50000
+    for start in range(0, len(vectors), batch):
+        chunk = vectors[start : start + batch]
+        ids = [str(start + i) for i in range(len(chunk))]
+        index.add(ids, [""] * len(chunk), chunk, [{}] * len(chunk))
+    if index_type == "flat" and not options:
+        return index
+    # Reopening trains the ANN index / quantizer over everything added above
+    return LocalVectorIndex(
+        path, dimension=vectors.shape[1], index_type=index_type, **options
+    )
+
+
+def time_queries(index, queries, k, **search_options):
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        results.append([row for row, _ in index.search(query, k, **search_options)])
+    elapsed = time.perf_counter() - started
+    return results, elapsed / len(queries) * 1000.0
+
+
+def recall(exact, approximate):
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approximate))
+    return hits / sum(len(e) for e in exact)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=EMBEDDING_DIMENSION)
+    parser.add_argument("--index-dir", help="benchmark a copy of an existing index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--quantization", nargs="*", default=[], choices=["int8", "pq"])
+    parser.add_argument("--rerank-factor", type=int, default=10)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ann-bench-")
+    try:
+        if args.index_dir:
+            source = LocalVectorIndex(args.index_dir, index_type="flat")
+            vectors = np.asarray(source._vectors[source._live])
+        else:
+            vectors = synthetic_vectors(args.rows, args.dimension)
+
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), args.queries)]
+        queries = queries + 0.1 * rng.standard_normal(queries.shape)
+
+        flat = build_index(os.path.join(workdir, "flat"), vectors, "flat")
+        exact, flat_ms = time_queries(flat, queries, args.k)
+
+        results = {
+            "rows": len(vectors),
+            "dimension": vectors.shape[1],
+            "k": args.k,
+            "flat_ms_per_query": flat_ms,
+            "flat_memory": flat.memory_stats(),
+            "nprobe": [],
+            "quantization": [],
+        }
+
+        if args.nprobe:
+            started = time.perf_counter()
+            ivf = build_index(
+                os.path.join(workdir, "ivf"),
+                vectors,
+                "ivf",
+                ann_options={"nlist": args.nlist, "min_train_size": 0},
+            )
+            results["ivf_build_seconds"] = time.perf_counter() - started
+            results["ivf"] = ivf._ann.get_stats()
+        for nprobe in args.nprobe:
+            approximate, ivf_ms = time_queries(ivf, queries, args.k, nprobe=nprobe)
+            results["nprobe"].append(
+                {
+                    "nprobe": nprobe,
+                    "recall": recall(exact, approximate),
+                    "ms_per_query": ivf_ms,
+                    "speedup": flat_ms / ivf_ms if ivf_ms else None,
+                }
+            )
+
+        for quantization in args.quantization:
+            options = {"min_train_size": 0} if quantization == "pq" else {}
+            started = time.perf_counter()
+            quantized = build_index(
+                os.path.join(workdir, quantization),
+                vectors,
+                "flat",
+                quantization=quantization,
+                quantization_options=options,
+                rerank_factor=args.rerank_factor,
+            )
+            build_seconds = time.perf_counter() - started
+            approximate, quantized_ms = time_queries(quantized, queries, args.k)
+            results["quantization"].append(
+                {
+                    "quantization": quantization,
+                    "build_seconds": build_seconds,
+                    "recall": recall(exact, approximate),
+                    "ms_per_query": quantized_ms,
+                    "memory": quantized.memory_stats(),
+                }
+            )
+
+        output = json.dumps(results, indent=2)
+        print(output)
+        if args.output:
+            Path(args.output).write_text(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
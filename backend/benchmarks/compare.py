@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare two load benchmark result files.
+
+Prints every shared metric of benchmarks.load results side by side and
+exits with status 1 when a latency, throughput or memory metric of the
+candidate is worse than the baseline by more than the threshold.
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.05
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def flatten(results, prefix=""):
+    """Numeric leaves of a result tree keyed by dotted path"""
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = float(value)
+    return metrics
+
+
+def direction(metric):
+    """+1 when higher is better, -1 when lower is better, 0 if informational"""
+    name = metric.rsplit(".", 1)[-1]
+    if name in ("requests_per_second", "pages_per_second"):
+        return 1
+    if ".latency_ms." in metric or name in ("peak_rss_mb", "errors"):
+        return -1
+    return 0
+
+
+def compare(baseline, candidate, threshold):
+    """Rows of (metric, baseline, candidate, relative change, regressed)"""
+    rows = []
+    for metric, before in baseline.items():
+        if metric not in candidate or direction(metric) == 0:
+            continue
+        after = candidate[metric]
+        change = (after - before) / before if before else (1.0 if after else 0.0)
+        regressed = change * direction(metric) < -threshold
+        rows.append((metric, before, after, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="relative change that counts as a regression (default 0.10)",
+    )
+    args = parser.parse_args()
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    candidate = json.loads(Path(args.candidate).read_text())
+    rows = compare(
+        flatten(baseline["scenarios"]), flatten(candidate["scenarios"]), args.threshold
+    )
+    rows += compare(
+        {"peak_rss_mb": baseline["peak_rss_mb"]},
+        {"peak_rss_mb": candidate["peak_rss_mb"]},
+        args.threshold,
+    )
+
+    print(f"baseline {baseline.get('commit')}  candidate {candidate.get('commit')}")
+    width = max(len(row[0]) for row in rows) if rows else 0
+    for metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{metric:<{width}}  {before:12.2f}  {after:12.2f}  {change:+8.1%}{flag}")
+
+    regressions = sum(row[4] for row in rows)
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+In-process stand-ins for the external services the API depends on, with
+configurable latency, for load benchmarks that run without network access.
+
+- FakeEmbeddings: deterministic hashed bag-of-words vectors in place of the
+  HuggingFace model.
+- FakePineconeBackend: a local on-disk backend that adds a network-like delay
+  to every query and upsert.
+- FakeGroqServer: an HTTP server speaking Groq's OpenAI-compatible chat
+  completions API (plain and streamed) at a fixed time to first token and
+  token rate.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from typing import Any, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from services.local_vector_store import LocalVectorStore
+from services.vector_backends import LocalBackend
+
+WORDS = (
+    "account access backup billing cache cluster config contract customer data "
+    "database deadline delivery deploy device error invoice key latency license "
+    "limit log memory network node order outage partner password payment plan "
+    "policy printer quota refund region release report request retention role "
+    "router schedule server service shipment storage support ticket token "
+    "upgrade usage user vendor version warranty workflow"
+).split()
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words unit vectors after a fixed compute delay"""
+
+    def __init__(self, dimension=384, latency_ms=5.0, per_text_ms=0.5):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep((self.latency_ms + self.per_text_ms * len(texts)) / 1000.0)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class DelayedVectorStore(LocalVectorStore):
+    """LocalVectorStore whose searches pay a remote round-trip"""
+
+    def __init__(self, index, embedding, query_latency_ms):
+        super().__init__(index, embedding)
+        self.query_latency_ms = query_latency_ms
+
+    def similarity_search_by_vector_with_score(
+        self, embedding, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        time.sleep(self.query_latency_ms / 1000.0)
+        return super().similarity_search_by_vector_with_score(embedding, k, **kwargs)
+
+    async def asimilarity_search_with_score(self, query, k: int = 4, **kwargs: Any):
+        embedding = await self._embedding.aembed_query(query)
+        await asyncio.sleep(self.query_latency_ms / 1000.0)
+        return LocalVectorStore.similarity_search_by_vector_with_score(
+            self, embedding, k, **kwargs
+        )
+
+
+class FakePineconeBackend(LocalBackend):
+    """Local indexes behind Pinecone-like query and upsert latency"""
+
+    name = "fake-pinecone"
+
+    def __init__(self, base_dir, query_latency_ms=20.0, upsert_latency_ms=50.0):
+        super().__init__(base_dir)
+        self.query_latency_ms = query_latency_ms
+        self.upsert_latency_ms = upsert_latency_ms
+
+    def get_vectorstore(self, index_name, embedding):
+        return DelayedVectorStore(
+            self.get_index(index_name), embedding, self.query_latency_ms
+        )
+
+    def add_embeddings(self, index_name, ids, documents, embeddings):
+        time.sleep(self.upsert_latency_ms / 1000.0)
+        return super().add_embeddings(index_name, ids, documents, embeddings)
+
+
+def create_fake_groq_app(latency_ms=300.0, tokens_per_second=200.0, output_tokens=60):
+    """ASGI app answering /openai/v1/chat/completions like Groq"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    token_delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    def completion(request_id, model, **fields):
+        return {
+            "id": request_id,
+            "created": int(time.time()),
+            "model": model,
+            **fields,
+        }
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        request_id = f"chatcmpl-{uuid.uuid4().hex}"
+        prompt_tokens = sum(
+            len(str(message.get("content", "")).split()) for message in body["messages"]
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        }
+        words = [WORDS[i % len(WORDS)] for i in range(output_tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency_ms / 1000.0 + token_delay * output_tokens)
+            return completion(
+                request_id,
+                model,
+                object="chat.completion",
+                choices=[
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                usage=usage,
+            )
+
+        async def events():
+            await asyncio.sleep(latency_ms / 1000.0)
+            for i, word in enumerate(words):
+                chunk = completion(
+                    request_id,
+                    model,
+                    object="chat.completion.chunk",
+                    choices=[
+                        {
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else " " + word},
+                            "finish_reason": None,
+                        }
+                    ],
+                )
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            final = completion(
+                request_id,
+                model,
+                object="chat.completion.chunk",
+                choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                x_groq={"id": request_id, "usage": usage},
+            )
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+class FakeGroqServer:
+    """Runs the fake Groq API on a local port in a background thread"""
+
+    def __init__(self, **options):
+        self.app = create_fake_groq_app(**options)
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def __enter__(self):
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        config = uvicorn.Config(
+            self.app, host="127.0.0.1", port=port, log_level="warning"
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Fake Groq server did not start")
+            time.sleep(0.01)
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def synthetic_pdf(pages=10, lines_per_page=30, seed=0) -> bytes:
+    """A PDF of pseudo-random sentences, roughly like a text-heavy report"""
+    from pypdf import PdfWriter
+    from pypdf.generic import DictionaryObject, NameObject, StreamObject
+
+    rng = np.random.default_rng(seed)
+    writer = PdfWriter()
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+    for page_number in range(pages):
+        lines = []
+        for _ in range(lines_per_page):
+            words = rng.choice(WORDS, size=12)
+            code = f"E-{rng.integers(100, 999)}"
+            lines.append(f"({' '.join(words)} {code}.) Tj T*")
+        content = StreamObject()
+        content.set_data(
+            (
+                "BT /F1 10 Tf 12 TL 50 750 Td "
+                f"(Page {page_number + 1}) Tj T* {' '.join(lines)} ET"
+            ).encode()
+        )
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark for the chat and upload endpoints.
+
+Runs the FastAPI app in-process against local stand-ins for Groq, Pinecone
+and the embedding model (see benchmarks/fakes.py), drives it through
+httpx's ASGI transport at a fixed concurrency and reports latency
+percentiles, throughput, ingestion pages/sec and peak RSS as JSON. Compare
+two result files with benchmarks.compare.
+
+Usage:
+    python -m benchmarks.load --output results.json
+    python -m benchmarks.load --scenarios chat stream --requests 500 --concurrency 32
+    python -m benchmarks.load --llm-latency-ms 800 --llm-tokens-per-second 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SCENARIOS = ("upload", "chat", "stream")
+INDEX_NAME = "bench"
+
+
+def configure_environment(workdir, args):
+    """Point every on-disk store at the work directory before the app loads"""
+    os.environ.update(
+        {
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "SECRET_KEY": "benchmark-secret",
+            "GROQ_API_KEY": "benchmark-key",
+            "PINECONE_API_KEY": "benchmark-key",
+            "INGESTION_DATA_DIR": os.path.join(workdir, "ingestion"),
+            "CHUNK_MANIFEST_PATH": os.path.join(workdir, "chunk_manifest.db"),
+            "CHUNK_EMBEDDING_STORE_DIR": os.path.join(workdir, "chunk_embeddings"),
+            "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical"),
+            "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        }
+    )
+
+
+def install_fakes(workdir, args):
+    """Swap the embedding model and vector backend for the stand-ins"""
+    from benchmarks.fakes import FakeEmbeddings, FakePineconeBackend
+    from services import embedding_service, vector_backends
+
+    engine = embedding_service.get_embedding_engine()
+    engine._model = FakeEmbeddings(latency_ms=args.embed_latency_ms)
+    vector_backends._backend = FakePineconeBackend(
+        os.path.join(workdir, "vectors"),
+        query_latency_ms=args.vector_latency_ms,
+        upsert_latency_ms=args.upsert_latency_ms,
+    )
+
+
+def summarize(latencies_ms, errors, elapsed):
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if len(latencies):
+        summary["latency_ms"] = {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": float(latencies.mean()),
+            "max": float(latencies.max()),
+        }
+    return summary
+
+
+async def run_at_concurrency(total, concurrency, send):
+    """Call ``send(i)`` for i in range(total) with at most ``concurrency`` in flight"""
+    latencies, errors = [], 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await send(i)
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"Request {i} failed: {str(e)}", file=sys.stderr)
+                continue
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def upload_scenario(client, args):
+    from benchmarks.fakes import synthetic_pdf
+
+    documents = [synthetic_pdf(args.pages, seed=seed) for seed in range(args.documents)]
+
+    async def send(i):
+        response = await client.post(
+            "/api/upload/bulk",
+            files=[("files", (f"doc-{i}.pdf", documents[i], "application/pdf"))],
+            data={"index_name": INDEX_NAME},
+        )
+        response.raise_for_status()
+        job_id = response.json()["files"][0]["job_id"]
+        while True:
+            job = (await client.get(f"/api/upload/jobs/{job_id}")).json()
+            if job["status"] == "completed":
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(job["error"])
+            await asyncio.sleep(0.02)
+
+    latencies, errors, elapsed = await run_at_concurrency(
+        args.documents, args.upload_concurrency, send
+    )
+    summary = summarize(latencies, errors, elapsed)
+    pages = (args.documents - errors) * args.pages
+    summary["pages_per_second"] = pages / elapsed if elapsed else 0.0
+    return summary
+
+
+def chat_payload(i):
+    # Distinct questions, so neither query nor answer caches short-circuit
+    return {
+        "query": f"What is the refund policy for order {i}?",
+        "index_name": INDEX_NAME,
+    }
+
+
+async def chat_scenario(client, args):
+    async def send(i):
+        response = await client.post("/api/chat", json=chat_payload(i))
+        response.raise_for_status()
+
+    await run_at_concurrency(args.warmup, args.concurrency, send)
+    return summarize(*await run_at_concurrency(args.requests, args.concurrency, send))
+
+
+async def stream_scenario(client, args):
+    # httpx's ASGI transport delivers a response once it is complete, so
+    # this measures whole streamed answers, not time to first token
+    async def send(i):
+        async with client.stream(
+            "POST", "/api/chat/stream", json=chat_payload(i)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line == "event: error":
+                    raise RuntimeError("stream reported an error")
+
+    await run_at_concurrency(args.warmup, args.concurrency, send)
+    return summarize(*await run_at_concurrency(args.requests, args.concurrency, send))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    import httpx
+    import main
+    from models import User
+
+    user = User(id=1, username="bench", email="bench@example.com", is_active=True)
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+
+    results = {}
+    async with main.lifespan(main.app):
+        # Measure a warm server, as the readiness probe would admit it
+        await asyncio.to_thread(main.warmup.wait)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=120
+        ) as client:
+            for name in SCENARIOS:
+                if name not in args.scenarios:
+                    continue
+                scenario = globals()[f"{name}_scenario"]
+                print(f"Running {name} scenario...", file=sys.stderr)
+                results[name] = await scenario(client, args)
+                results[name]["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200)
+    parser.add_argument("--llm-output-tokens", type=int, default=60)
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--vector-latency-ms", type=float, default=20)
+    parser.add_argument("--upsert-latency-ms", type=float, default=50)
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if {"chat", "stream"} & set(args.scenarios) and "upload" not in args.scenarios:
+        # Chats need an index with documents in it
+        args.scenarios.insert(0, "upload")
+
+    workdir = tempfile.mkdtemp(prefix="load-bench-")
+    try:
+        configure_environment(workdir, args)
+        install_fakes(workdir, args)
+        from benchmarks.fakes import FakeGroqServer
+
+        with FakeGroqServer(
+            latency_ms=args.llm_latency_ms,
+            tokens_per_second=args.llm_tokens_per_second,
+            output_tokens=args.llm_output_tokens,
+        ) as groq:
+            os.environ["GROQ_API_BASE"] = groq.url
+            scenarios = asyncio.run(run(args))
+
+        results = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "config": vars(args),
+            "scenarios": scenarios,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        output = json.dumps(results, indent=2)
+        print(output)
+        if args.output:
+            Path(args.output).write_text(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,146 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi.concurrency import run_in_threadpool
 import os
+import threading
+import time
 
 # Database configuration
 DATABASE_URL = os.environ["DATABASE_URL"]
 
+# Connection pool (per engine, per worker process)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Seconds before a pooled connection is replaced; -1 keeps connections
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+# Serve the auth endpoints from an async engine (asyncpg / aiosqlite)
+DB_ASYNC = os.environ.get("DB_ASYNC", "false").lower() == "true"
+
+# Async drivers for the sync drivers DATABASE_URL may name
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+class PoolStats:
+    """Counters of connection checkouts, waits and timeouts for one pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def begin(self):
+        with self._lock:
+            self.waiting += 1
+
+    def end(self, elapsed_ms, timed_out=False):
+        with self._lock:
+            self.waiting -= 1
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_ms_total += elapsed_ms
+            self.wait_ms_max = max(self.wait_ms_max, elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": (
+                    self.wait_ms_total / self.checkouts if self.checkouts else 0.0
+                ),
+                "wait_ms_max": self.wait_ms_max,
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Times every connection checkout from the pool's queue"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        self.stats.begin()
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.end(0.0, timed_out=True)
+            raise
+        except BaseException:
+            self.stats.end((time.perf_counter() - started) * 1000.0)
+            raise
+        self.stats.end((time.perf_counter() - started) * 1000.0)
+        return connection
+
+    def recreate(self):
+        # Keep the counters when the engine replaces its pool
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def get_stats(self):
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "max_overflow": self._max_overflow,
+            **self.stats.snapshot(),
+        }
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_options(url, poolclass):
+    """Pool settings for a URL; in-memory SQLite keeps SQLAlchemy's pool"""
+    if make_url(url).database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def async_database_url(url: str) -> str:
+    """The URL with its driver replaced by the matching async driver"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.get_driver_name() in ("asyncpg", "aiosqlite", "psycopg"):
+        return url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(
+        hide_password=False
+    )
+
+
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL, **_engine_options(DATABASE_URL, InstrumentedQueuePool)
+)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -15,6 +148,57 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create Base class
 Base = declarative_base()
 
+_async_engine = None
+_async_sessionmaker = None
+_async_lock = threading.Lock()
+
+
+def get_async_sessionmaker():
+    """Session factory on the async engine (created on first use)"""
+    global _async_engine, _async_sessionmaker
+    if _async_sessionmaker is None:
+        with _async_lock:
+            if _async_sessionmaker is None:
+                from sqlalchemy.ext.asyncio import (
+                    async_sessionmaker,
+                    create_async_engine,
+                )
+
+                url = async_database_url(DATABASE_URL)
+                _async_engine = create_async_engine(
+                    url, **_engine_options(url, InstrumentedAsyncQueuePool)
+                )
+                # Objects are read after commit, once the session is closed
+                _async_sessionmaker = async_sessionmaker(
+                    _async_engine, autoflush=False, expire_on_commit=False
+                )
+    return _async_sessionmaker
+
+
+def get_pool_stats():
+    """Connection pool counters of the sync and (if used) async engines"""
+    stats = {"async": DB_ASYNC}
+    for name, current in (("sync", engine), ("async_engine", _async_engine)):
+        if current is not None and hasattr(current.pool, "get_stats"):
+            stats[name] = current.pool.get_stats()
+    return stats
+
+
+class SessionRunner:
+    """
+    Runs synchronous ORM code ``function(session, *args)`` without blocking
+    the event loop: through ``AsyncSession.run_sync`` on an async session,
+    or on the thread pool with a sync session.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def run(self, function, *args):
+        if hasattr(self.session, "run_sync"):
+            return await self.session.run_sync(function, *args)
+        return await run_in_threadpool(function, self.session, *args)
+
 
 # Dependency to get DB session
 def get_db():
@@ -23,3 +207,16 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency for async endpoints; uses the async engine when DB_ASYNC is set
+async def get_session_runner():
+    if DB_ASYNC:
+        async with get_async_sessionmaker()() as session:
+            yield SessionRunner(session)
+        return
+    db = SessionLocal()
+    try:
+        yield SessionRunner(db)
+    finally:
+        await run_in_threadpool(db.close)
@@ -1,17 +1,49 @@
+import json
+import os
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from typing import List, Literal, Optional
 import uvicorn
-from sqlalchemy.orm import Session
 
 from services.vector_service import VectorStoreService
 from services.llm_service import LLMService
-from services.document_processor import DocumentProcessor
-from services.auth_service import AuthService, ACCESS_TOKEN_EXPIRE_MINUTES
-from database import get_db, engine, Base
+from services.document_processor import DocumentProcessor, default_index_name
+from services.answer_cache import get_answer_cache
+from services.reranker import RERANK_ENABLED, get_reranker, get_reranker_stats
+from services.ingestion_queue import (
+    INGESTION_MAX_PENDING,
+    IngestionQueue,
+    IngestionQueueFull,
+)
+from services.upload_archives import (
+    count_archive_pdfs,
+    is_archive,
+    iter_archive_pdfs,
+)
+from services.vector_backends import InvalidIndexName, validate_index_name
+from services.auth_service import (
+    AuthService,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    get_principal_cache,
+)
+from services.password_hashing import shutdown_hash_pool, warm_up_hash_pool
+from services.warmup import WARMUP_ENABLED, WARMUP_STEPS, WARMUP_TEXT, Warmup
+from services.metrics import (
+    CONTENT_TYPE,
+    REGISTRY,
+    MetricsMiddleware,
+    render_metrics,
+    stage,
+)
+from database import get_pool_stats, get_session_runner, engine, Base, SessionRunner
 from models import User
 
 # Load environment variables
@@ -19,7 +51,115 @@ from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
 
-app = FastAPI(title="DocBot AI API", version="1.0.0")
+# Largest PDF accepted, on its own or inside an archive
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# Most documents accepted by one bulk upload; no more than the queue holds
+BULK_UPLOAD_MAX_FILES = int(
+    os.environ.get("BULK_UPLOAD_MAX_FILES", str(INGESTION_MAX_PENDING))
+)
+
+# Initialize services
+vector_service = VectorStoreService()
+llm_service = LLMService()
+document_processor = DocumentProcessor()
+answer_cache = get_answer_cache()
+ingestion_queue = IngestionQueue(document_processor)
+principal_cache = get_principal_cache()
+
+# Chains hold the vector store they were built on; drop them with it
+vector_service.add_index_listener(llm_service.invalidate_chains)
+
+
+def warm_up_steps():
+    """The WARMUP_STEPS to run at startup, by name"""
+    if not WARMUP_ENABLED:
+        return {}
+    steps = {
+        # Loads MiniLM and runs a first (slow) forward pass
+        "embedding": lambda: vector_service.warm_up_embeddings(WARMUP_TEXT),
+        "vectorstore": vector_service.warm_up_vectorstore,
+        "llm": lambda: llm_service.warm_up(WARMUP_TEXT),
+        "ingestion": document_processor.warm_up,
+        "auth": warm_up_hash_pool,
+    }
+    if RERANK_ENABLED:
+        steps["reranker"] = lambda: get_reranker().warm_up(WARMUP_TEXT)
+    return {name: steps[name] for name in WARMUP_STEPS if name in steps}
+
+
+warmup = Warmup(warm_up_steps())
+
+
+def collect_service_metrics():
+    """/metrics families read from the counters services already keep"""
+    caches = {
+        "query_embedding": vector_service.get_query_cache_stats(),
+        "answer": answer_cache.get_stats(),
+        "principal": principal_cache.get_stats(),
+    }
+    yield (
+        "docbot_cache_hits_total",
+        "counter",
+        "Cache lookups answered from the cache",
+        [({"cache": name}, stats["hits"]) for name, stats in caches.items()],
+    )
+    yield (
+        "docbot_cache_misses_total",
+        "counter",
+        "Cache lookups not answered from the cache",
+        [({"cache": name}, stats["misses"]) for name, stats in caches.items()],
+    )
+    yield (
+        "docbot_cache_hit_ratio",
+        "gauge",
+        "Share of cache lookups answered from the cache since startup",
+        [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()],
+    )
+    ingestion = ingestion_queue.get_stats()
+    yield (
+        "docbot_ingestion_jobs",
+        "gauge",
+        "Upload jobs by status",
+        [({"status": status}, count) for status, count in ingestion["jobs"].items()],
+    )
+    pools = get_pool_stats()
+    yield (
+        "docbot_db_connections_checked_out",
+        "gauge",
+        "Database connections in use",
+        [
+            ({"engine": name}, pools[name]["checked_out"])
+            for name in ("sync", "async_engine")
+            if name in pools
+        ],
+    )
+    yield (
+        "docbot_db_connection_waits",
+        "gauge",
+        "Requests waiting for a database connection",
+        [
+            ({"engine": name}, pools[name]["waiting"])
+            for name in ("sync", "async_engine")
+            if name in pools
+        ],
+    )
+
+
+REGISTRY.register_collector(collect_service_metrics)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resume uploads that were still queued when the server last stopped
+    ingestion_queue.start()
+    # Requests are served meanwhile; /api/ready reports when it's done
+    warmup.start()
+    yield
+    ingestion_queue.shutdown(wait=False)
+    shutdown_hash_pool()
+
+
+app = FastAPI(title="DocBot AI API", version="1.0.0", lifespan=lifespan)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -27,6 +167,20 @@ Base.metadata.create_all(bind=engine)
 # Security
 security = HTTPBearer()
 
+
+@app.exception_handler(RequestValidationError)
+async def index_name_error_handler(request, exc: RequestValidationError):
+    """Invalid index names are bad requests (400); other errors stay 422"""
+    for error in exc.errors():
+        cause = error.get("ctx", {}).get("error")
+        if isinstance(cause, InvalidIndexName):
+            return JSONResponse(status_code=400, content={"detail": str(cause)})
+    return await request_validation_exception_handler(request, exc)
+
+
+# Request latency, in-flight requests and trace context
+app.add_middleware(MetricsMiddleware)
+
 # CORS middleware for React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -43,6 +197,28 @@ app.add_middleware(
 # Request/Response models
 class ChatRequest(BaseModel):
     query: str
+    # Index to answer from; defaults to the index the user switched to
+    index_name: Optional[str] = None
+    # Retrieval overrides; unset ones use the RETRIEVAL_* defaults
+    retrieval_mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
+    dense_weight: Optional[float] = Field(default=None, ge=0)
+    lexical_weight: Optional[float] = Field(default=None, ge=0)
+    rerank: Optional[bool] = None
+
+    @field_validator("index_name")
+    @classmethod
+    def check_index_name(cls, value):
+        return value if value is None else validate_index_name(value)
+
+    def retrieval_settings(self):
+        """Retrieval overrides as build_retriever keyword arguments"""
+        settings = {
+            "mode": self.retrieval_mode,
+            "dense_weight": self.dense_weight,
+            "lexical_weight": self.lexical_weight,
+            "rerank": self.rerank,
+        }
+        return {key: value for key, value in settings.items() if value is not None}
 
 
 class SourceDocument(BaseModel):
@@ -53,6 +229,8 @@ class SourceDocument(BaseModel):
 class ChatResponse(BaseModel):
     result: str
     source_documents: List[dict]
+    # Prompt token counts; absent for answers served from the answer cache
+    usage: Optional[dict] = None
 
 
 class UploadResponse(BaseModel):
@@ -62,6 +240,30 @@ class UploadResponse(BaseModel):
     error: Optional[str] = None
 
 
+class BulkUploadFileResult(BaseModel):
+    filename: str
+    status: str
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkUploadResponse(BaseModel):
+    success: bool
+    queued: int
+    rejected: int
+    files: List[BulkUploadFileResult]
+
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    filename: str
+    index_name: Optional[str] = None
+    status: str
+    progress: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
 class IndexListResponse(BaseModel):
     success: bool
     indexes: List[str]
@@ -71,6 +273,11 @@ class IndexListResponse(BaseModel):
 class SwitchIndexRequest(BaseModel):
     index_name: str
 
+    @field_validator("index_name")
+    @classmethod
+    def check_index_name(cls, value):
+        return validate_index_name(value)
+
 
 # Authentication models
 class UserSignup(BaseModel):
@@ -96,31 +303,35 @@ class UserResponse(BaseModel):
     is_active: bool
 
 
-# Initialize services
-vector_service = VectorStoreService()
-llm_service = LLMService()
-document_processor = DocumentProcessor()
-
-
 # Authentication dependency
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_session_runner),
 ) -> User:
     """Get current authenticated user"""
     token = credentials.credentials
-    username = AuthService.verify_token(token)
-    if username is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = AuthService.get_user_by_username(db, username)
+    # Recently seen tokens skip JWT decoding and the user lookup
+    user = principal_cache.get(token)
     if user is None:
+        payload = AuthService.decode_token(token)
+        if payload is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user = await db.run(AuthService.get_user_by_username, payload["sub"])
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        principal_cache.put(token, user, payload.get("exp"))
+    if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+            detail="Inactive user",
             headers={"WWW-Authenticate": "Bearer"},
         )
     return user
@@ -132,23 +343,54 @@ async def health_check():
     return {"status": "healthy", "message": "DocBot AI API is running"}
 
 
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the startup warm-up has finished"""
+    readiness = warmup.get_status()
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, tokens, cache hit rates"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """Performance counters for the retrieval pipeline"""
+    return {
+        "query_batcher": vector_service.get_query_batcher_stats(),
+        "query_cache": vector_service.get_query_cache_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "reranker": get_reranker_stats(),
+        "ingestion": ingestion_queue.get_stats(),
+        "principal_cache": principal_cache.get_stats(),
+        "database": get_pool_stats(),
+    }
+
+
 # Authentication endpoints
 @app.post("/api/auth/signup", response_model=UserResponse)
-def signup(user_data: UserSignup, db: Session = Depends(get_db)):
+async def signup(
+    user_data: UserSignup, db: SessionRunner = Depends(get_session_runner)
+):
     """User registration"""
     # Check if user already exists
-    if AuthService.get_user_by_email(db, user_data.email):
+    if await db.run(AuthService.get_user_by_email, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
         )
 
-    if AuthService.get_user_by_username(db, user_data.username):
+    if await db.run(AuthService.get_user_by_username, user_data.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Username already taken"
         )
 
-    # Create new user
-    user = AuthService.create_user(
+    # Create new user; bcrypt runs on the password hashing pool
+    user = await AuthService.acreate_user(
         db=db,
         username=user_data.username,
         email=user_data.email,
@@ -161,9 +403,11 @@ def signup(user_data: UserSignup, db: Session = Depends(get_db)):
 
 
 @app.post("/api/auth/login", response_model=Token)
-def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(
+    user_credentials: UserLogin, db: SessionRunner = Depends(get_session_runner)
+):
     """User login"""
-    user = AuthService.authenticate_user(
+    user = await AuthService.aauthenticate_user(
         db, user_credentials.email, user_credentials.password
     )
     if not user:
@@ -181,6 +425,20 @@ def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.post("/api/auth/deactivate", response_model=UserResponse)
+async def deactivate_account(
+    current_user: User = Depends(get_current_user),
+    db: SessionRunner = Depends(get_session_runner),
+):
+    """Deactivate the current user's account; its tokens stop working"""
+    user = await db.run(AuthService.deactivate_user, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return UserResponse(
+        id=user.id, username=user.username, email=user.email, is_active=user.is_active
+    )
+
+
 @app.get("/api/auth/me", response_model=UserResponse)
 def get_current_user_info(current_user: User = Depends(get_current_user)):
     """Get current user information"""
@@ -192,49 +450,142 @@ def get_current_user_info(current_user: User = Depends(get_current_user)):
     )
 
 
+def format_source_documents(documents):
+    """Format source documents for frontend"""
+    source_docs = []
+    for doc in documents:
+        source_docs.append(
+            {
+                "page_content": (
+                    doc.page_content[:200] + "..."
+                    if len(doc.page_content) > 200
+                    else doc.page_content
+                ),
+                "metadata": doc.metadata,
+            }
+        )
+    return source_docs
+
+
+def format_sse(event, data):
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.post("/api/chat", response_model=ChatResponse)
-def chat(request: ChatRequest, current_user: User = Depends(get_current_user)):
+async def chat(request: ChatRequest, current_user: User = Depends(get_current_user)):
     """
     Chat endpoint that processes user queries using the vector store and LLM
     Replicates the functionality from connect_memory_with_llm.py
     """
     try:
-        # Get vector store
-        vectorstore = vector_service.get_vectorstore()
+        # Get vector store for the requested (or the user's selected) index
+        index_name = request.index_name or vector_service.get_current_index(
+            current_user.id
+        )
+        vectorstore = await run_in_threadpool(
+            vector_service.get_vectorstore, index_name
+        )
         if vectorstore is None:
             raise HTTPException(status_code=500, detail="Failed to load vector store")
 
+        # Serve a previous answer to a near-duplicate question on this index;
+        # answers retrieved with per-request overrides are not cached
+        retrieval = request.retrieval_settings()
+        query_embedding = None
+        if answer_cache.enabled and not retrieval:
+            with stage("answer_cache_lookup"):
+                query_embedding = await vector_service.aembed_query(request.query)
+                cached = answer_cache.lookup(index_name, query_embedding)
+            if cached is not None:
+                return ChatResponse(**cached)
+
         # Get LLM response using the RetrievalQA chain
-        response = llm_service.get_response(request.query, vectorstore)
-
-        # Format source documents for frontend
-        source_docs = []
-        if "source_documents" in response:
-            for doc in response["source_documents"]:
-                source_docs.append(
-                    {
-                        "page_content": (
-                            doc.page_content[:200] + "..."
-                            if len(doc.page_content) > 200
-                            else doc.page_content
-                        ),
-                        "metadata": doc.metadata,
-                    }
-                )
+        response = await llm_service.aget_response(
+            request.query, vectorstore, index_name=index_name, **retrieval
+        )
+
+        with stage("response_formatting"):
+            source_docs = format_source_documents(response.get("source_documents", []))
+
+        answer = {"result": response["result"], "source_documents": source_docs}
+        if query_embedding is not None:
+            answer_cache.store(index_name, query_embedding, answer)
 
-        return ChatResponse(result=response["result"], source_documents=source_docs)
+        return ChatResponse(**answer, usage=response.get("usage"))
 
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")  # Add logging
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(
+    request: ChatRequest, current_user: User = Depends(get_current_user)
+):
+    """
+    Streaming chat endpoint (server-sent events).
+    Sends a "usage" event with the prompt token counts, "token" events as
+    the answer is generated, then a "sources" event with the source
+    documents and a final "done" event.
+    """
+    index_name = request.index_name or vector_service.get_current_index(current_user.id)
+    vectorstore = await run_in_threadpool(vector_service.get_vectorstore, index_name)
+    if vectorstore is None:
+        raise HTTPException(status_code=500, detail="Failed to load vector store")
+
+    retrieval = request.retrieval_settings()
+
+    async def event_stream():
+        try:
+            query_embedding = None
+            if answer_cache.enabled and not retrieval:
+                with stage("answer_cache_lookup"):
+                    query_embedding = await vector_service.aembed_query(request.query)
+                    cached = answer_cache.lookup(index_name, query_embedding)
+                if cached is not None:
+                    yield format_sse("token", {"text": cached["result"]})
+                    yield format_sse("sources", cached["source_documents"])
+                    yield format_sse("done", {})
+                    return
+
+            tokens = []
+            source_docs = []
+            async for kind, payload in llm_service.astream_response(
+                request.query, vectorstore, index_name=index_name, **retrieval
+            ):
+                if kind == "token":
+                    tokens.append(payload)
+                    yield format_sse("token", {"text": payload})
+                elif kind == "usage":
+                    yield format_sse("usage", payload)
+                else:
+                    with stage("response_formatting"):
+                        source_docs = format_source_documents(payload)
+                    yield format_sse("sources", source_docs)
+
+            if query_embedding is not None:
+                answer_cache.store(
+                    index_name,
+                    query_embedding,
+                    {"result": "".join(tokens), "source_documents": source_docs},
+                )
+            yield format_sse("done", {})
+
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {str(e)}")  # Add logging
+            yield format_sse("error", {"detail": f"Error processing query: {str(e)}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.post("/api/upload", response_model=UploadResponse)
 def upload_document(
     file: UploadFile = File(...), current_user: User = Depends(get_current_user)
 ):
     """
-    Upload and process a PDF document
+    Upload a PDF document and queue it for processing.
+    Poll /api/upload/jobs/{job_id} for progress.
     """
     try:
         # Check file type
@@ -250,26 +601,153 @@ def upload_document(
         # Read file content
         file_content = file.file.read()
 
-        # Process the document
-        result = document_processor.process_pdf_file(file_content, file.filename)
+        # Queue the document for background processing
+        job = ingestion_queue.enqueue(
+            file_content,
+            file.filename,
+            default_index_name(file.filename),
+            user_id=current_user.id,
+        )
 
-        if result["success"]:
-            return UploadResponse(
-                success=True, message=result["message"], details=result["details"]
-            )
-        else:
-            return UploadResponse(
-                success=False,
-                message="Failed to process document",
-                error=result["error"],
-            )
+        return UploadResponse(
+            success=True,
+            message=f"Queued {file.filename} for processing",
+            details={
+                "job_id": job["id"],
+                "status": job["status"],
+                "filename": job["filename"],
+                "index_name": job["index_name"],
+            },
+        )
 
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error uploading document: {str(e)}"
         )
 
 
+@app.post("/api/upload/bulk", response_model=BulkUploadResponse)
+def upload_documents_bulk(
+    files: List[UploadFile] = File(...),
+    index_name: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Upload many PDFs, or zip/tar archives of PDFs, in one request.
+    Each document is queued as its own ingestion job (into ``index_name``
+    if given); the response lists the job or rejection reason per file.
+    Queue room for every document is claimed up front, so an upload the
+    queue can't hold is refused as a whole (503) rather than in part.
+    """
+    if index_name is not None:
+        try:
+            validate_index_name(index_name)
+        except InvalidIndexName as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    reserved = min(_count_documents(files), BULK_UPLOAD_MAX_FILES)
+    try:
+        ingestion_queue.reserve(reserved)
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    def entries():
+        for file in files:
+            if is_archive(file.filename):
+                try:
+                    for path, content in iter_archive_pdfs(
+                        file.filename, file.file, MAX_UPLOAD_BYTES
+                    ):
+                        yield f"{file.filename}/{path}", content, None
+                except Exception as e:
+                    yield file.filename, None, f"Could not read archive: {str(e)}"
+            elif not file.filename.lower().endswith(".pdf"):
+                yield file.filename, None, "Only PDF files and zip/tar archives"
+            else:
+                yield file.filename, _read_upload(file), None
+
+    results = []
+    queued = 0
+    try:
+        for filename, content, error in entries():
+            if error is None and content is None:
+                error = "File size too large. Maximum 10MB allowed"
+            if error is None and queued >= reserved:
+                error = f"Too many files. Maximum {BULK_UPLOAD_MAX_FILES} per request"
+            if error is None:
+                try:
+                    job = ingestion_queue.enqueue(
+                        content,
+                        filename,
+                        index_name,
+                        user_id=current_user.id,
+                        reserved=True,
+                    )
+                    results.append(
+                        BulkUploadFileResult(
+                            filename=filename, status=job["status"], job_id=job["id"]
+                        )
+                    )
+                    queued += 1
+                    continue
+                except Exception as e:
+                    error = str(e)
+            results.append(
+                BulkUploadFileResult(filename=filename, status="rejected", error=error)
+            )
+    finally:
+        # Room claimed for documents that were rejected after all
+        ingestion_queue.release(reserved - queued)
+
+    return BulkUploadResponse(
+        success=queued > 0,
+        queued=queued,
+        rejected=len(results) - queued,
+        files=results,
+    )
+
+
+def _count_documents(files: List[UploadFile]) -> int:
+    """PDFs in a bulk upload, counting those inside archives"""
+    count = 0
+    for file in files:
+        if is_archive(file.filename):
+            try:
+                count += count_archive_pdfs(file.filename, file.file)
+            except Exception:
+                pass  # reported as unreadable when the upload is processed
+        elif file.filename.lower().endswith(".pdf"):
+            count += 1
+    return count
+
+
+def _read_upload(file: UploadFile) -> Optional[bytes]:
+    """Read an uploaded file, or None if it is larger than allowed"""
+    content = file.file.read(MAX_UPLOAD_BYTES + 1)
+    return None if len(content) > MAX_UPLOAD_BYTES else content
+
+
+@app.get("/api/upload/jobs/{job_id}", response_model=IngestionJobResponse)
+def get_upload_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Get the status and per-stage progress of a queued upload
+    """
+    job = ingestion_queue.get_job(job_id)
+    if job is None or job["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return IngestionJobResponse(
+        job_id=job["id"],
+        filename=job["filename"],
+        index_name=job["index_name"],
+        status=job["status"],
+        progress=job["progress"],
+        result=job["result"],
+        error=job["error"],
+    )
+
+
 @app.get("/api/indexes", response_model=IndexListResponse)
 def get_indexes(current_user: User = Depends(get_current_user)):
     """
@@ -290,11 +768,11 @@ def switch_index(
     request: SwitchIndexRequest, current_user: User = Depends(get_current_user)
 ):
     """
-    Switch to a different document index for chat
+    Switch the current user to a different document index for chat
     """
     try:
-        # Update the vector service to use the new index
-        vector_service.switch_index(request.index_name)
+        # Only this user's chats move to the new index
+        vector_service.switch_index(request.index_name, user_id=current_user.id)
         return {"success": True, "message": f"Switched to index: {request.index_name}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error switching index: {str(e)}")
@@ -0,0 +1,251 @@
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 = sqrt(rows)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+IVF_MIN_TRAIN_SIZE = int(os.environ.get("IVF_MIN_TRAIN_SIZE", "4096"))
+IVF_REBUILD_GROWTH = float(os.environ.get("IVF_REBUILD_GROWTH", "2.0"))
+IVF_TRAIN_SAMPLE = 50000
+IVF_TRAIN_ITERATIONS = 15
+ASSIGN_BATCH_SIZE = 65536
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=IVF_TRAIN_ITERATIONS, seed=0):
+    """k-means on unit vectors, using dot products as similarity"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = np.array(
+        vectors[rng.choice(len(vectors), n_clusters, replace=False)],
+        dtype=np.float32,
+    )
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty clusters with random points
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def assign_to_centroids(vectors, centroids):
+    """Index of the nearest centroid for every vector"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = np.asarray(vectors[start : start + ASSIGN_BATCH_SIZE])
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over a row matrix.
+
+    Rows are partitioned into ``nlist`` clusters by spherical k-means and
+    a search only scores rows in the ``nprobe`` clusters closest to the
+    query, trading recall for latency. New rows are assigned to their
+    nearest cluster as they are added; once the number of rows has grown by
+    ``rebuild_growth`` since training, the clusters are retrained in a
+    background thread and swapped in when ready.
+    """
+
+    FILE = "ivf.npz"
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        nlist=IVF_NLIST,
+        nprobe=IVF_NPROBE,
+        min_train_size=IVF_MIN_TRAIN_SIZE,
+        rebuild_growth=IVF_REBUILD_GROWTH,
+    ):
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.rebuild_growth = rebuild_growth
+        self.centroids = None
+        self.trained_rows = 0
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[np.ndarray] = []
+        self._lock = threading.Lock()
+        self._rebuild_thread = None
+        # Latest row matrix passed to sync, caught up after a rebuild
+        self._vectors = None
+        self._load()
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def _file(self):
+        return os.path.join(self.path, self.FILE) if self.path else None
+
+    def _load(self):
+        if self._file is None or not os.path.exists(self._file):
+            return
+        data = np.load(self._file)
+        self._install(data["centroids"], data["assignments"], int(data["trained_rows"]))
+
+    def save(self):
+        """Persist centroids and row assignments next to the vectors"""
+        if self._file is None or not self.is_trained:
+            return
+        with self._lock:
+            centroids, assignments = self.centroids, self._assignments
+            trained_rows = self.trained_rows
+        tmp = self._file + ".tmp.npz"
+        np.savez(
+            tmp,
+            centroids=centroids,
+            assignments=assignments,
+            trained_rows=trained_rows,
+        )
+        os.replace(tmp, self._file)
+
+    def _install(self, centroids, assignments, trained_rows):
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(
+            assignments[order], np.arange(len(centroids) + 1), side="left"
+        )
+        lists = [
+            order[bounds[i] : bounds[i + 1]].astype(np.int64)
+            for i in range(len(centroids))
+        ]
+        with self._lock:
+            self.centroids = centroids
+            self._assignments = assignments
+            self._lists = lists
+            self.trained_rows = trained_rows
+
+    def _n_clusters(self, rows):
+        return self.nlist or max(1, int(np.sqrt(rows)))
+
+    def train(self, vectors):
+        """(Re)build clusters and assignments for all rows of ``vectors``"""
+        rows = len(vectors)
+        rng = np.random.default_rng(0)
+        if rows > IVF_TRAIN_SAMPLE:
+            sample = np.asarray(vectors[np.sort(rng.choice(rows, IVF_TRAIN_SAMPLE))])
+        else:
+            sample = np.asarray(vectors)
+        centroids = spherical_kmeans(sample, self._n_clusters(rows))
+        self._install(centroids, assign_to_centroids(vectors, centroids), rows)
+        self.save()
+
+    def wait_for_rebuild(self):
+        """Block until a background rebuild (if any) has been swapped in"""
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join()
+
+    def settle(self, vectors):
+        """Finish any rebuild and assign every row of ``vectors``"""
+        self.wait_for_rebuild()
+        self.catch_up(vectors)
+
+    def remap(self, kept_rows):
+        """Renumber rows after compaction kept only ``kept_rows``"""
+        if not self.is_trained:
+            return
+        self.wait_for_rebuild()
+        with self._lock:
+            if len(kept_rows) and kept_rows[-1] >= len(self._assignments):
+                # Rows were never assigned (settle wasn't called first); the
+                # next sync retrains rather than leave them unsearchable
+                self.centroids = None
+                return
+            assignments = self._assignments[kept_rows]
+            centroids = self.centroids
+        self._install(centroids, assignments, len(assignments))
+        self.save()
+
+    def sync(self, vectors):
+        """
+        Bring the index up to date with a row matrix: train once it is large
+        enough, assign rows added since the last call and schedule a
+        background rebuild after enough growth
+        """
+        rows = len(vectors)
+        self._vectors = vectors
+        if self.is_trained and len(self._assignments) > rows:
+            # Rows were dropped from disk after the assignments were saved
+            with self._lock:
+                self.centroids = None
+        if not self.is_trained:
+            if rows >= max(1, self.min_train_size):
+                self.train(vectors)
+            return
+        self.catch_up(vectors)
+        if rows >= self.trained_rows * self.rebuild_growth:
+            self.rebuild_in_background(vectors)
+
+    def catch_up(self, vectors):
+        """Assign any rows that were added since the last assignment"""
+        while True:
+            with self._lock:
+                centroids, start_row = self.centroids, len(self._assignments)
+            if centroids is None or len(vectors) <= start_row:
+                return
+            new = assign_to_centroids(vectors[start_row:], centroids)
+            with self._lock:
+                if self.centroids is not centroids or (
+                    len(self._assignments) != start_row
+                ):
+                    # A rebuild swapped in or another caller assigned rows
+                    # meanwhile; assign whatever is still missing
+                    continue
+                self._assignments = np.concatenate([self._assignments, new])
+                for cluster in np.unique(new):
+                    rows = start_row + np.flatnonzero(new == cluster)
+                    self._lists[cluster] = np.concatenate([self._lists[cluster], rows])
+                return
+
+    def rebuild_in_background(self, vectors):
+        """Retrain clusters on a background thread and swap them in when done"""
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+
+        def rebuild():
+            try:
+                self.train(vectors)
+                # Rows added while training only exist in the newer matrix
+                self.catch_up(self._vectors)
+            except Exception as e:
+                print(f"Error rebuilding IVF index: {str(e)}")
+
+        self._rebuild_thread = threading.Thread(
+            target=rebuild, name="ivf-rebuild", daemon=True
+        )
+        self._rebuild_thread.start()
+
+    def candidates(self, query, nprobe=None) -> np.ndarray:
+        """Rows in the clusters closest to the query"""
+        with self._lock:
+            centroids, lists = self.centroids, self._lists
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([lists[cluster] for cluster in probes])
+
+    def get_stats(self):
+        """Cluster layout for monitoring"""
+        with self._lock:
+            sizes = [len(rows) for rows in self._lists]
+        return {
+            "trained": self.is_trained,
+            "trained_rows": self.trained_rows,
+            "nlist": len(sizes),
+            "nprobe": self.nprobe,
+            "largest_list": max(sizes) if sizes else 0,
+            "rebuilding": self._rebuild_thread is not None
+            and self._rebuild_thread.is_alive(),
+        }
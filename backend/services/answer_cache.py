@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+# Answers kept across all indexes (indexes are created per upload or user)
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+
+
+class _IndexAnswers:
+    """Cached answers for one index, with their unit-length query embeddings"""
+
+    def __init__(self):
+        self.vectors = []
+        self.answers = []
+        self.stored_at = []
+        self.matrix = None  # stacked vectors, rebuilt lazily after changes
+
+    def get_matrix(self):
+        if self.matrix is None:
+            self.matrix = np.vstack(self.vectors)
+        return self.matrix
+
+    def remove(self, position):
+        del self.vectors[position]
+        del self.answers[position]
+        del self.stored_at[position]
+        self.matrix = None
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache for /api/chat keyed by index and query similarity.
+
+    A cached answer is served when the cosine similarity between the new
+    query's embedding and a cached query's embedding for the same index is
+    at least ``threshold``. Entries for an index are dropped whenever new
+    chunks are written to it. At most ``max_entries`` answers are kept over
+    all indexes; beyond that the least recently used index loses its oldest
+    answers first.
+    """
+
+    def __init__(
+        self,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        enabled=ANSWER_CACHE_ENABLED,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._indexes = OrderedDict()  # index name -> _IndexAnswers, LRU
+        self._size = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, index_name, entries, position):
+        """Drop one answer, and the index's entry once it has none left"""
+        entries.remove(position)
+        self._size -= 1
+        if not entries.vectors:
+            del self._indexes[index_name]
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def lookup(self, index_name: str, query_embedding) -> Optional[dict]:
+        """Get a cached answer for a near-duplicate query, or None"""
+        if not self.enabled:
+            return None
+        query = self._normalize(query_embedding)
+        with self._lock:
+            entries = self._indexes.get(index_name)
+            if entries is not None:
+                self._indexes.move_to_end(index_name)
+                scores = entries.get_matrix() @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    if not self._expired(entries.stored_at[best]):
+                        self._hits += 1
+                        return entries.answers[best]
+                    self._remove(index_name, entries, best)
+            self._misses += 1
+            return None
+
+    def store(self, index_name: str, query_embedding, answer: dict):
+        """Cache the answer to a query against an index"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entries = self._indexes.setdefault(index_name, _IndexAnswers())
+            self._indexes.move_to_end(index_name)
+            entries.vectors.append(self._normalize(query_embedding))
+            entries.answers.append(answer)
+            entries.stored_at.append(time.time())
+            entries.matrix = None
+            self._size += 1
+            while self._size > self.max_entries:
+                oldest_name, oldest = next(iter(self._indexes.items()))
+                self._remove(oldest_name, oldest, 0)
+
+    def invalidate(self, index_name: str):
+        """Drop every cached answer for an index"""
+        with self._lock:
+            entries = self._indexes.pop(index_name, None)
+            if entries is not None:
+                self._size -= len(entries.vectors)
+                self._invalidations += 1
+
+    def get_stats(self):
+        """Hit/miss counters and cache size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "entries": self._size,
+                "indexes": len(self._indexes),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Get the shared answer cache for this process"""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache()
+    return _answer_cache
@@ -1,9 +1,13 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from models import User
+from services import password_hashing
 import os
 
 # Configuration
@@ -11,8 +15,102 @@ SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated users are cached per token for this long; 0 disables
+AUTH_PRINCIPAL_TTL_SECONDS = float(os.environ.get("AUTH_PRINCIPAL_TTL_SECONDS", "60"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+class PrincipalCache:
+    """
+    Short-lived cache of the user behind each access token, so
+    authenticated requests skip the user lookup.
+
+    Entries expire after ``ttl_seconds`` or when their token does, whichever
+    is first, and are dropped when the user is deactivated. Cached users
+    are detached copies without the password hash. The cache is per
+    process, so other workers see a deactivation within ``ttl_seconds``.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = AUTH_PRINCIPAL_TTL_SECONDS,
+        max_entries: int = AUTH_PRINCIPAL_CACHE_SIZE,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # token hash -> (user, expires_at), LRU
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _key(self, token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        """The cached user for a token, if still fresh"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, token: str, user: User, token_expires_at: Optional[float] = None):
+        """Cache the user a token resolved to"""
+        if self.ttl_seconds <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        principal = User(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+            created_at=user.created_at,
+        )
+        with self._lock:
+            self._entries[self._key(token)] = (principal, expires_at)
+            self._entries.move_to_end(self._key(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached token of a user"""
+        with self._lock:
+            for key in [
+                k for k, (user, _) in self._entries.items() if user.id == user_id
+            ]:
+                del self._entries[key]
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+_principal_cache: Optional[PrincipalCache] = None
+_principal_cache_lock = threading.Lock()
+
+
+def get_principal_cache() -> PrincipalCache:
+    """Get the process-wide principal cache"""
+    global _principal_cache
+    if _principal_cache is None:
+        with _principal_cache_lock:
+            if _principal_cache is None:
+                _principal_cache = PrincipalCache()
+    return _principal_cache
 
 
 class AuthService:
@@ -21,12 +119,12 @@ class AuthService:
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+        return password_hashing.verify_password(plain_password, hashed_password)
 
     @staticmethod
     def get_password_hash(password: str) -> str:
         """Hash a password"""
-        return pwd_context.hash(password)
+        return password_hashing.hash_password(password)
 
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -41,16 +139,21 @@ class AuthService:
         return encoded_jwt
 
     @staticmethod
-    def verify_token(token: str) -> Optional[str]:
-        """Verify and decode a JWT token"""
+    def decode_token(token: str) -> Optional[dict]:
+        """Verify a JWT token and return its claims"""
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
-                return None
-            return username
         except JWTError:
             return None
+        if payload.get("sub") is None:
+            return None
+        return payload
+
+    @staticmethod
+    def verify_token(token: str) -> Optional[str]:
+        """Verify and decode a JWT token"""
+        payload = AuthService.decode_token(token)
+        return None if payload is None else payload["sub"]
 
     @staticmethod
     def get_user_by_email(db: Session, email: str) -> Optional[User]:
@@ -66,12 +169,36 @@ class AuthService:
     def create_user(db: Session, username: str, email: str, password: str) -> User:
         """Create a new user"""
         hashed_password = AuthService.get_password_hash(password)
+        return AuthService._insert_user(db, username, email, hashed_password)
+
+    @staticmethod
+    async def acreate_user(db, username: str, email: str, password: str) -> User:
+        """
+        Create a new user without blocking the event loop; ``db`` is a
+        database.SessionRunner
+        """
+        hashed_password = await password_hashing.ahash_password(password)
+        return await db.run(AuthService._insert_user, username, email, hashed_password)
+
+    @staticmethod
+    def _insert_user(db: Session, username, email, hashed_password) -> User:
         db_user = User(username=username, email=email, hashed_password=hashed_password)
         db.add(db_user)
         db.commit()
         db.refresh(db_user)
         return db_user
 
+    @staticmethod
+    def deactivate_user(db: Session, user_id: int) -> Optional[User]:
+        """Deactivate a user and drop their cached sessions"""
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        user.is_active = False
+        db.commit()
+        get_principal_cache().invalidate_user(user_id)
+        return user
+
     @staticmethod
     def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
         """Authenticate a user with email and password"""
@@ -81,3 +208,16 @@ class AuthService:
         if not AuthService.verify_password(password, user.hashed_password):
             return None
         return user
+
+    @staticmethod
+    async def aauthenticate_user(db, email: str, password: str) -> Optional[User]:
+        """
+        Authenticate a user without blocking the event loop; ``db`` is a
+        database.SessionRunner
+        """
+        user = await db.run(AuthService.get_user_by_email, email)
+        if not user:
+            return None
+        if not await password_hashing.averify_password(password, user.hashed_password):
+            return None
+        return user
@@ -0,0 +1,300 @@
+import fcntl
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+CHUNK_EMBEDDING_STORE_DIR = os.environ.get(
+    "CHUNK_EMBEDDING_STORE_DIR", "./ingestion_data/chunk_embeddings"
+)
+# Compact once this share of the row file is dead rows (0 = never)...
+CHUNK_EMBEDDING_COMPACT_RATIO = float(
+    os.environ.get("CHUNK_EMBEDDING_COMPACT_RATIO", "0.3")
+)
+# ...and at least this many, so small stores aren't rewritten after every job
+CHUNK_EMBEDDING_COMPACT_MIN_ROWS = int(
+    os.environ.get("CHUNK_EMBEDDING_COMPACT_MIN_ROWS", "1000")
+)
+# SQLite's default limit on bound parameters is 999
+QUERY_BATCH_SIZE = 500
+
+
+class ChunkEmbeddingStore:
+    """
+    Disk-backed store of document chunk embeddings for one embedding model,
+    keyed by chunk content hash.
+
+    Vectors are appended to a float32 row file that readers memory-map, and
+    a SQLite table maps each hash to its row. Appends take an exclusive
+    ``flock`` so ingestion workers in several processes can share a store.
+    ``compact()`` rewrites the row file without dropped or orphaned rows
+    under a new generation number; readers notice the new generation and
+    remap, while their old mapping stays valid until then.
+    ``compact_if_needed()`` does so once ``compact_ratio`` of the rows (and
+    at least ``compact_min_rows``) are dead.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        base_dir: str = CHUNK_EMBEDDING_STORE_DIR,
+        compact_ratio: float = CHUNK_EMBEDDING_COMPACT_RATIO,
+        compact_min_rows: int = CHUNK_EMBEDDING_COMPACT_MIN_ROWS,
+    ):
+        self.model_name = model_name
+        self.path = os.path.join(base_dir, model_name.replace("/", "__"))
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self._conn = None
+        self._lock = threading.Lock()
+        self._mapped_generation = None
+        self._vectors = None
+
+    @property
+    def _db(self):
+        """Key table connection, opened on first use; call with the lock held"""
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.path, "keys.db"), check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(hash TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _meta(self, key):
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _rows_file(self, generation):
+        return os.path.join(self.path, f"embeddings.{generation}.f32")
+
+    @contextmanager
+    def _exclusive(self):
+        """Cross-process write lock (appends and compaction)"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "write.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _mapped(self, generation, dimension, rows_needed):
+        """Memory map of the row file, reopened after compaction or growth"""
+        if (
+            self._mapped_generation != generation
+            or self._vectors is None
+            or len(self._vectors) < rows_needed
+        ):
+            path = self._rows_file(generation)
+            rows = os.path.getsize(path) // (dimension * 4)
+            self._vectors = np.memmap(
+                path, dtype=np.float32, mode="r", shape=(rows, dimension)
+            )
+            self._mapped_generation = generation
+        return self._vectors
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings for whichever of ``hashes`` are present"""
+        hashes = list(set(hashes))
+        if not hashes:
+            return {}
+        with self._lock:
+            db = self._db
+            for _ in range(2):
+                # Read the generation and rows from one snapshot, so rows are
+                # never looked up in the file of a different generation
+                db.execute("BEGIN")
+                try:
+                    generation = self._meta("generation")
+                    dimension = self._meta("dimension")
+                    found = []
+                    for start in range(0, len(hashes), QUERY_BATCH_SIZE):
+                        batch = hashes[start : start + QUERY_BATCH_SIZE]
+                        found += db.execute(
+                            "SELECT hash, row FROM embeddings "
+                            f"WHERE hash IN ({', '.join('?' * len(batch))})",
+                            batch,
+                        ).fetchall()
+                finally:
+                    db.commit()
+                if not found:
+                    return {}
+                try:
+                    vectors = self._mapped(
+                        generation, dimension, max(row for _, row in found) + 1
+                    )
+                except FileNotFoundError:
+                    continue  # compacted since the snapshot; read again
+                return {hash_: np.array(vectors[row]) for hash_, row in found}
+            return {}
+
+    def put_many(self, embeddings: Dict[str, Iterable[float]]):
+        """Append embeddings for hashes not already stored"""
+        if not embeddings:
+            return
+        with self._lock, self._exclusive():
+            db = self._db
+            hashes = list(embeddings)
+            stored = set()
+            for start in range(0, len(hashes), QUERY_BATCH_SIZE):
+                batch = hashes[start : start + QUERY_BATCH_SIZE]
+                stored.update(
+                    row[0]
+                    for row in db.execute(
+                        "SELECT hash FROM embeddings "
+                        f"WHERE hash IN ({', '.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+            new = [hash_ for hash_ in hashes if hash_ not in stored]
+            if not new:
+                return
+            vectors = np.asarray([embeddings[hash_] for hash_ in new], dtype=np.float32)
+
+            generation = self._meta("generation")
+            if generation is None:
+                generation = 0
+                with db:
+                    db.executemany(
+                        "INSERT INTO meta (key, value) VALUES (?, ?)",
+                        [("generation", 0), ("dimension", vectors.shape[1])],
+                    )
+            elif vectors.shape[1] != self._meta("dimension"):
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match "
+                    f"the store ({self._meta('dimension')})"
+                )
+
+            # Rows land before their keys, so a crash leaves only orphan rows
+            path = self._rows_file(generation)
+            row_bytes = vectors.shape[1] * 4
+            with open(path, "ab") as f:
+                size = f.tell()
+                if size % row_bytes:
+                    f.truncate(size - size % row_bytes)  # torn write from a crash
+                    f.seek(0, os.SEEK_END)
+                first_row = f.tell() // row_bytes
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with db:
+                db.executemany(
+                    "INSERT INTO embeddings (hash, row) VALUES (?, ?)",
+                    [(hash_, first_row + i) for i, hash_ in enumerate(new)],
+                )
+
+    def discard(self, hashes: Iterable[str]):
+        """Drop stored embeddings; their rows are reclaimed by compaction"""
+        hashes = list(set(hashes))
+        if not hashes:
+            return
+        with self._lock, self._exclusive():
+            with self._db as db:
+                for start in range(0, len(hashes), QUERY_BATCH_SIZE):
+                    batch = hashes[start : start + QUERY_BATCH_SIZE]
+                    db.execute(
+                        "DELETE FROM embeddings "
+                        f"WHERE hash IN ({', '.join('?' * len(batch))})",
+                        batch,
+                    )
+
+    def compact_if_needed(self):
+        """Compact once enough rows are dead; returns the rows removed"""
+        if self.compact_ratio <= 0:
+            return 0
+        stats = self.get_stats()
+        with self._lock:
+            dimension = self._meta("dimension") if stats["bytes"] else None
+        rows = stats["bytes"] // (dimension * 4) if dimension else 0
+        dead = rows - stats["embeddings"]
+        if dead < max(1, self.compact_min_rows) or dead < self.compact_ratio * rows:
+            return 0
+        return self.compact()
+
+    def compact(self, keep: Optional[Iterable[str]] = None):
+        """
+        Rewrite the row file with only the rows still referenced, optionally
+        also dropping every hash not in ``keep``; returns the rows removed
+        """
+        with self._lock, self._exclusive():
+            db = self._db
+            generation = self._meta("generation")
+            if generation is None:
+                return 0
+            dimension = self._meta("dimension")
+            entries = db.execute(
+                "SELECT hash, row FROM embeddings ORDER BY row"
+            ).fetchall()
+            if keep is not None:
+                keep = set(keep)
+                entries = [entry for entry in entries if entry[0] in keep]
+
+            old_path = self._rows_file(generation)
+            old_rows = os.path.getsize(old_path) // (dimension * 4)
+            old = np.memmap(
+                old_path, dtype=np.float32, mode="r", shape=(old_rows, dimension)
+            )
+            new_path = self._rows_file(generation + 1)
+            with open(new_path, "wb") as f:
+                for start in range(0, len(entries), 65536):
+                    rows = [row for _, row in entries[start : start + 65536]]
+                    f.write(np.ascontiguousarray(old[rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            del old
+
+            with db:
+                db.execute("DELETE FROM embeddings")
+                db.executemany(
+                    "INSERT INTO embeddings (hash, row) VALUES (?, ?)",
+                    [(hash_, i) for i, (hash_, _) in enumerate(entries)],
+                )
+                db.execute(
+                    "UPDATE meta SET value = ? WHERE key = 'generation'",
+                    (generation + 1,),
+                )
+            # Readers still mapping the old file keep their pages until they remap
+            os.unlink(old_path)
+            return old_rows - len(entries)
+
+    def get_stats(self):
+        """Number of stored embeddings and size of the row file"""
+        with self._lock:
+            if self._conn is None and not os.path.exists(self.path):
+                return {"embeddings": 0, "bytes": 0}
+            count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            generation = self._meta("generation")
+        path = self._rows_file(generation) if generation is not None else None
+        return {
+            "embeddings": count,
+            "bytes": os.path.getsize(path) if path and os.path.exists(path) else 0,
+        }
+
+
+_stores: Dict[str, ChunkEmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_chunk_embedding_store(model_name: str) -> ChunkEmbeddingStore:
+    """Get the process-wide chunk embedding store for a model"""
+    with _stores_lock:
+        store = _stores.get(model_name)
+        if store is None:
+            store = ChunkEmbeddingStore(model_name)
+            _stores[model_name] = store
+        return store
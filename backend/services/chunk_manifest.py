@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Set
+
+CHUNK_MANIFEST_PATH = os.environ.get(
+    "CHUNK_MANIFEST_PATH", "./ingestion_data/chunk_manifest.db"
+)
+# SQLite's default limit on bound parameters is 999
+QUERY_BATCH_SIZE = 500
+
+
+def chunk_hash(text: str) -> str:
+    """Content address of a chunk: sha256 of its whitespace-normalized text"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class ChunkManifest:
+    """
+    Record of which chunks (by content hash) each document contributed to
+    an index.
+
+    Chunks are stored under their content hash as vector id, so a chunk
+    already in the index never needs embedding or upserting again, and a
+    chunk is only deleted once no document in the index still contains it.
+    Indexes are namespaced by vector backend, so switching backends
+    re-ingests everything.
+    """
+
+    def __init__(self, path: str = CHUNK_MANIFEST_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def _db(self):
+        """Manifest connection, opened on first use; call with the lock held"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "namespace TEXT NOT NULL, index_name TEXT NOT NULL, "
+                "source TEXT NOT NULL, hash TEXT NOT NULL, "
+                "PRIMARY KEY (namespace, index_name, source, hash))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS chunks_by_hash "
+                "ON chunks (namespace, index_name, hash)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def existing(self, namespace, index_name, hashes: Iterable[str]) -> Set[str]:
+        """The subset of ``hashes`` already stored in the index"""
+        hashes = list(set(hashes))
+        found = set()
+        with self._lock:
+            for start in range(0, len(hashes), QUERY_BATCH_SIZE):
+                batch = hashes[start : start + QUERY_BATCH_SIZE]
+                rows = self._db.execute(
+                    "SELECT DISTINCT hash FROM chunks "
+                    "WHERE namespace = ? AND index_name = ? "
+                    f"AND hash IN ({', '.join('?' * len(batch))})",
+                    (namespace, index_name, *batch),
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def add(self, namespace, index_name, source, hashes: Iterable[str]):
+        """Record that a document references chunks now stored in the index"""
+        with self._lock, self._db as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (namespace, index_name, source, hash) "
+                "VALUES (?, ?, ?, ?)",
+                [(namespace, index_name, source, hash_) for hash_ in set(hashes)],
+            )
+
+    def replace_document(
+        self, namespace, index_name, source, hashes: Iterable[str]
+    ) -> List[str]:
+        """
+        Record the full set of chunks a document now has in the index and
+        return the hashes of chunks no document in the index references any
+        more
+        """
+        hashes = set(hashes)
+        with self._lock, self._db as conn:
+            previous = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT hash FROM chunks "
+                    "WHERE namespace = ? AND index_name = ? AND source = ?",
+                    (namespace, index_name, source),
+                )
+            }
+            removed = previous - hashes
+            conn.executemany(
+                "DELETE FROM chunks WHERE namespace = ? AND index_name = ? "
+                "AND source = ? AND hash = ?",
+                [(namespace, index_name, source, hash_) for hash_ in removed],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (namespace, index_name, source, hash) "
+                "VALUES (?, ?, ?, ?)",
+                [(namespace, index_name, source, hash_) for hash_ in hashes - previous],
+            )
+            orphaned = [
+                hash_
+                for hash_ in removed
+                if conn.execute(
+                    "SELECT 1 FROM chunks WHERE namespace = ? AND index_name = ? "
+                    "AND hash = ? LIMIT 1",
+                    (namespace, index_name, hash_),
+                ).fetchone()
+                is None
+            ]
+        return orphaned
+
+    def unreferenced(self, hashes: Iterable[str]) -> List[str]:
+        """The subset of ``hashes`` that no index (in any namespace) references"""
+        hashes = list(set(hashes))
+        referenced = set()
+        with self._lock:
+            for start in range(0, len(hashes), QUERY_BATCH_SIZE):
+                batch = hashes[start : start + QUERY_BATCH_SIZE]
+                rows = self._db.execute(
+                    "SELECT DISTINCT hash FROM chunks "
+                    f"WHERE hash IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                referenced.update(row[0] for row in rows)
+        return [hash_ for hash_ in hashes if hash_ not in referenced]
+
+
+_manifest: Optional[ChunkManifest] = None
+_manifest_lock = threading.Lock()
+
+
+def get_chunk_manifest() -> ChunkManifest:
+    """Get the process-wide chunk manifest"""
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = ChunkManifest()
+    return _manifest
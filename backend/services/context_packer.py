@@ -0,0 +1,174 @@
+import asyncio
+import os
+import re
+import threading
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from services.metrics import stage
+
+CONTEXT_PACKING = os.environ.get("CONTEXT_PACKING", "true").lower() == "true"
+# Prompt tokens available for retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+# Chunks retrieved as packing candidates
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", "8"))
+# Word-shingle overlap above which a lower-ranked chunk is a duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(
+    os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8")
+)
+# Shortest overlap between adjacent chunks of a page that gets merged
+MIN_MERGE_OVERLAP = 20
+# Separator the "stuff" chain puts between documents
+DOCUMENT_SEPARATOR = "\n\n"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count of a text with the cl100k encoding (close to the Llama
+    tokenizer for English), or about 4 characters per token without tiktoken
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _shingles(text: str, size: int = 3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of ``first`` that starts ``second``"""
+    for length in range(min(len(first), len(second)), MIN_MERGE_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+class ContextPacker:
+    """
+    Assembles retrieved chunks into the LLM context under a token budget.
+
+    Chunks arrive best first. A chunk mostly made of the same word
+    shingles as a better one is dropped; the rest are taken in rank order
+    while they fit the budget. Chunks from the same page that overlap (the
+    splitter repeats the end of each chunk at the start of the next) are
+    merged into one passage without the repeated text. Passages are
+    ordered by their best chunk's rank.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+
+    def _is_duplicate(self, shingles, kept) -> bool:
+        for other in kept:
+            smaller = min(len(shingles), len(other)) or 1
+            if len(shingles & other) / smaller >= self.duplicate_threshold:
+                return True
+        return False
+
+    def _merge(self, documents: List[Document]) -> List[Document]:
+        """Merge overlapping chunks of the same page, keeping rank order"""
+        passages = []  # [page key, text, first chunk, merged]
+        for document in documents:
+            key = (document.metadata.get("source"), document.metadata.get("page"))
+            for passage in passages:
+                if passage[0] != key or key == (None, None):
+                    continue
+                overlap = _overlap(passage[1], document.page_content)
+                if overlap:
+                    passage[1] += document.page_content[overlap:]
+                    passage[3] = True
+                    break
+                overlap = _overlap(document.page_content, passage[1])
+                if overlap:
+                    passage[1] = document.page_content + passage[1][overlap:]
+                    passage[3] = True
+                    break
+            else:
+                passages.append([key, document.page_content, document, False])
+        return [
+            (
+                Document(page_content=text, metadata=dict(first.metadata))
+                if merged
+                else first
+            )
+            for _, text, first, merged in passages
+        ]
+
+    def _tokens(self, passages: List[Document]) -> int:
+        return count_tokens(DOCUMENT_SEPARATOR.join(p.page_content for p in passages))
+
+    def pack(self, documents: List[Document]) -> List[Document]:
+        """Context passages for ranked chunks, within the token budget"""
+        selected, kept_shingles, passages = [], [], []
+        for document in documents:
+            shingles = _shingles(document.page_content)
+            if self._is_duplicate(shingles, kept_shingles):
+                continue
+            candidate = self._merge(selected + [document])
+            # The best chunk is always used, even when it alone is too long
+            if selected and self._tokens(candidate) > self.token_budget:
+                continue
+            selected.append(document)
+            kept_shingles.append(shingles)
+            passages = candidate
+        return passages
+
+
+class PackingRetriever(BaseRetriever):
+    """Retrieves candidate chunks and returns them packed by a ContextPacker"""
+
+    retriever: Any
+    packer: Any
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        documents = self.retriever.invoke(query)
+        with stage("context_packing"):
+            return self.packer.pack(documents)
+
+    async def _aget_relevant_documents(self, query: str, **kwargs: Any):
+        documents = await self.retriever.ainvoke(query)
+        with stage("context_packing"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.packer.pack, documents
+            )
+
+
+_packer: Optional[ContextPacker] = None
+_packer_lock = threading.Lock()
+
+
+def get_context_packer() -> ContextPacker:
+    """Get the process-wide context packer"""
+    global _packer
+    if _packer is None:
+        with _packer_lock:
+            if _packer is None:
+                _packer = ContextPacker()
+    return _packer
@@ -1,54 +1,74 @@
 import os
-import tempfile
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone, ServerlessSpec
 import hashlib
+import itertools
+import threading
 import time
 
+from services.answer_cache import get_answer_cache
+from services.chunk_embedding_store import get_chunk_embedding_store
+from services.chunk_manifest import chunk_hash, get_chunk_manifest
+from services.embedding_service import get_embedding_engine
+from services.lexical_index import get_lexical_index
+from services.metrics import INGESTED_CHUNKS, INGESTED_PAGES, observe_stage, stage
+from services.pdf_parser import iter_pdf_pages, prefetch
+from services.upsert_writer import UpsertWriter
+from services.vector_backends import get_vector_backend
+
+# Chunks embedded and upserted per step of an upload
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+# Parsed pages buffered ahead of the embedding step
+INGEST_PREFETCH_PAGES = int(os.environ.get("INGEST_PREFETCH_PAGES", "32"))
+
+
+def default_index_name(filename):
+    """Index a document goes into when no index name is given"""
+    # Create a hash of filename for unique index name
+    file_hash = hashlib.md5(filename.encode()).hexdigest()[:8]
+    return f"user-docs-{file_hash}"
+
 
 class DocumentProcessor:
     """
     Service to process uploaded PDF documents and add them to vector store
     """
 
-    def __init__(self):
+    def __init__(
+        self, backend=None, manifest=None, embedding_store=None, lexical_indexes=None
+    ):
         self.embedding_model = None
+        self.embedding_store = embedding_store
+        self.backend = backend or get_vector_backend()
+        self.manifest = manifest or get_chunk_manifest()
+        # index name -> BM25 index kept alongside the vector index
+        self.lexical_indexes = lexical_indexes or (
+            lambda index_name: get_lexical_index(index_name, self.backend.name)
+        )
+        # Per-index locks making "is this chunk stored? then reference it"
+        # atomic with "drop unreferenced chunks", so concurrent uploads into
+        # one index never skip a chunk another upload is deleting
+        self._index_locks = {}
 
     def _get_embedding_model(self):
-        """Get the embedding model (cached for performance)"""
+        """Get the process-wide shared embedding engine"""
         if self.embedding_model is None:
-            self.embedding_model = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
+            self.embedding_model = get_embedding_engine()
         return self.embedding_model
 
-    def _create_or_get_index(self, index_name):
-        """Create or get existing Pinecone index"""
-        try:
-            pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-
-            # Check if index exists
-            if not pc.has_index(index_name):
-                print(f"Creating new index: {index_name}")
-                pc.create_index(
-                    name=index_name,
-                    dimension=384,  # dimension for all-MiniLM-L6-v2
-                    metric="cosine",
-                    spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-                )
-                # Wait for index creation
-                time.sleep(30)
+    def _get_embedding_store(self):
+        """Get the on-disk chunk embedding store for the embedding model"""
+        if self.embedding_store is None:
+            model_name = self._get_embedding_model().model_name
+            self.embedding_store = get_chunk_embedding_store(model_name)
+        return self.embedding_store
 
-            return True
-        except Exception as e:
-            print(f"Error creating/accessing index: {str(e)}")
-            return False
+    def _create_or_get_index(self, index_name):
+        """Create or get existing vector store index"""
+        return self.backend.ensure_index(index_name)
 
-    def process_pdf_file(self, file_content, filename, user_index_name=None):
+    def process_pdf_file(
+        self, file_content, filename, user_index_name=None, progress_callback=None
+    ):
         """
         Process uploaded PDF file and add to vector store
 
@@ -56,81 +76,218 @@ class DocumentProcessor:
             file_content: Binary content of the PDF file
             filename: Name of the uploaded file
             user_index_name: Optional custom index name for user's documents
+            progress_callback: Optional callable receiving progress updates as
+                keyword arguments (stage, parsed_pages, text_chunks,
+                chunks_unchanged, chunks_cached, chunks_embedded, vectors_upserted,
+                chunks_removed) after every batch
 
         Returns:
             dict: Processing result with success status and details
         """
+        report = progress_callback or (lambda **progress: None)
         try:
-            # Create a temporary file to save the uploaded content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-
-            try:
-                # Load PDF document
-                loader = PyPDFLoader(temp_file_path)
-                documents = loader.load()
-
-                if not documents:
-                    return {"success": False, "error": "No content found in PDF file"}
-
-                # Add filename metadata to all documents
-                for doc in documents:
-                    doc.metadata["source"] = filename
-                    doc.metadata["upload_timestamp"] = time.time()
-
-                # Create text chunks
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=500, chunk_overlap=50
-                )
-                text_chunks = text_splitter.split_documents(documents)
-
-                # Generate index name based on filename if not provided
-                if user_index_name is None:
-                    # Create a hash of filename for unique index name
-                    file_hash = hashlib.md5(filename.encode()).hexdigest()[:8]
-                    index_name = f"user-docs-{file_hash}"
-                else:
-                    index_name = user_index_name
-
-                # Create or get the index
-                if not self._create_or_get_index(index_name):
-                    return {
-                        "success": False,
-                        "error": "Failed to create/access vector store index",
-                    }
-
-                # Add documents to vector store
-                embedding_model = self._get_embedding_model()
-                PineconeVectorStore.from_documents(
-                    documents=text_chunks,
-                    index_name=index_name,
-                    embedding=embedding_model,
-                )
+            # Generate index name based on filename if not provided
+            if user_index_name is None:
+                index_name = default_index_name(filename)
+            else:
+                index_name = user_index_name
+
+            with stage("ingest_document"):
+                return self._ingest(file_content, filename, index_name, report)
+
+        except Exception as e:
+            return {"success": False, "error": f"Error processing PDF: {str(e)}"}
+
+    def _ingest(self, file_content, filename, index_name, report):
+        """
+        Parse, chunk, embed and upsert a document. Chunks are stored under
+        their content hash, so chunks already in the index are skipped and
+        chunks the previous version of the document had are deleted.
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        # Pages are parsed straight from memory (on the process pool for
+        # large documents) and chunked one at a time on a background
+        # thread, while this thread embeds full batches and hands them to
+        # a pipelined upsert writer
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        upload_timestamp = time.time()
+        counts = {"parsed_pages": 0, "text_chunks": 0}
 
+        def iter_chunks():
+            started = time.perf_counter()
+            for page in iter_pdf_pages(file_content, filename):
+                page.metadata["upload_timestamp"] = upload_timestamp
+                counts["parsed_pages"] += 1
+                chunks = text_splitter.split_documents([page])
+                counts["text_chunks"] += len(chunks)
+                # Parsing and splitting, excluding waits on a full buffer
+                observe_stage("ingest_parse", time.perf_counter() - started)
+                INGESTED_PAGES.inc()
+                yield [(chunk_hash(chunk.page_content), chunk) for chunk in chunks]
+                started = time.perf_counter()
+
+        pages = prefetch(iter_chunks(), max_buffered=INGEST_PREFETCH_PAGES)
+        try:
+            first = next(pages, None)
+            if first is None:
+                return {"success": False, "error": "No content found in PDF file"}
+
+            # Create or get the index
+            if not self._create_or_get_index(index_name):
                 return {
-                    "success": True,
-                    "message": f"Successfully processed {filename}",
-                    "details": {
-                        "filename": filename,
-                        "total_pages": len(documents),
-                        "text_chunks": len(text_chunks),
-                        "index_name": index_name,
-                    },
+                    "success": False,
+                    "error": "Failed to create/access vector store index",
                 }
 
-            finally:
-                # Clean up temporary file
-                os.unlink(temp_file_path)
+            # Embed and add new chunks to vector store batch by batch
+            embedding_model = self._get_embedding_model()
+            embedding_store = self._get_embedding_store()
+            namespace = self.backend.name
+            lexical_index = self.lexical_indexes(index_name)
+            index_lock = self._index_locks.setdefault(index_name, threading.Lock())
+            progress = {
+                "chunks_unchanged": 0,
+                "chunks_cached": 0,
+                "chunks_embedded": 0,
+                "vectors_upserted": 0,
+            }
+
+            progress_lock = threading.Lock()
+            # New chunks waiting for their vectors, by hash
+            pending = {}
+
+            def index_terms(items):
+                if not items:
+                    return
+                hashes, chunks = zip(*items)
+                lexical_index.add(
+                    hashes,
+                    [chunk.page_content for chunk in chunks],
+                    [chunk.metadata for chunk in chunks],
+                )
+
+            def embed(batch):
+                hashes, chunks = zip(*batch)
+                # Reuse embeddings computed for these chunks by earlier uploads
+                with stage("ingest_embedding"):
+                    stored = embedding_store.get_many(hashes)
+                    missing = [
+                        i for i, hash_ in enumerate(hashes) if hash_ not in stored
+                    ]
+                    if missing:
+                        computed = embedding_model.embed_documents(
+                            [chunks[i].page_content for i in missing]
+                        )
+                        new = {
+                            hashes[i]: vector for i, vector in zip(missing, computed)
+                        }
+                        embedding_store.put_many(new)
+                        stored.update(new)
+                INGESTED_CHUNKS.inc(len(batch) - len(missing), result="cached")
+                INGESTED_CHUNKS.inc(len(missing), result="embedded")
+                with progress_lock:
+                    progress["chunks_cached"] += len(batch) - len(missing)
+                    progress["chunks_embedded"] += len(missing)
+                    report(stage="embedding", **counts, **progress)
+                return hashes, chunks, [stored[hash_] for hash_ in hashes]
+
+            def upserted(hashes):
+                # Runs on an upsert worker once a batch is in the index
+                with progress_lock:
+                    items = [(hash_, pending.pop(hash_)) for hash_ in hashes]
+                with index_lock:
+                    self.manifest.add(namespace, index_name, filename, hashes)
+                    index_terms(items)
+                with progress_lock:
+                    progress["vectors_upserted"] += len(hashes)
+                    report(stage="upserting", **counts, **progress)
 
+            seen = set()
+            batch = []
+            with UpsertWriter(
+                self.backend, index_name, on_batch_done=upserted
+            ) as writer:
+                for chunks in itertools.chain([first], pages):
+                    new = []
+                    for hash_, chunk in chunks:
+                        if hash_ not in seen:
+                            seen.add(hash_)
+                            new.append((hash_, chunk))
+                    with index_lock:
+                        stored = self.manifest.existing(
+                            namespace, index_name, [hash_ for hash_, _ in new]
+                        )
+                        self.manifest.add(namespace, index_name, filename, stored)
+                        # Also indexes chunks stored before lexical indexing
+                        index_terms([item for item in new if item[0] in stored])
+                    added = [item for item in new if item[0] not in stored]
+                    batch.extend(added)
+                    with progress_lock:
+                        pending.update(added)
+                        progress["chunks_unchanged"] += len(stored)
+                    INGESTED_CHUNKS.inc(len(stored), result="unchanged")
+                    while len(batch) >= INGEST_BATCH_SIZE:
+                        writer.write(*embed(batch[:INGEST_BATCH_SIZE]))
+                        batch = batch[INGEST_BATCH_SIZE:]
+                if batch:
+                    writer.write(*embed(batch))
+
+            # Drop chunks only the previous version of this document had
+            with index_lock:
+                removed = self.manifest.replace_document(
+                    namespace, index_name, filename, seen
+                )
+                if removed:
+                    self.backend.delete(index_name, removed)
+                    lexical_index.delete(removed)
+            report(stage="indexed", chunks_removed=len(removed), **counts, **progress)
+
+            if progress["vectors_upserted"] or removed:
+                # Cached answers for this index may now be out of date
+                get_answer_cache().invalidate(index_name)
+            if removed:
+                self._reclaim_embeddings(embedding_store, removed)
+
+            return {
+                "success": True,
+                "message": f"Successfully processed {filename}",
+                "details": {
+                    "filename": filename,
+                    "total_pages": counts["parsed_pages"],
+                    "text_chunks": counts["text_chunks"],
+                    "chunks_added": progress["vectors_upserted"],
+                    "chunks_unchanged": progress["chunks_unchanged"],
+                    "chunks_removed": len(removed),
+                    "index_name": index_name,
+                },
+            }
+        finally:
+            pages.close()
+
+    def _reclaim_embeddings(self, embedding_store, removed):
+        """
+        Drop stored embeddings of chunks no index references any more and
+        compact the store once enough of it is dead rows
+        """
+        try:
+            embedding_store.discard(self.manifest.unreferenced(removed))
+            reclaimed = embedding_store.compact_if_needed()
+            if reclaimed:
+                print(f"Compacted chunk embedding store: {reclaimed} rows removed")
         except Exception as e:
-            return {"success": False, "error": f"Error processing PDF: {str(e)}"}
+            print(f"Error compacting chunk embedding store: {str(e)}")
+
+    def warm_up(self):
+        """Load the PDF parser, text splitter and chunk embedding store"""
+        import pypdf  # noqa: F401
+        from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: F401
+
+        self._get_embedding_store()
 
     def get_available_indexes(self):
-        """Get list of available Pinecone indexes"""
+        """Get list of available vector store indexes"""
         try:
-            pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-            indexes = pc.list_indexes()
-            return {"success": True, "indexes": [index.name for index in indexes]}
+            return {"success": True, "indexes": self.backend.list_indexes()}
         except Exception as e:
             return {"success": False, "error": f"Error fetching indexes: {str(e)}"}
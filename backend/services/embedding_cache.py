@@ -0,0 +1,222 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "10000"))
+QUERY_CACHE_MAX_BYTES = int(
+    os.environ.get("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("QUERY_CACHE_TTL_SECONDS", "3600"))
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH")  # optional on-disk tier
+QUERY_CACHE_DISK_MAX_ENTRIES = int(
+    os.environ.get("QUERY_CACHE_DISK_MAX_ENTRIES", "100000")
+)
+# Writes between prunes of expired and surplus rows from the on-disk tier
+QUERY_CACHE_DISK_PRUNE_INTERVAL = 100
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text for cache lookups (MiniLM is uncased)"""
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with TTL expiry.
+
+    Vectors are held as float32 arrays and evicted least-recently-used
+    first once either the entry or the byte limit is exceeded. When
+    ``disk_path`` is set, entries are also written through to a SQLite file
+    so they survive restarts; expired rows and the oldest rows beyond
+    ``disk_max_entries`` are pruned from it on open and every
+    QUERY_CACHE_DISK_PRUNE_INTERVAL writes.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries=QUERY_CACHE_MAX_ENTRIES,
+        max_bytes=QUERY_CACHE_MAX_BYTES,
+        ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+        disk_path: Optional[str] = QUERY_CACHE_PATH,
+        disk_max_entries=QUERY_CACHE_DISK_MAX_ENTRIES,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()  # key -> (vector, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._disk_evictions = 0
+        self._disk_writes = 0
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._disk.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_stored_at "
+                "ON query_embeddings (stored_at)"
+            )
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete expired rows, then the oldest rows beyond disk_max_entries"""
+        deleted = 0
+        if self.ttl_seconds > 0:
+            deleted += self._disk.execute(
+                "DELETE FROM query_embeddings WHERE stored_at < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+        deleted += self._disk.execute(
+            "DELETE FROM query_embeddings WHERE key IN ("
+            "SELECT key FROM query_embeddings ORDER BY stored_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        ).rowcount
+        self._disk.commit()
+        self._disk_evictions += deleted
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.model_name}\x00{normalize_query(text)}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _store(self, key, vector, stored_at):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[0].nbytes
+        self._entries[key] = (vector, stored_at)
+        self._bytes += vector.nbytes
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._evictions += 1
+
+    def _load_from_disk(self, key):
+        row = self._disk.execute(
+            "SELECT vector, stored_at FROM query_embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        vector, stored_at = np.frombuffer(row[0], dtype=np.float32), row[1]
+        if self._expired(stored_at):
+            self._disk.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+            self._disk.commit()
+            return None
+        self._store(key, vector, stored_at)
+        return vector
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Get the cached embedding for a query, or None"""
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, stored_at = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return vector
+                self._bytes -= self._entries.pop(key)[0].nbytes
+
+            if self._disk is not None:
+                vector = self._load_from_disk(key)
+                if vector is not None:
+                    self._disk_hits += 1
+                    return vector
+
+            self._misses += 1
+            return None
+
+    def put(self, text: str, vector):
+        """Cache the embedding for a query"""
+        key = self._key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, vector, stored_at)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), stored_at),
+                )
+                self._disk.commit()
+                self._disk_writes += 1
+                if self._disk_writes % QUERY_CACHE_DISK_PRUNE_INTERVAL == 0:
+                    self._prune_disk()
+
+    def clear(self):
+        """Drop every cached embedding, including the on-disk tier"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM query_embeddings")
+                self._disk.commit()
+
+    def get_stats(self):
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "disk_evictions": self._disk_evictions,
+                "hit_rate": (
+                    (self._hits + self._disk_hits) / lookups if lookups else 0.0
+                ),
+                "disk_enabled": self._disk is not None,
+            }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated queries from a QueryEmbeddingCache"""
+
+    def __init__(self, embeddings: Embeddings, cache: QueryEmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, using the cache when possible"""
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(text, vector)
+            return vector
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Asynchronously embed a query, using the cache when possible"""
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.put(text, vector)
+            return vector
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents without caching"""
+        return self.embeddings.embed_documents(texts)
@@ -0,0 +1,250 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384  # dimension for all-MiniLM-L6-v2
+
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "32"))
+
+
+class _EmbeddingRequest:
+    """A pending embed call waiting to be folded into a batch"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    Process-wide embedding engine shared by every service.
+
+    The underlying model is loaded once on first use. Concurrent
+    embed_query/embed_documents calls are coalesced: while one thread runs a
+    forward pass, calls arriving from other threads queue up and the next
+    thread to take the model runs all of them as a single batch.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: List[_EmbeddingRequest] = []
+
+    def _get_model(self):
+        """Load the HuggingFace model (once per process)"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from langchain_huggingface import HuggingFaceEmbeddings
+
+                    self._model = HuggingFaceEmbeddings(model_name=self.model_name)
+        return self._model
+
+    def _run_batch(self, batch):
+        """Embed all pending requests with one forward pass"""
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = self._get_model().embed_documents(texts) if texts else []
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        offset = 0
+        for request in batch:
+            request.result = vectors[offset : offset + len(request.texts)]
+            offset += len(request.texts)
+            request.done.set()
+
+    def _submit(self, texts):
+        request = _EmbeddingRequest(list(texts))
+        with self._pending_lock:
+            self._pending.append(request)
+
+        while not request.done.is_set():
+            with self._compute_lock:
+                if request.done.is_set():
+                    break
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                self._run_batch(batch)
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        return self._submit(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._submit([text])[0]
+
+    def is_loaded(self):
+        """Whether the underlying model has been loaded"""
+        return self._model is not None
+
+
+class QueryBatcher(Embeddings):
+    """
+    Micro-batching scheduler for query embeddings.
+
+    Queries are queued and a background worker embeds everything that
+    arrives within ``window_ms`` of the first queued query (or up to
+    ``max_batch_size`` queries) in a single call to the engine. Document
+    embedding is passed straight through to the engine.
+    """
+
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(
+        self,
+        engine: Embeddings,
+        window_ms=QUERY_BATCH_WINDOW_MS,
+        max_batch_size=QUERY_BATCH_MAX_SIZE,
+    ):
+        self.engine = engine
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._largest_batch = 0
+        self._batch_size_counts = {bucket: 0 for bucket in self.BATCH_SIZE_BUCKETS}
+        self._batch_size_counts["+Inf"] = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(
+                        target=self._run, name="query-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _collect_batch(self):
+        """Block for one query, then gather more until the window closes"""
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                self._run_batch(self._collect_batch())
+            except Exception as e:
+                # The worker serves every caller; never let one batch stop it
+                print(f"Query batch failed: {str(e)}")
+
+    def _run_batch(self, batch):
+        # Callers that gave up (e.g. a disconnected stream) are dropped;
+        # the rest can no longer be cancelled
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.monotonic()
+        self._record_batch(len(batch), [started - item[2] for item in batch])
+        try:
+            vectors = self.engine.embed_documents([item[0] for item in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def _record_batch(self, size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._queries += size
+            self._largest_batch = max(self._largest_batch, size)
+            for bucket in self.BATCH_SIZE_BUCKETS:
+                if size <= bucket:
+                    self._batch_size_counts[bucket] += 1
+                    break
+            else:
+                self._batch_size_counts["+Inf"] += 1
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, max(waits))
+
+    def submit(self, text: str) -> Future:
+        """Queue a query for embedding and return a future for its vector"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query through the batching queue"""
+        return self.submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a query through the batching queue without blocking the loop"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents directly with the engine"""
+        return self.engine.embed_documents(texts)
+
+    def get_stats(self):
+        """Batch size and queue wait metrics"""
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "queries": self._queries,
+                "queued": self._queue.qsize(),
+                "avg_batch_size": (
+                    self._queries / self._batches if self._batches else 0.0
+                ),
+                "max_batch_size": self._largest_batch,
+                "batch_size_histogram": {
+                    str(bucket): count
+                    for bucket, count in self._batch_size_counts.items()
+                },
+                "avg_queue_wait_ms": (
+                    self._total_wait / self._queries * 1000.0 if self._queries else 0.0
+                ),
+                "max_queue_wait_ms": self._max_wait * 1000.0,
+            }
+
+
+_engine: Optional[EmbeddingEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """Get the shared embedding engine for this process"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = EmbeddingEngine()
+    return _engine
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+INGESTION_DATA_DIR = os.environ.get("INGESTION_DATA_DIR", "./ingestion_data")
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+INGESTION_MAX_PENDING = int(os.environ.get("INGESTION_MAX_PENDING", "100"))
+
+
+class IngestionQueueFull(Exception):
+    """Raised when too many ingestion jobs are already waiting"""
+
+
+class IngestionQueue:
+    """
+    Persistent queue of document ingestion jobs.
+
+    Uploaded files are spooled to disk and recorded in a local SQLite job
+    table, then processed by a bounded pool of worker threads. Each job
+    records per-stage progress (parsed pages, chunks embedded, vectors
+    upserted). Jobs that were queued or running when the process stopped
+    are picked up again by ``start()``.
+    """
+
+    def __init__(
+        self,
+        processor,
+        data_dir: str = INGESTION_DATA_DIR,
+        workers: int = INGESTION_WORKERS,
+        max_pending: int = INGESTION_MAX_PENDING,
+    ):
+        self.processor = processor
+        self.data_dir = data_dir
+        self.spool_dir = os.path.join(data_dir, "spool")
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = None
+
+    @property
+    def _db(self):
+        """Job table connection, opened on first use; call with the lock held"""
+        if self._conn is None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.data_dir, "jobs.db"), check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingestion_jobs ("
+                "id TEXT PRIMARY KEY, user_id INTEGER, filename TEXT NOT NULL, "
+                "index_name TEXT, status TEXT NOT NULL, progress TEXT NOT NULL, "
+                "result TEXT, error TEXT, payload_path TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def start(self):
+        """Start the worker pool and resume unfinished jobs"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="ingestion"
+            )
+            rows = self._db.execute(
+                "SELECT id FROM ingestion_jobs WHERE status IN ('queued', 'running') "
+                "ORDER BY created_at"
+            ).fetchall()
+        for row in rows:
+            self._update(row["id"], status="queued")
+            self._submit(row["id"])
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and wait for running jobs"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _submit(self, job_id, reserved=False):
+        with self._lock:
+            if not reserved:
+                self._pending += 1
+            executor = self._executor
+        executor.submit(self._run, job_id)
+
+    def reserve(self, count):
+        """
+        Claim room for ``count`` jobs at once, so a batch of uploads is
+        accepted or refused as a whole. Jobs enqueued with ``reserved=True``
+        use the claim; release() what is left unused.
+        """
+        self.start()
+        with self._lock:
+            if self._pending + count > self.max_pending:
+                raise IngestionQueueFull(
+                    f"Ingestion queue is full ({self._pending} of "
+                    f"{self.max_pending} jobs waiting, {count} more requested)"
+                )
+            self._pending += count
+
+    def release(self, count):
+        """Give back reserved room that no job used"""
+        with self._lock:
+            self._pending -= count
+
+    def enqueue(
+        self, file_content, filename, index_name=None, user_id=None, reserved=False
+    ):
+        """Spool an upload and queue it for ingestion; returns the job"""
+        self.start()
+        with self._lock:
+            if not reserved and self._pending >= self.max_pending:
+                raise IngestionQueueFull(
+                    f"Ingestion queue is full ({self.max_pending} jobs waiting)"
+                )
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.spool_dir, exist_ok=True)
+        payload_path = os.path.join(self.spool_dir, f"{job_id}.pdf")
+        with open(payload_path, "wb") as f:
+            f.write(file_content)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO ingestion_jobs (id, user_id, filename, index_name, "
+                "status, progress, payload_path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', '{}', ?, ?, ?)",
+                (job_id, user_id, filename, index_name, payload_path, now, now),
+            )
+            self._db.commit()
+        self._submit(job_id, reserved=reserved)
+        return self.get_job(job_id)
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        for key in ("progress", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE ingestion_jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+            self._db.commit()
+
+    def _run(self, job_id):
+        payload_path = None
+        try:
+            job = self.get_job(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                return
+            payload_path = job["payload_path"]
+            progress = {"stage": "starting"}
+            self._update(job_id, status="running", progress=progress)
+
+            def report(**update):
+                progress.update(update)
+                self._update(job_id, progress=progress)
+
+            with open(payload_path, "rb") as f:
+                file_content = f.read()
+            result = self.processor.process_pdf_file(
+                file_content,
+                job["filename"],
+                job["index_name"],
+                progress_callback=report,
+            )
+
+            progress["stage"] = "completed" if result["success"] else "failed"
+            self._update(
+                job_id,
+                status=progress["stage"],
+                progress=progress,
+                result=result.get("details"),
+                error=result.get("error"),
+            )
+        except Exception as e:
+            print(f"Error running ingestion job {job_id}: {str(e)}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            # Failed jobs aren't retried, so their spooled upload goes too
+            if payload_path is not None and os.path.exists(payload_path):
+                os.unlink(payload_path)
+            with self._lock:
+                self._pending -= 1
+
+    def get_job(self, job_id) -> Optional[dict]:
+        """Get a job's status, progress and result"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def get_stats(self):
+        """Number of jobs per status"""
+        with self._lock:
+            rows = []
+            if self._conn is not None:
+                rows = self._db.execute(
+                    "SELECT status, COUNT(*) AS count FROM ingestion_jobs "
+                    "GROUP BY status"
+                ).fetchall()
+            pending = self._pending
+        return {
+            "workers": self.workers,
+            "pending": pending,
+            "jobs": {row["status"]: row["count"] for row in rows},
+        }
@@ -0,0 +1,284 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from services.local_vector_store import top_k
+from services.vector_backends import get_vector_backend, validate_index_name
+
+LEXICAL_INDEX_DIR = os.environ.get("LEXICAL_INDEX_DIR", "./ingestion_data/lexical")
+# Rows added since the last postings snapshot before a new one is written
+LEXICAL_SNAPSHOT_ROWS = int(os.environ.get("LEXICAL_SNAPSHOT_ROWS", "20000"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words, numbers and joined codes such as "ABC-123", "0x80070005" or "E.404"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase terms of a text. Joined codes are kept whole and also split
+    into their parts, so "ABC-123" matches both "abc-123" and "abc"
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_./:]", token) if part)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over document chunks, persisted to a directory.
+
+    Chunks are appended to ``documents.jsonl`` (deletions are tombstones).
+    Postings are compact per-term arrays of rows (int32) and term
+    frequencies (uint16), stored as one CSR snapshot in ``postings.npz``
+    plus per-term lists for rows added since; a snapshot is rewritten once
+    LEXICAL_SNAPSHOT_ROWS rows have accumulated. Queries score all postings
+    of a term at once with numpy.
+    """
+
+    DOCUMENTS_FILE = "documents.jsonl"
+    POSTINGS_FILE = "postings.npz"
+
+    def __init__(self, path: str, snapshot_rows: int = LEXICAL_SNAPSHOT_ROWS):
+        self.path = path
+        self.snapshot_rows = snapshot_rows
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._live = np.zeros(0, dtype=bool)
+        self._live_length = 0.0
+        # Snapshot postings: term -> (start, stop) into the row/tf arrays
+        self._base_terms: Dict[str, Tuple[int, int]] = {}
+        self._base_rows = np.zeros(0, dtype=np.int32)
+        self._base_tfs = np.zeros(0, dtype=np.uint16)
+        self._snapshot_records = 0  # documents.jsonl lines the snapshot covers
+        self._records = 0
+        # Postings for rows added since the snapshot: term -> (rows, tfs)
+        self._extra: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._extra_rows = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def _documents_path(self):
+        return os.path.join(self.path, self.DOCUMENTS_FILE)
+
+    @property
+    def _postings_path(self):
+        return os.path.join(self.path, self.POSTINGS_FILE)
+
+    def _load(self):
+        lengths = []
+        if os.path.exists(self._postings_path):
+            data = np.load(self._postings_path)
+            offsets = data["offsets"]
+            self._base_terms = {
+                str(term): (int(offsets[i]), int(offsets[i + 1]))
+                for i, term in enumerate(data["terms"])
+            }
+            self._base_rows = data["rows"]
+            self._base_tfs = data["tfs"]
+            self._snapshot_records = int(data["records"])
+            lengths = list(data["lengths"])
+
+        if not os.path.exists(self._documents_path):
+            self._finish_load(lengths)
+            return
+        with open(self._documents_path) as f:
+            for record_number, line in enumerate(f):
+                record = json.loads(line)
+                self._records += 1
+                if record.get("deleted"):
+                    self._delete_row(self._id_to_row.pop(record["id"], None))
+                    continue
+                row = self._append_row(record)
+                if record_number >= self._snapshot_records:
+                    lengths.append(self._index_terms(row, record["text"]))
+        self._finish_load(lengths)
+
+    def _finish_load(self, lengths):
+        self._lengths = np.asarray(lengths, dtype=np.float32)
+        # Rows still mapped from an id are the live ones
+        live = np.zeros(len(self._ids), dtype=bool)
+        live[list(self._id_to_row.values())] = True
+        self._live = live
+        self._live_length = float(self._lengths[live].sum()) if len(live) else 0.0
+
+    def _append_row(self, record):
+        previous = self._id_to_row.get(record["id"])
+        if previous is not None:
+            self._delete_row(previous)
+        row = len(self._ids)
+        self._id_to_row[record["id"]] = row
+        self._ids.append(record["id"])
+        self._texts.append(record["text"])
+        self._metadatas.append(record.get("metadata", {}))
+        return row
+
+    def _delete_row(self, row):
+        if row is not None and row < len(self._live) and self._live[row]:
+            self._live[row] = False
+            self._live_length -= float(self._lengths[row])
+
+    def _index_terms(self, row, text):
+        """Add a row's terms to the recent postings; returns its length"""
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            rows, tfs = self._extra.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(min(count, 65535))
+        self._extra_rows += 1
+        return sum(terms.values())
+
+    def add(self, ids, texts, metadatas=None):
+        """Index chunks; ids already present are skipped"""
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            records = {
+                id_: {"id": id_, "text": text, "metadata": metadata}
+                for id_, text, metadata in zip(ids, texts, metadatas)
+                if id_ not in self._id_to_row
+            }
+            records = list(records.values())
+            if not records:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._documents_path, "a") as f:
+                for record in records:
+                    f.write(json.dumps(record, default=str) + "\n")
+            self._records += len(records)
+            lengths = []
+            for record in records:
+                row = self._append_row(record)
+                lengths.append(self._index_terms(row, record["text"]))
+            self._lengths = np.concatenate(
+                [self._lengths, np.asarray(lengths, dtype=np.float32)]
+            )
+            self._live = np.concatenate([self._live, np.ones(len(records), bool)])
+            self._live_length += float(sum(lengths))
+            if self._extra_rows >= self.snapshot_rows:
+                self._snapshot()
+
+    def delete(self, ids):
+        """Tombstone chunks by id"""
+        with self._lock:
+            deleted = [id_ for id_ in dict.fromkeys(ids) if id_ in self._id_to_row]
+            if not deleted:
+                return
+            with open(self._documents_path, "a") as f:
+                for id_ in deleted:
+                    self._delete_row(self._id_to_row.pop(id_))
+                    f.write(json.dumps({"id": id_, "deleted": True}) + "\n")
+            self._records += len(deleted)
+
+    def _postings(self, term):
+        """Rows and term frequencies of one term; call with the lock held"""
+        start, stop = self._base_terms.get(term, (0, 0))
+        rows, tfs = self._base_rows[start:stop], self._base_tfs[start:stop]
+        extra = self._extra.get(term)
+        if extra is not None:
+            rows = np.concatenate([rows, np.asarray(extra[0], dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.asarray(extra[1], dtype=np.uint16)])
+        return rows, tfs
+
+    def _snapshot(self):
+        """Merge recent postings into a new CSR snapshot on disk"""
+        terms = sorted(set(self._base_terms) | set(self._extra))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        all_rows, all_tfs = [], []
+        for i, term in enumerate(terms):
+            rows, tfs = self._postings(term)
+            all_rows.append(rows)
+            all_tfs.append(tfs)
+            offsets[i + 1] = offsets[i] + len(rows)
+        base_rows = np.concatenate(all_rows) if all_rows else self._base_rows[:0]
+        base_tfs = np.concatenate(all_tfs) if all_tfs else self._base_tfs[:0]
+
+        tmp = self._postings_path + ".tmp.npz"
+        np.savez(
+            tmp,
+            terms=np.asarray(terms, dtype=str),
+            offsets=offsets,
+            rows=base_rows,
+            tfs=base_tfs,
+            lengths=self._lengths,
+            records=self._records,
+        )
+        os.replace(tmp, self._postings_path)
+        self._base_terms = {
+            term: (int(offsets[i]), int(offsets[i + 1])) for i, term in enumerate(terms)
+        }
+        self._base_rows, self._base_tfs = base_rows, base_tfs
+        self._snapshot_records = self._records
+        self._extra = {}
+        self._extra_rows = 0
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """Return (row, BM25 score) pairs for the top-k live rows"""
+        terms = set(tokenize(query))
+        with self._lock:
+            live, lengths = self._live, self._lengths
+            documents = int(live.sum())
+            if documents == 0 or not terms or k <= 0:
+                return []
+            average_length = max(self._live_length / documents, 1.0)
+            postings = [self._postings(term) for term in terms]
+
+        scores = np.zeros(len(live), dtype=np.float32)
+        for rows, tfs in postings:
+            rows, tfs = rows[live[rows]], tfs[live[rows]].astype(np.float32)
+            if len(rows) == 0:
+                continue
+            idf = np.log(1.0 + (documents - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[rows] / average_length)
+            scores[rows] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+
+        matched = np.flatnonzero(scores)
+        best = matched[top_k(scores[matched], k)]
+        return [(int(row), float(scores[row])) for row in best]
+
+    def get_document(self, row) -> Document:
+        """Build the Document stored at a row"""
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata=dict(self._metadatas[row]),
+        )
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        """Top-k chunks for a query by BM25, best first"""
+        return [self.get_document(row) for row, _ in self.search(query, k)]
+
+    def __len__(self):
+        return int(self._live.sum())
+
+
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(index_name: str, namespace: Optional[str] = None) -> LexicalIndex:
+    """Get the lexical index kept alongside a vector index (loaded once)"""
+    validate_index_name(index_name)
+    if namespace is None:
+        namespace = get_vector_backend().name
+    key = os.path.join(namespace, index_name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LexicalIndex(os.path.join(LEXICAL_INDEX_DIR, key))
+            _indexes[key] = index
+        return index
@@ -1,7 +1,89 @@
+import asyncio
+import functools
 import os
-from langchain.chains import RetrievalQA
+import threading
+import time
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import PromptTemplate
-from langchain_groq import ChatGroq
+
+from services.context_packer import (
+    CONTEXT_CANDIDATES,
+    CONTEXT_PACKING,
+    DOCUMENT_SEPARATOR,
+    PackingRetriever,
+    count_tokens,
+    get_context_packer,
+)
+from services.metrics import (
+    LLM_REQUESTS_IN_FLIGHT,
+    LLM_TIME_TO_FIRST_TOKEN_SECONDS,
+    ainject_trace_headers,
+    inject_trace_headers,
+    observe_stage,
+    record_tokens,
+    stage,
+)
+from services.retrieval import build_retriever
+
+# Keep-alive connection pool shared by all requests to the Groq API
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.environ.get("LLM_KEEPALIVE_SECONDS", "60"))
+# Free-form per-request retrieval overrides; chains built with them aren't
+# cached, or clients could grow the chain cache without bound
+UNCACHED_RETRIEVAL_SETTINGS = ("dense_weight", "lexical_weight")
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """
+    Times the retrieval and generation steps of one chain run as pipeline
+    stages, and counts generations in flight
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}  # run id -> (stage, start time)
+
+    def _start(self, run_id, name, parent_run_id=None):
+        # Retrievers wrapping retrievers are timed once, at the outermost
+        if parent_run_id in self._started:
+            return
+        self._started[run_id] = (name, time.perf_counter())
+        if name == "generation":
+            LLM_REQUESTS_IN_FLIGHT.inc()
+
+    def _end(self, run_id, failed=False):
+        entry = self._started.pop(run_id, None)
+        if entry is None:
+            return
+        name, started = entry
+        if name == "generation":
+            LLM_REQUESTS_IN_FLIGHT.dec()
+        if not failed:
+            observe_stage(name, time.perf_counter() - started)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieval", kwargs.get("parent_run_id"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, failed=True)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "generation")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "generation")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, failed=True)
 
 
 class LLMService:
@@ -13,7 +95,8 @@ class LLMService:
     def __init__(self):
         self.custom_prompt_template = """
         Use the pieces of information provided in the context to answer user's question.
-        If you dont know the answer, just say that you dont know, dont try to make up an answer.
+        If you dont know the answer, just say that you dont know,
+        dont try to make up an answer.
         Dont provide anything out of the given context
 
         Context: {context}
@@ -21,6 +104,11 @@ class LLMService:
 
         Start the answer directly. No small talk please.
         """
+        self._llm = None
+        self._prompt = None
+        # (index_name, prompt template, k, retrieval settings) -> (vectorstore, chain)
+        self._chains = {}
+        self._lock = threading.RLock()
 
     def _set_custom_prompt(self, custom_prompt_template):
         """Create and return a PromptTemplate"""
@@ -29,43 +117,212 @@ class LLMService:
         )
         return prompt
 
+    def _get_prompt(self):
+        """Get the PromptTemplate for the current template (built once)"""
+        with self._lock:
+            if self._prompt is None:
+                self._prompt = self._set_custom_prompt(self.custom_prompt_template)
+            return self._prompt
+
     def _get_llm(self):
-        """Initialize and return the ChatGroq LLM"""
+        """Initialize and return the shared ChatGroq LLM"""
+        with self._lock:
+            if self._llm is not None:
+                return self._llm
+            try:
+                # The Groq SDK is imported on first use, not at startup
+                from langchain_groq import ChatGroq
+
+                limits = httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+                )
+                # Both clients pass the request's trace context on to Groq
+                http_client = httpx.Client(
+                    limits=limits, event_hooks={"request": [inject_trace_headers]}
+                )
+                http_async_client = httpx.AsyncClient(
+                    limits=limits, event_hooks={"request": [ainject_trace_headers]}
+                )
+                self._llm = ChatGroq(
+                    model_name="meta-llama/llama-4-maverick-17b-128e-instruct",
+                    temperature=0.0,
+                    groq_api_key=os.environ["GROQ_API_KEY"],
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                )
+                return self._llm
+            except Exception as e:
+                raise Exception(f"Failed to initialize LLM: {str(e)}")
+
+    def _build_retriever(self, vectorstore, index_name, k, retrieval):
+        """
+        Retriever for the LLM context: with context packing, up to
+        CONTEXT_CANDIDATES chunks packed into the token budget, otherwise the
+        top k chunks
+        """
+        if not CONTEXT_PACKING:
+            return build_retriever(vectorstore, index_name, k, **retrieval)
+        candidates = max(k, CONTEXT_CANDIDATES)
+        return PackingRetriever(
+            retriever=build_retriever(vectorstore, index_name, candidates, **retrieval),
+            packer=get_context_packer(),
+        )
+
+    def _usage(self, query, documents):
+        """Token counts of the prompt sent for a query"""
+        context = DOCUMENT_SEPARATOR.join(doc.page_content for doc in documents)
+        prompt = self._get_prompt().format(context=context, question=query)
+        return {
+            "prompt_tokens": count_tokens(prompt),
+            "context_tokens": count_tokens(context),
+            "context_passages": len(documents),
+        }
+
+    def _finish(self, query, response):
+        """Add the prompt's token counts to a chain response and count them"""
+        usage = self._usage(query, response["source_documents"])
+        result = response.get("result")
+        record_tokens(usage, count_tokens(result) if isinstance(result, str) else 0)
+        response["usage"] = usage
+        return response
+
+    def _new_chain(self, vectorstore, index_name, k, retrieval):
+        from langchain.chains import RetrievalQA
+
+        return RetrievalQA.from_chain_type(
+            llm=self._get_llm(),
+            chain_type="stuff",
+            retriever=self._build_retriever(vectorstore, index_name, k, retrieval),
+            return_source_documents=True,
+            chain_type_kwargs={"prompt": self._get_prompt()},
+        )
+
+    def _get_chain(self, vectorstore, index_name=None, k=3, **retrieval):
+        """
+        Get the RetrievalQA chain for an index, prompt template, k and
+        retrieval settings (see build_retriever), building it only when no
+        chain exists for this vector store yet. Chains with fusion weight
+        overrides are built per request and not cached.
+        """
+        if any(name in retrieval for name in UNCACHED_RETRIEVAL_SETTINGS):
+            return self._new_chain(vectorstore, index_name, k, retrieval)
+        key = (index_name, self.custom_prompt_template, k, *sorted(retrieval.items()))
+        with self._lock:
+            entry = self._chains.get(key)
+            if entry is None or entry[0] is not vectorstore:
+                entry = (
+                    vectorstore,
+                    self._new_chain(vectorstore, index_name, k, retrieval),
+                )
+                self._chains[key] = entry
+            return entry[1]
+
+    def warm_up(self, text):
+        """Build the Groq client and prompt, load the chain code and tokenizer"""
+        from langchain.chains import RetrievalQA  # noqa: F401
+
+        self._get_llm()
+        self._get_prompt()
+        count_tokens(text)
+
+    def invalidate_chains(self, index_name=None):
+        """Drop cached chains for an index (or all chains when None)"""
+        with self._lock:
+            if index_name is None:
+                self._chains.clear()
+                return
+            for key in [key for key in self._chains if key[0] == index_name]:
+                del self._chains[key]
+
+    def get_response(self, query, vectorstore, index_name=None, k=3, **retrieval):
+        """
+        Get response from the RetrievalQA chain
+        Replicates the qa_chain functionality from connect_memory_with_llm.py
+
+        ``retrieval`` takes the retrieval mode, fusion weights and re-ranking
+        switch (see build_retriever); unset ones use the defaults. The
+        response includes the prompt's token counts under "usage".
+        """
         try:
-            llm = ChatGroq(
-                model_name="meta-llama/llama-4-maverick-17b-128e-instruct",
-                temperature=0.0,
-                groq_api_key=os.environ["GROQ_API_KEY"],
+            # Reuse the RetrievalQA chain for this index
+            qa_chain = self._get_chain(vectorstore, index_name, k, **retrieval)
+
+            # Get response from the chain, timing retrieval and generation
+            response = qa_chain.invoke(
+                {"query": query}, config={"callbacks": [StageTimingCallback()]}
+            )
+
+            return self._finish(query, response)
+
+        except Exception as e:
+            raise Exception(f"Failed to get LLM response: {str(e)}")
+
+    async def aget_response(
+        self, query, vectorstore, index_name=None, k=3, **retrieval
+    ):
+        """Asynchronously get response from the RetrievalQA chain"""
+        try:
+            # Building a chain can load the BM25 index and the re-ranker
+            qa_chain = await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    self._get_chain, vectorstore, index_name, k, **retrieval
+                ),
+            )
+            response = await qa_chain.ainvoke(
+                {"query": query}, config={"callbacks": [StageTimingCallback()]}
             )
-            return llm
+            return self._finish(query, response)
+
         except Exception as e:
-            raise Exception(f"Failed to initialize LLM: {str(e)}")
+            raise Exception(f"Failed to get LLM response: {str(e)}")
 
-    def get_response(self, query, vectorstore):
+    async def astream_response(
+        self, query, vectorstore, index_name=None, k=3, **retrieval
+    ):
         """
-        Get response from the RetrievalQA chain
-        Replicates the qa_chain functionality from connect_memory_with_llm.py
+        Stream a response token by token.
+
+        Retrieves the same context the "stuff" chain would use, then yields
+        a ("usage", token counts) tuple, ("token", text) tuples as the LLM
+        generates them and a single ("sources", documents) tuple.
         """
         try:
-            # Create the RetrievalQA chain
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self._get_llm(),
-                chain_type="stuff",
-                retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
-                return_source_documents=True,
-                chain_type_kwargs={
-                    "prompt": self._set_custom_prompt(self.custom_prompt_template)
-                },
+            retriever = await asyncio.get_running_loop().run_in_executor(
+                None, self._build_retriever, vectorstore, index_name, k, retrieval
             )
+            with stage("retrieval"):
+                documents = await retriever.ainvoke(query)
+            with stage("prompt_assembly"):
+                context = DOCUMENT_SEPARATOR.join(doc.page_content for doc in documents)
+                prompt = self._get_prompt().format(context=context, question=query)
+                usage = self._usage(query, documents)
+            yield "usage", usage
 
-            # Get response from the chain
-            response = qa_chain.invoke({"query": query})
+            answer = []
+            started = time.perf_counter()
+            with LLM_REQUESTS_IN_FLIGHT.track():
+                async for chunk in self._get_llm().astream(prompt):
+                    if chunk.content:
+                        if not answer:
+                            LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(
+                                time.perf_counter() - started
+                            )
+                        answer.append(chunk.content)
+                        yield "token", chunk.content
+            observe_stage("generation", time.perf_counter() - started)
+            record_tokens(usage, count_tokens("".join(answer)))
 
-            return response
+            yield "sources", documents
 
         except Exception as e:
             raise Exception(f"Failed to get LLM response: {str(e)}")
 
     def update_prompt_template(self, new_template):
         """Update the custom prompt template"""
-        self.custom_prompt_template = new_template
+        with self._lock:
+            self.custom_prompt_template = new_template
+            self._prompt = None
+            self._chains.clear()
@@ -0,0 +1,445 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from services.ann_index import IVFIndex
+from services.embedding_service import EMBEDDING_DIMENSION
+from services.quantization import QuantizedCodes
+
+# "flat" (exact search) or "ivf" (approximate, for large corpora)
+LOCAL_INDEX_TYPE = os.environ.get("LOCAL_INDEX_TYPE", "flat")
+# "none", "int8" or "pq": compressed codes for the first search pass
+LOCAL_QUANTIZATION = os.environ.get("LOCAL_QUANTIZATION", "none")
+# How many first-pass candidates per requested result are re-scored exactly
+QUANTIZATION_RERANK_FACTOR = int(os.environ.get("QUANTIZATION_RERANK_FACTOR", "10"))
+# Compact in the background once this share of rows are tombstones (0 = never)
+LOCAL_COMPACT_DEAD_RATIO = float(os.environ.get("LOCAL_COMPACT_DEAD_RATIO", "0.3"))
+# ...and at least this many, so small indexes aren't rewritten on every delete
+LOCAL_COMPACT_MIN_DEAD_ROWS = int(os.environ.get("LOCAL_COMPACT_MIN_DEAD_ROWS", "1000"))
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class LocalVectorIndex:
+    """
+    In-process vector index persisted to a directory.
+
+    Embeddings are L2-normalized and stored as rows of a float32 matrix in
+    ``vectors.f32``, which is memory-mapped for search, so cosine similarity
+    is a single matrix-vector product. Text and metadata live in a
+    ``documents.jsonl`` sidecar; deletions are appended to it as tombstones
+    and removed from disk by ``compact()``, which runs on a background
+    thread once ``compact_ratio`` of the rows (and at least
+    ``compact_min_rows``) are tombstones.
+
+    With ``index_type="ivf"`` searches go through an IVFIndex once the
+    index holds enough rows to train it; until then they stay exact.
+
+    With ``quantization`` set to "int8" or "pq", a compressed copy of the
+    vectors is kept in memory and scored first; only the best
+    ``k * rerank_factor`` candidates are re-scored exactly against the
+    memory-mapped float32 rows, which otherwise stay on disk.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    DOCUMENTS_FILE = "documents.jsonl"
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int = EMBEDDING_DIMENSION,
+        index_type: str = LOCAL_INDEX_TYPE,
+        ann_options: Optional[dict] = None,
+        quantization: str = LOCAL_QUANTIZATION,
+        quantization_options: Optional[dict] = None,
+        rerank_factor: int = QUANTIZATION_RERANK_FACTOR,
+        compact_ratio: float = LOCAL_COMPACT_DEAD_RATIO,
+        compact_min_rows: int = LOCAL_COMPACT_MIN_DEAD_ROWS,
+    ):
+        self.path = path
+        self.dimension = dimension
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self._compact_thread = None
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._id_to_row = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        os.makedirs(path, exist_ok=True)
+        self._load()
+        self._ann = None
+        if index_type == "ivf":
+            self._ann = IVFIndex(path, **(ann_options or {}))
+            self._ann.sync(self._vectors)
+        elif index_type != "flat":
+            raise ValueError(f"Unknown local index type: {index_type}")
+        self.rerank_factor = rerank_factor
+        self._codes = None
+        if quantization != "none":
+            self._codes = QuantizedCodes(
+                path, quantization, dimension, **(quantization_options or {})
+            )
+            self._codes.sync(self._vectors)
+        with self._lock:
+            self._compact_if_needed()
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, self.VECTORS_FILE)
+
+    @property
+    def _documents_path(self):
+        return os.path.join(self.path, self.DOCUMENTS_FILE)
+
+    def _load(self):
+        """Reload documents and the vector matrix from disk"""
+        rows = 0
+        if os.path.exists(self._vectors_path):
+            rows = os.path.getsize(self._vectors_path) // (4 * self.dimension)
+
+        live = []
+        if os.path.exists(self._documents_path):
+            with open(self._documents_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record.get("deleted"):
+                        row = self._id_to_row.pop(record["id"], None)
+                        if row is not None:
+                            live[row] = False
+                        continue
+                    previous = self._id_to_row.get(record["id"])
+                    if previous is not None:
+                        live[previous] = False
+                    self._id_to_row[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._texts.append(record["text"])
+                    self._metadatas.append(record["metadata"])
+                    live.append(True)
+
+        if rows > len(self._ids):
+            # A write was interrupted after the vectors but before the documents
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(len(self._ids) * 4 * self.dimension)
+
+        self._live = np.array(live, dtype=bool)
+        self._map_vectors(len(self._ids))
+
+    def _map_vectors(self, rows):
+        if rows == 0:
+            self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        else:
+            self._vectors = np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(rows, self.dimension),
+            )
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def __len__(self):
+        return int(self._live.sum())
+
+    def add(self, ids, texts, embeddings, metadatas):
+        """Append documents with precomputed embeddings"""
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Expected embeddings of dimension {self.dimension}, "
+                f"got shape {vectors.shape}"
+            )
+
+        with self._lock:
+            # Replacing an id tombstones its previous row
+            replaced = [id_ for id_ in ids if id_ in self._id_to_row]
+            if replaced:
+                self.delete(replaced)
+
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._documents_path, "a") as f:
+                for id_, text, metadata in zip(ids, texts, metadatas):
+                    f.write(
+                        json.dumps({"id": id_, "text": text, "metadata": metadata})
+                        + "\n"
+                    )
+
+            start = len(self._ids)
+            for offset, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self._id_to_row[id_] = start + offset
+                self._ids.append(id_)
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+            self._live = np.concatenate([self._live, np.ones(len(ids), dtype=bool)])
+            self._map_vectors(len(self._ids))
+            if self._ann is not None:
+                self._ann.sync(self._vectors)
+            if self._codes is not None:
+                self._codes.sync(self._vectors)
+        return list(ids)
+
+    def delete(self, ids):
+        """Tombstone documents by id"""
+        with self._lock:
+            with open(self._documents_path, "a") as f:
+                for id_ in ids:
+                    row = self._id_to_row.pop(id_, None)
+                    if row is None:
+                        continue
+                    self._live[row] = False
+                    f.write(json.dumps({"id": id_, "deleted": True}) + "\n")
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        """Start a background compaction once enough rows are tombstones"""
+        dead = len(self._live) - len(self)
+        if (
+            self.compact_ratio <= 0
+            or dead < max(1, self.compact_min_rows)
+            or dead < self.compact_ratio * len(self._live)
+        ):
+            return
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+
+        def compact():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting local index {self.path}: {str(e)}")
+
+        self._compact_thread = threading.Thread(
+            target=compact, name="local-compact", daemon=True
+        )
+        self._compact_thread.start()
+
+    def wait_for_compaction(self):
+        """Block until a background compaction (if any) has finished"""
+        thread = self._compact_thread
+        if thread is not None:
+            thread.join()
+
+    def search(self, embedding, k=4, nprobe=None) -> List[Tuple[int, float]]:
+        """Return (row, cosine similarity) pairs for the top-k live rows"""
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            vectors, live = self._vectors, self._live
+            if self._ann is not None:
+                self._ann.catch_up(vectors)
+        if len(live) == 0 or k <= 0:
+            return []
+
+        # Candidate rows: the probed IVF clusters, or every row
+        rows = None
+        if self._ann is not None and self._ann.is_trained:
+            rows = self._ann.candidates(query, nprobe)
+            rows = np.sort(rows[rows < len(live)])
+            rows = rows[live[rows]]
+
+        # First pass on compressed codes narrows the candidates to re-score
+        codes = self._codes
+        if codes is not None and codes.is_trained and len(codes.codes) >= len(live):
+            if rows is None:
+                rows = np.flatnonzero(live)
+                approximate = codes.score(query)[: len(live)][rows]
+            else:
+                approximate = codes.score(query, rows)
+            rows = np.sort(rows[top_k(approximate, k * self.rerank_factor)])
+
+        if rows is None:
+            scores = np.where(live, vectors @ query, -np.inf)
+            top = top_k(scores, min(k, int(live.sum())))
+            return [(int(row), float(scores[row])) for row in top]
+
+        scores = vectors[rows] @ query
+        return [(int(rows[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def memory_stats(self):
+        """Footprint of the vectors on disk and of what search keeps in RAM"""
+        rows = len(self._ids)
+        vector_bytes = rows * self.dimension * 4
+        stats = {
+            "rows": rows,
+            "live_rows": len(self),
+            "float32_bytes": vector_bytes,
+            "quantization": None,
+            "code_bytes": 0,
+            "compression_ratio": 1.0,
+        }
+        if self._codes is not None and self._codes.is_trained:
+            stats["quantization"] = self._codes.quantizer.kind
+            stats["code_bytes"] = self._codes.nbytes
+            if self._codes.nbytes:
+                stats["compression_ratio"] = vector_bytes / self._codes.nbytes
+        return stats
+
+    def get_document(self, row) -> Document:
+        """Build the Document stored at a row"""
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata=dict(self._metadatas[row]),
+        )
+
+    def compact(self):
+        """Rewrite the files on disk without deleted rows"""
+        with self._lock:
+            if self._ann is not None:
+                # Every row needs its cluster before rows are renumbered
+                self._ann.settle(self._vectors)
+            rows = np.flatnonzero(self._live)
+            vectors = np.array(self._vectors[rows], dtype=np.float32)
+            ids = [self._ids[row] for row in rows]
+            texts = [self._texts[row] for row in rows]
+            metadatas = [self._metadatas[row] for row in rows]
+
+            vectors_tmp = self._vectors_path + ".tmp"
+            documents_tmp = self._documents_path + ".tmp"
+            with open(vectors_tmp, "wb") as f:
+                f.write(vectors.tobytes())
+            with open(documents_tmp, "w") as f:
+                for id_, text, metadata in zip(ids, texts, metadatas):
+                    f.write(
+                        json.dumps({"id": id_, "text": text, "metadata": metadata})
+                        + "\n"
+                    )
+            self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            os.replace(vectors_tmp, self._vectors_path)
+            os.replace(documents_tmp, self._documents_path)
+
+            self._ids, self._texts, self._metadatas = ids, texts, metadatas
+            self._id_to_row = {id_: row for row, id_ in enumerate(ids)}
+            self._live = np.ones(len(ids), dtype=bool)
+            self._map_vectors(len(ids))
+            if self._ann is not None:
+                self._ann.remap(rows)
+            if self._codes is not None:
+                self._codes.remap(rows)
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain VectorStore over a LocalVectorIndex"""
+
+    def __init__(self, index: LocalVectorIndex, embedding: Embeddings):
+        self.index = index
+        self._embedding = embedding
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        embeddings = self._embedding.embed_documents(texts)
+        return self.index.add(ids, texts, embeddings, metadatas)
+
+    def add_embeddings(self, ids, texts, embeddings, metadatas) -> List[str]:
+        """Add documents whose embeddings were computed elsewhere"""
+        return self.index.add(ids, texts, embeddings, metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids:
+            self.index.delete(ids)
+        return True
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return [
+            (self.index.get_document(row), score)
+            for row, score in self.index.search(embedding, k, kwargs.get("nprobe"))
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = await self._embedding.aembed_query(query)
+        # The matrix scan is numpy work; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                self.similarity_search_by_vector_with_score, embedding, k, **kwargs
+            ),
+        )
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        if path is None:
+            raise ValueError("A path is required to create a LocalVectorStore")
+        store = cls(LocalVectorIndex(path), embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,434 @@
+import json
+import math
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Accept, continue and log W3C trace contexts (the traceparent header)
+TRACE_CONTEXT = os.environ.get("TRACE_CONTEXT", "false").lower() == "true"
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """A named metric with one series per combination of label values"""
+
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for key, value in series:
+                lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [
+            f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = float(value)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0.0)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels):
+        """Observation count and sum of one series"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": series[2], "sum": series[1]}
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        labels = self._labels(key)
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            bucket_labels = _format_labels(labels + [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process in the Prometheus text exposition format.
+
+    Besides the metrics it owns, the registry calls collectors at scrape
+    time: callables returning (name, kind, help, samples) tuples, where
+    samples is a list of (labels dict, value) pairs. They export counters
+    other services already keep, such as cache hits.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    labels = _format_labels(sorted(labels.items()))
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "docbot_stage_duration_seconds",
+    "Time spent in each stage of the chat and ingestion pipelines",
+    ["stage"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "docbot_http_request_duration_seconds",
+    "HTTP request latency, until the last byte of the response",
+    ["method", "route", "status"],
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "docbot_http_requests_in_flight", "HTTP requests being served"
+)
+LLM_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "docbot_llm_requests_in_flight", "Answers being generated by the LLM"
+)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "docbot_llm_time_to_first_token_seconds",
+    "Time from sending a streamed prompt to its first answer token",
+)
+LLM_TOKENS = REGISTRY.counter(
+    "docbot_llm_tokens_total",
+    "Tokens sent to and generated by the LLM (prompt, context, completion)",
+    ["kind"],
+)
+INGESTED_PAGES = REGISTRY.counter(
+    "docbot_ingested_pages_total", "PDF pages parsed by uploads"
+)
+INGESTED_CHUNKS = REGISTRY.counter(
+    "docbot_ingested_chunks_total",
+    "Chunks of uploaded documents by how their vectors were obtained",
+    ["result"],
+)
+
+# (trace id, span id) of the span the current code runs in
+_current_span: ContextVar[Optional[tuple]] = ContextVar(
+    "docbot_current_span", default=None
+)
+
+
+def parse_traceparent(header: Optional[str]):
+    """(trace id, parent span id) of a W3C traceparent header, or None"""
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, _ = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent header continuing the current span, or None outside traces"""
+    span = _current_span.get()
+    if span is None:
+        return None
+    return f"00-{span[0]}-{span[1]}-01"
+
+
+def _log_span(trace_id, span_id, parent_id, name, started, elapsed, **attributes):
+    record = {
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "start": started,
+        "duration_ms": round(elapsed * 1000.0, 3),
+        **attributes,
+    }
+    print(json.dumps(record, default=str))
+
+
+@contextmanager
+def span(name, trace=None, **attributes):
+    """
+    Run the block as a span of the current trace, or of ``trace`` (a
+    (trace id, parent span id) pair; a new trace when None) if given.
+    Spans are logged as JSON lines when TRACE_CONTEXT is on.
+    """
+    if not TRACE_CONTEXT:
+        yield None
+        return
+    parent = trace or _current_span.get()
+    if parent is None:
+        parent = (secrets.token_hex(16), None)
+    span_id = new_span_id()
+    token = _current_span.set((parent[0], span_id))
+    started, wall = time.perf_counter(), time.time()
+    try:
+        yield span_id
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Left in another context, e.g. an async generator closed elsewhere
+            pass
+        _log_span(
+            parent[0],
+            span_id,
+            parent[1],
+            name,
+            wall,
+            time.perf_counter() - started,
+            **attributes,
+        )
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+@contextmanager
+def stage(name):
+    """Time the block into the stage latency histogram (and trace)"""
+    started = time.perf_counter()
+    try:
+        if TRACE_CONTEXT and _current_span.get() is not None:
+            with span(name):
+                yield
+        else:
+            yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def inject_trace_headers(request):
+    """httpx request hook propagating the current trace to outgoing calls"""
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        request.headers["traceparent"] = traceparent
+
+
+async def ainject_trace_headers(request):
+    inject_trace_headers(request)
+
+
+def record_tokens(usage=None, completion=None):
+    """Count a prompt's token usage and an answer's tokens"""
+    for kind in ("prompt", "context"):
+        if usage and usage.get(f"{kind}_tokens"):
+            LLM_TOKENS.inc(usage[f"{kind}_tokens"], kind=kind)
+    if completion:
+        LLM_TOKENS.inc(completion, kind="completion")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing HTTP requests by route template and counting
+    those in flight. With TRACE_CONTEXT on, each request runs in a span
+    continuing the caller's traceparent and returns its own traceparent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        trace = None
+        if TRACE_CONTEXT:
+            headers = dict(scope.get("headers") or [])
+            trace = parse_traceparent(headers.get(b"traceparent", b"").decode())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                traceparent = current_traceparent()
+                if traceparent is not None:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"traceparent", traceparent.encode())
+                    ]
+            await send(message)
+
+        started = time.perf_counter()
+        with HTTP_REQUESTS_IN_FLIGHT.track():
+            try:
+                with span(f"{scope['method']} {scope['path']}", trace=trace):
+                    await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started,
+                    method=scope["method"],
+                    # Templates, not raw paths, keep the label set small
+                    route=getattr(route, "path", "unmatched"),
+                    status=status["code"],
+                )
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
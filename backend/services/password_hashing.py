@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# Processes hashing and verifying passwords; 0 runs bcrypt in the caller
+AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", "2"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_hash_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool for bcrypt, so a burst of logins uses at most
+    AUTH_HASH_WORKERS cores and never holds request threads' GIL
+    """
+    global _pool
+    if _pool is None and AUTH_HASH_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the server process runs model and I/O threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=AUTH_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _discard_hash_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_hash_pool():
+    """Stop the bcrypt worker processes"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _run(function, *args):
+    pool = get_hash_pool()
+    if pool is None:
+        return function(*args)
+    try:
+        return pool.submit(function, *args).result()
+    except BrokenProcessPool:
+        print("Password hashing pool broke, hashing in-process")
+        _discard_hash_pool(pool)
+        return function(*args)
+
+
+async def _arun(function, *args):
+    pool = get_hash_pool()
+    if pool is None:
+        return await asyncio.to_thread(function, *args)
+    try:
+        return await asyncio.wrap_future(pool.submit(function, *args))
+    except BrokenProcessPool:
+        print("Password hashing pool broke, hashing in-process")
+        _discard_hash_pool(pool)
+        return await asyncio.to_thread(function, *args)
+
+
+def warm_up_hash_pool():
+    """Start the bcrypt worker processes before the first signup or login"""
+    pool = get_hash_pool()
+    if pool is None:
+        return
+    # Workers are spawned on demand, one per submission without an idle worker
+    futures = [pool.submit(_hash, "warm-up") for _ in range(AUTH_HASH_WORKERS)]
+    for future in futures:
+        future.result()
+
+
+def hash_password(password: str) -> str:
+    """Hash a password on the hashing pool"""
+    return _run(_hash, password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash on the hashing pool"""
+    return _run(_verify, plain_password, hashed_password)
+
+
+async def ahash_password(password: str) -> str:
+    """Hash a password without blocking the event loop or a request thread"""
+    return await _arun(_hash, password)
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password without blocking the event loop or a request thread"""
+    return await _arun(_verify, plain_password, hashed_password)
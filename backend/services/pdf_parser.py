@@ -0,0 +1,157 @@
+import io
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Documents with at least this many pages are parsed across the process pool
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all uploads for parsing large documents"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the server process runs model and I/O threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _discard_parse_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pages(file_content: bytes, start: int, stop: int) -> List[str]:
+    """Text of pages ``start..stop`` (runs in a pool worker)"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(file_content))
+    return [reader.pages[page].extract_text().strip() for page in range(start, stop)]
+
+
+def _page_texts(file_content, reader, parallel_min_pages, pages_per_task):
+    total_pages = len(reader.pages)
+    if total_pages < max(1, parallel_min_pages):
+        for page in reader.pages:
+            yield page.extract_text().strip()
+        return
+
+    # Keep a bounded number of page ranges in flight and yield them in order,
+    # so memory stays flat however long the document is
+    pool = get_parse_pool()
+    spans = iter(range(0, total_pages, pages_per_task))
+    in_flight = []
+
+    def submit_next():
+        start = next(spans, None)
+        if start is not None:
+            stop = min(start + pages_per_task, total_pages)
+            in_flight.append(pool.submit(_extract_pages, file_content, start, stop))
+
+    for _ in range(PDF_PARSE_WORKERS * 2):
+        submit_next()
+    parsed = 0
+    while in_flight:
+        try:
+            texts = in_flight.pop(0).result()
+        except BrokenProcessPool:
+            # A worker died; parse the rest here and start a fresh pool next time
+            print("PDF parse pool broke, parsing remaining pages in-process")
+            _discard_parse_pool(pool)
+            for page in range(parsed, total_pages):
+                yield reader.pages[page].extract_text().strip()
+            return
+        submit_next()
+        parsed += len(texts)
+        yield from texts
+
+
+def iter_pdf_pages(
+    file_content: bytes,
+    source: str,
+    parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+) -> Iterator[Document]:
+    """
+    Lazily parse a PDF held in memory into one Document per page, with the
+    same page metadata as PyPDFLoader (source, page, page_label, total_pages)
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(file_content))
+    total_pages = len(reader.pages)
+    texts = _page_texts(file_content, reader, parallel_min_pages, pages_per_task)
+    for page, text in enumerate(texts):
+        yield Document(
+            page_content=text,
+            metadata={
+                "source": source,
+                "total_pages": total_pages,
+                "page": page,
+                "page_label": reader.page_labels[page],
+            },
+        )
+
+
+_DONE = object()
+
+
+def prefetch(items: Iterable, max_buffered: int) -> Iterator:
+    """
+    Produce ``items`` on a background thread, at most ``max_buffered``
+    ahead of the consumer, so producing and consuming overlap
+    """
+    buffer = queue.Queue(maxsize=max(1, max_buffered))
+    stopped = threading.Event()
+
+    def put(entry):
+        # Give up once the consumer has gone away rather than block forever
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # Let the producer exit if the consumer stopped early
+        stopped.set()
@@ -0,0 +1,27 @@
+import asyncio
+import functools
+from typing import Any, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_pinecone import PineconeVectorStore
+
+
+class PooledPineconeVectorStore(PineconeVectorStore):
+    """
+    PineconeVectorStore whose async searches run the sync query on a worker
+    thread, through the shared connection-pooled client.
+
+    Built on a sync index handle, langchain_pinecone opens and closes a new
+    PineconeAsyncio client for every async search, paying connection setup
+    on each query.
+    """
+
+    async def asimilarity_search_by_vector_with_score(
+        self, embedding: List[float], *, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                self.similarity_search_by_vector_with_score, embedding, k=k, **kwargs
+            ),
+        )
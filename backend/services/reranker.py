@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from services.chunk_manifest import chunk_hash
+from services.embedding_cache import normalize_query
+from services.metrics import stage
+
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.environ.get(
+    "RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+)
+# Candidates retrieved for re-ranking per request
+RERANK_FETCH_K = int(os.environ.get("RERANK_FETCH_K", "30"))
+# Time allowed for scoring before falling back to the retrieval order
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "300"))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", "20000"))
+# Scoring passes queued or running at once; requests beyond it fall back
+RERANK_MAX_PENDING = int(os.environ.get("RERANK_MAX_PENDING", "2"))
+
+
+class CrossEncoderReranker:
+    """
+    Re-orders retrieved chunks by cross-encoder relevance to the query.
+
+    All (query, chunk) pairs of a request are scored in one batched CPU
+    pass on a dedicated worker thread. Scores are cached per normalized
+    query and chunk hash. When scoring does not finish within the latency
+    budget, the retrieval order is kept; the pass still completes in the
+    background and fills the cache for the next request. At most
+    ``max_pending`` passes are queued or running; requests beyond that
+    fall back without queueing one. The model is loaded on the first
+    pass, so early requests may fall back.
+    """
+
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL_NAME,
+        budget_ms: float = RERANK_BUDGET_MS,
+        batch_size: int = RERANK_BATCH_SIZE,
+        cache_size: int = RERANK_CACHE_SIZE,
+        max_pending: int = RERANK_MAX_PENDING,
+    ):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self._pending = 0
+        self._model = None
+        self._scores = OrderedDict()  # (query, chunk hash) -> score, LRU
+        self._lock = threading.Lock()
+        # One scoring pass at a time; the model uses every core on its own
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._stats = {
+            "requests": 0,
+            "pairs_scored": 0,
+            "cache_hits": 0,
+            "fallbacks": 0,
+        }
+
+    def _get_model(self):
+        """Load the cross-encoder (once per process, on the worker thread)"""
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score(self, query, keys, texts):
+        """Score (query, text) pairs in one batched pass and cache the scores"""
+        scores = self._get_model().predict(
+            [(query, text) for text in texts], batch_size=self.batch_size
+        )
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = float(score)
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+            self._stats["pairs_scored"] += len(keys)
+
+    def rerank(self, query: str, documents: List[Document], k: int) -> List[Document]:
+        """Top-k documents by cross-encoder score, best first"""
+        normalized = normalize_query(query)
+        keys = [(normalized, chunk_hash(doc.page_content)) for doc in documents]
+        with self._lock:
+            self._stats["requests"] += 1
+            missing = [i for i, key in enumerate(keys) if key not in self._scores]
+            self._stats["cache_hits"] += len(keys) - len(missing)
+            busy = bool(missing) and self._pending >= self.max_pending
+            if busy:
+                self._stats["fallbacks"] += 1
+            elif missing:
+                self._pending += 1
+        if busy:
+            return documents[:k]
+
+        if missing:
+            future = self._executor.submit(
+                self._score,
+                query,
+                [keys[i] for i in missing],
+                [documents[i].page_content for i in missing],
+            )
+            future.add_done_callback(self._pass_done)
+            try:
+                future.result(timeout=self.budget_ms / 1000.0)
+            except FutureTimeoutError:
+                # The pass keeps running and fills the cache
+                with self._lock:
+                    self._stats["fallbacks"] += 1
+                return documents[:k]
+            except Exception as e:
+                print(f"Re-ranking failed ({str(e)}), keeping retrieval order")
+                with self._lock:
+                    self._stats["fallbacks"] += 1
+                return documents[:k]
+
+        with self._lock:
+            scores = [self._scores.get(key, float("-inf")) for key in keys]
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        return [documents[i] for i in order[:k]]
+
+    def _pass_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def warm_up(self, text):
+        """Load the cross-encoder on its worker thread and score one pair"""
+        self._executor.submit(
+            lambda: self._get_model().predict([(text, text)], batch_size=1)
+        ).result()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, cache_entries=len(self._scores))
+
+
+class RerankingRetriever(BaseRetriever):
+    """Retrieves a wide candidate set and keeps the k best by re-ranking"""
+
+    retriever: Any
+    reranker: Any
+    k: int = 3
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        documents = self.retriever.invoke(query)
+        with stage("rerank"):
+            return self.reranker.rerank(query, documents, self.k)
+
+    async def _aget_relevant_documents(self, query: str, **kwargs: Any):
+        documents = await self.retriever.ainvoke(query)
+        with stage("rerank"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.reranker.rerank, query, documents, self.k
+            )
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """Get the process-wide cross-encoder reranker"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    return _reranker
+
+
+def get_reranker_stats():
+    """Reranker counters, without loading anything when it was never used"""
+    if _reranker is None:
+        return {"enabled": RERANK_ENABLED}
+    return dict(_reranker.get_stats(), enabled=RERANK_ENABLED)
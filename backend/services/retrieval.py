@@ -0,0 +1,154 @@
+import asyncio
+import os
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from services.chunk_manifest import chunk_hash
+from services.lexical_index import LexicalIndex, get_lexical_index
+from services.metrics import stage
+from services.reranker import (
+    RERANK_ENABLED,
+    RERANK_FETCH_K,
+    RerankingRetriever,
+    get_reranker,
+)
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+# Hybrid is opt-in: BM25 postings exist only where this node ingested them
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "dense")
+DENSE_WEIGHT = float(os.environ.get("RETRIEVAL_DENSE_WEIGHT", "1.0"))
+LEXICAL_WEIGHT = float(os.environ.get("RETRIEVAL_LEXICAL_WEIGHT", "1.0"))
+# Candidates fetched from each retriever per result wanted
+HYBRID_FETCH_FACTOR = 4
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(ranked_lists, weights, k, rrf_k=RRF_K) -> List[Document]:
+    """
+    Fuse ranked document lists: each document scores the sum over lists of
+    weight / (rrf_k + rank). Chunks are matched by content hash, which is
+    also their vector id, so the same chunk from both lists counts once.
+    """
+    scores = {}
+    documents = {}
+    for documents_ranked, weight in zip(ranked_lists, weights):
+        for rank, document in enumerate(documents_ranked):
+            key = chunk_hash(document.page_content)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank + 1)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class LexicalRetriever(BaseRetriever):
+    """
+    BM25 retrieval from a local lexical index; dense retrieval from
+    ``vectorstore`` (if given) while the index has no postings
+    """
+
+    index: LexicalIndex
+    k: int = 4
+    vectorstore: Any = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.vectorstore is not None and len(self.index) == 0:
+            return self.vectorstore.similarity_search(query, k=self.k)
+        with stage("lexical_search"):
+            return self.index.similarity_search(query, self.k)
+
+    async def _aget_relevant_documents(self, query: str, **kwargs: Any):
+        if self.vectorstore is not None and len(self.index) == 0:
+            return await self.vectorstore.asimilarity_search(query, k=self.k)
+        with stage("lexical_search"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.index.similarity_search, query, self.k
+            )
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense and BM25 retrieval fused with weighted reciprocal rank fusion;
+    dense only while the lexical index has no postings
+    """
+
+    vectorstore: Any
+    index: LexicalIndex
+    k: int = 4
+    dense_weight: float = DENSE_WEIGHT
+    lexical_weight: float = LEXICAL_WEIGHT
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if len(self.index) == 0:
+            return self.vectorstore.similarity_search(query, k=self.k)
+        fetch_k = self.k * HYBRID_FETCH_FACTOR
+        with stage("vector_search"):
+            dense = self.vectorstore.similarity_search(query, k=fetch_k)
+        with stage("lexical_search"):
+            lexical = self.index.similarity_search(query, fetch_k)
+        return reciprocal_rank_fusion(
+            [dense, lexical], [self.dense_weight, self.lexical_weight], self.k
+        )
+
+    async def _aget_relevant_documents(self, query: str, **kwargs: Any):
+        if len(self.index) == 0:
+            return await self.vectorstore.asimilarity_search(query, k=self.k)
+        fetch_k = self.k * HYBRID_FETCH_FACTOR
+        with stage("vector_search"):
+            dense = await self.vectorstore.asimilarity_search(query, k=fetch_k)
+        with stage("lexical_search"):
+            lexical = await asyncio.get_running_loop().run_in_executor(
+                None, self.index.similarity_search, query, fetch_k
+            )
+        return reciprocal_rank_fusion(
+            [dense, lexical], [self.dense_weight, self.lexical_weight], self.k
+        )
+
+
+def build_retriever(
+    vectorstore,
+    index_name: Optional[str] = None,
+    k: int = 3,
+    mode: Optional[str] = None,
+    dense_weight: Optional[float] = None,
+    lexical_weight: Optional[float] = None,
+    rerank: Optional[bool] = None,
+) -> BaseRetriever:
+    """
+    Retriever for a retrieval mode: "dense" (vector similarity), "lexical"
+    (BM25) or "hybrid" (both, fused). Falls back to dense retrieval while
+    the index has no lexical postings, e.g. indexes built before them;
+    this is checked per query, so the retriever can be cached.
+    With ``rerank``, RERANK_FETCH_K candidates are retrieved and the k best
+    kept by a cross-encoder.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    fetch_k = max(k, RERANK_FETCH_K) if rerank else k
+
+    index = get_lexical_index(index_name) if index_name else None
+    if mode == "dense" or index is None:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": fetch_k})
+    elif mode == "lexical":
+        retriever = LexicalRetriever(index=index, k=fetch_k, vectorstore=vectorstore)
+    else:
+        retriever = HybridRetriever(
+            vectorstore=vectorstore,
+            index=index,
+            k=fetch_k,
+            dense_weight=DENSE_WEIGHT if dense_weight is None else dense_weight,
+            lexical_weight=(
+                LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+            ),
+        )
+    if rerank:
+        return RerankingRetriever(retriever=retriever, reranker=get_reranker(), k=k)
+    return retriever
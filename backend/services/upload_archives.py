@@ -0,0 +1,68 @@
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_archive(filename: str) -> bool:
+    """Whether an upload is an archive of documents rather than a document"""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _read_limited(stream: BinaryIO, max_bytes: int) -> Optional[bytes]:
+    data = stream.read(max_bytes + 1)
+    return None if len(data) > max_bytes else data
+
+
+def count_archive_pdfs(filename: str, fileobj: BinaryIO) -> int:
+    """
+    Number of PDFs in a zip or tar archive, read from its directory or
+    headers without reading entry contents; ``fileobj`` is rewound after
+    """
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as archive:
+                return sum(
+                    not info.is_dir() and info.filename.lower().endswith(".pdf")
+                    for info in archive.infolist()
+                )
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            return sum(
+                member.isfile() and member.name.lower().endswith(".pdf")
+                for member in archive
+            )
+    finally:
+        fileobj.seek(0)
+
+
+def iter_archive_pdfs(
+    filename: str, fileobj: BinaryIO, max_entry_bytes: int
+) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+    Yield ``(path, content)`` for each PDF in a zip or tar archive, one entry
+    at a time and without extracting anything to disk. ``content`` is None
+    for entries larger than ``max_entry_bytes``. Tar archives are read as a
+    stream, so compressed tarballs are never decompressed as a whole.
+    """
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                if info.file_size > max_entry_bytes:
+                    yield info.filename, None
+                    continue
+                with archive.open(info) as entry:
+                    yield info.filename, _read_limited(entry, max_entry_bytes)
+        return
+
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                continue
+            if member.size > max_entry_bytes:
+                yield member.name, None
+                continue
+            entry = archive.extractfile(member)
+            yield member.name, _read_limited(entry, max_entry_bytes)
@@ -0,0 +1,172 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from services.metrics import observe_stage
+
+UPSERT_MAX_IN_FLIGHT = int(os.environ.get("UPSERT_MAX_IN_FLIGHT", "4"))
+# Pinecone rejects upsert requests over 2MB
+UPSERT_TARGET_BYTES = int(os.environ.get("UPSERT_TARGET_BYTES", str(1536 * 1024)))
+UPSERT_TARGET_LATENCY_MS = float(os.environ.get("UPSERT_TARGET_LATENCY_MS", "1000"))
+UPSERT_MAX_RETRIES = int(os.environ.get("UPSERT_MAX_RETRIES", "4"))
+UPSERT_BACKOFF_SECONDS = 0.5
+UPSERT_MIN_BATCH = 8
+# Most vectors sent in one upsert request
+UPSERT_MAX_BATCH = int(os.environ.get("UPSERT_MAX_BATCH", "200"))
+# Vectors are sent as JSON floats, e.g. "-0.0123456789012345, "
+JSON_BYTES_PER_FLOAT = 20
+# Id, keys and punctuation of one vector in the request body
+VECTOR_OVERHEAD_BYTES = 100
+
+
+def estimate_bytes(document, embedding) -> int:
+    """Rough JSON request payload size of one vector with its metadata"""
+    return (
+        len(embedding) * JSON_BYTES_PER_FLOAT
+        + len(json.dumps(document.page_content))
+        + len(json.dumps(document.metadata, default=str))
+        + VECTOR_OVERHEAD_BYTES
+    )
+
+
+def is_request_too_large(error) -> bool:
+    """Whether an upsert failed because the request body was too large"""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    return status == 413 or (status == 400 and "size" in str(error).lower())
+
+
+class UpsertWriter:
+    """
+    Pipelined writer of pre-computed embeddings to a vector backend index.
+
+    Vectors passed to ``write()`` are regrouped into upsert batches sent by
+    up to ``max_in_flight`` worker threads, so embedding the next batch
+    overlaps with upserting the previous ones. Batches are sized to stay
+    under ``target_bytes`` of payload, halved when an upsert is slower than
+    ``target_latency_ms`` and grown while upserts are fast, up to
+    UPSERT_MAX_BATCH vectors. A batch rejected as too large is split in
+    half; any other failed batch is retried with exponential backoff using
+    the same embeddings.
+    ``on_batch_done(ids)`` is called from a worker thread after each batch.
+    """
+
+    def __init__(
+        self,
+        backend,
+        index_name: str,
+        on_batch_done: Optional[Callable] = None,
+        max_in_flight: int = UPSERT_MAX_IN_FLIGHT,
+        target_bytes: int = UPSERT_TARGET_BYTES,
+        target_latency_ms: float = UPSERT_TARGET_LATENCY_MS,
+        max_retries: int = UPSERT_MAX_RETRIES,
+        backoff_seconds: float = UPSERT_BACKOFF_SECONDS,
+    ):
+        self.backend = backend
+        self.index_name = index_name
+        self.on_batch_done = on_batch_done
+        self.max_in_flight = max(1, max_in_flight)
+        self.target_bytes = target_bytes
+        self.target_latency_ms = target_latency_ms
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.batch_size = min(100, UPSERT_MAX_BATCH)
+        self._pending = []
+        self._pending_bytes = 0
+        self._in_flight = deque()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="upsert"
+        )
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "vectors": 0, "retries": 0, "upsert_ms": 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.flush()
+        self.close()
+
+    def write(self, ids, documents, embeddings):
+        """Queue vectors for upsert; blocks while too many batches are in flight"""
+        for item in zip(ids, documents, embeddings):
+            self._pending.append(item)
+            self._pending_bytes += estimate_bytes(item[1], item[2])
+            if (
+                len(self._pending) >= self.batch_size
+                or self._pending_bytes >= self.target_bytes
+            ):
+                self._dispatch()
+
+    def _dispatch(self):
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        # Wait for the oldest batch once the pipeline is full; also surfaces
+        # a failed batch before more work is queued behind it
+        while len(self._in_flight) >= self.max_in_flight:
+            self._in_flight.popleft().result()
+        while self._in_flight and self._in_flight[0].done():
+            self._in_flight.popleft().result()
+        self._in_flight.append(self._executor.submit(self._upsert, batch))
+
+    def _upsert(self, batch):
+        ids, documents, embeddings = (list(column) for column in zip(*batch))
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                self.backend.add_embeddings(self.index_name, ids, documents, embeddings)
+                break
+            except Exception as e:
+                if is_request_too_large(e) and len(batch) > 1:
+                    # Resending the same batch can't succeed; send halves
+                    half = len(batch) // 2
+                    print(f"Upsert of {len(ids)} vectors too large, splitting")
+                    with self._lock:
+                        self.batch_size = max(UPSERT_MIN_BATCH, half)
+                    self._upsert(batch[:half])
+                    self._upsert(batch[half:])
+                    return
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_seconds * 2**attempt * random.uniform(0.5, 1.5)
+                print(f"Upsert of {len(ids)} vectors failed ({str(e)}), retrying")
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        observe_stage("ingest_upsert", elapsed_ms / 1000.0)
+        self._adapt(len(ids), elapsed_ms)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["vectors"] += len(ids)
+            self._stats["upsert_ms"] += elapsed_ms
+        if self.on_batch_done is not None:
+            self.on_batch_done(ids)
+
+    def _adapt(self, size, elapsed_ms):
+        """Shrink batches after a slow upsert, grow them while upserts are fast"""
+        with self._lock:
+            if elapsed_ms > self.target_latency_ms:
+                self.batch_size = max(UPSERT_MIN_BATCH, size // 2)
+            elif elapsed_ms < self.target_latency_ms / 2 and size >= self.batch_size:
+                self.batch_size = min(UPSERT_MAX_BATCH, int(self.batch_size * 1.5))
+
+    def flush(self):
+        """Send any partial batch and wait for every batch to finish"""
+        self._dispatch()
+        while self._in_flight:
+            self._in_flight.popleft().result()
+        return self.get_stats()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, batch_size=self.batch_size)
@@ -0,0 +1,294 @@
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from services.embedding_service import EMBEDDING_DIMENSION
+from services.local_vector_store import LocalVectorIndex, LocalVectorStore
+
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_DIR = os.environ.get("LOCAL_VECTOR_STORE_DIR", "./vector_data")
+PINECONE_POOL_THREADS = int(os.environ.get("PINECONE_POOL_THREADS", "8"))
+PINECONE_METADATA_TTL_SECONDS = float(
+    os.environ.get("PINECONE_METADATA_TTL_SECONDS", "30")
+)
+PINECONE_READY_TIMEOUT_SECONDS = float(
+    os.environ.get("PINECONE_READY_TIMEOUT_SECONDS", "300")
+)
+PINECONE_READY_POLL_SECONDS = 1.0
+# Pinecone accepts at most 1000 ids per delete request
+PINECONE_DELETE_BATCH_SIZE = 1000
+# Pinecone's index naming rules; local indexes follow them too, so a name
+# is always a single, safe path component
+INDEX_NAME_PATTERN = re.compile(r"^[a-z0-9-]{1,45}$")
+
+
+class InvalidIndexName(ValueError):
+    """Raised for index names that don't match INDEX_NAME_PATTERN"""
+
+
+def validate_index_name(index_name: str) -> str:
+    """Return the index name, or raise InvalidIndexName if it isn't valid"""
+    if not isinstance(index_name, str) or not INDEX_NAME_PATTERN.match(index_name):
+        raise InvalidIndexName(
+            "Index names must be 1-45 lowercase letters, digits or hyphens"
+        )
+    return index_name
+
+
+class VectorBackend(ABC):
+    """Where document indexes live and how to open a VectorStore on them"""
+
+    name = None
+
+    @abstractmethod
+    def ensure_index(self, index_name: str) -> bool:
+        """Create the index if needed; return False if it can't be used"""
+
+    @abstractmethod
+    def list_indexes(self) -> List[str]:
+        """Names of all available indexes"""
+
+    @abstractmethod
+    def get_vectorstore(self, index_name: str, embedding: Embeddings) -> VectorStore:
+        """Open a VectorStore on an existing index"""
+
+    def add_documents(self, index_name, documents, embedding, ids=None):
+        """Embed and add documents to an index"""
+        vectorstore = self.get_vectorstore(index_name, embedding)
+        return vectorstore.add_documents(documents, ids=ids)
+
+    @abstractmethod
+    def add_embeddings(self, index_name, ids, documents, embeddings):
+        """Upsert documents whose embeddings are already computed"""
+
+    @abstractmethod
+    def delete(self, index_name, ids):
+        """Delete vectors by id"""
+
+
+class PineconeBackend(VectorBackend):
+    """
+    Indexes hosted on Pinecone serverless.
+
+    One connection-pooled client and one handle per index are shared by the
+    whole process. Index listings and descriptions are cached for
+    PINECONE_METADATA_TTL_SECONDS and dropped when an index is created.
+    """
+
+    name = "pinecone"
+
+    def __init__(self):
+        self._client = None
+        self._handles = {}
+        self._listing = None  # (index names, expiry)
+        self._descriptions = {}  # index name -> (description, expiry)
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+
+    def get_client(self):
+        """The shared Pinecone client"""
+        with self._lock:
+            if self._client is None:
+                # The Pinecone SDK is imported on first use, not at startup
+                from pinecone import Pinecone
+
+                self._client = Pinecone(
+                    api_key=os.environ["PINECONE_API_KEY"],
+                    pool_threads=PINECONE_POOL_THREADS,
+                )
+            return self._client
+
+    def get_index(self, index_name):
+        """Cached data-plane handle for an index"""
+        with self._lock:
+            handle = self._handles.get(index_name)
+        if handle is None:
+            # Opening by host skips the SDK's own (uncached) describe call
+            host = self.describe_index(index_name).host
+            handle = self.get_client().Index(host=host)
+            with self._lock:
+                handle = self._handles.setdefault(index_name, handle)
+        return handle
+
+    def _invalidate_metadata(self):
+        with self._lock:
+            self._listing = None
+            self._descriptions.clear()
+
+    def list_indexes(self):
+        with self._lock:
+            if self._listing is not None and self._listing[1] > time.monotonic():
+                return list(self._listing[0])
+        names = [index.name for index in self.get_client().list_indexes()]
+        with self._lock:
+            self._listing = (names, time.monotonic() + PINECONE_METADATA_TTL_SECONDS)
+        return list(names)
+
+    def describe_index(self, index_name):
+        """Index description (dimension, host, status), cached briefly"""
+        with self._lock:
+            cached = self._descriptions.get(index_name)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+        description = self.get_client().describe_index(index_name)
+        with self._lock:
+            self._descriptions[index_name] = (
+                description,
+                time.monotonic() + PINECONE_METADATA_TTL_SECONDS,
+            )
+        return description
+
+    def _wait_until_ready(self, index_name):
+        """Poll a new index until Pinecone reports it ready"""
+        # Deliberately bypasses describe_index: a cached "not ready" would
+        # stall the poll for PINECONE_METADATA_TTL_SECONDS
+        deadline = time.monotonic() + PINECONE_READY_TIMEOUT_SECONDS
+        while True:
+            status = self.get_client().describe_index(index_name).status
+            if status.ready:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"Index {index_name} not ready after "
+                    f"{PINECONE_READY_TIMEOUT_SECONDS}s (state: {status.state})"
+                )
+            time.sleep(PINECONE_READY_POLL_SECONDS)
+
+    def ensure_index(self, index_name):
+        try:
+            # Check if index exists
+            if index_name in self.list_indexes():
+                return True
+
+            with self._create_lock:
+                self._invalidate_metadata()
+                if index_name not in self.list_indexes():
+                    from pinecone import ServerlessSpec
+
+                    print(f"Creating new index: {index_name}")
+                    self.get_client().create_index(
+                        name=index_name,
+                        dimension=EMBEDDING_DIMENSION,
+                        metric="cosine",
+                        spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+                        timeout=-1,  # we poll readiness ourselves
+                    )
+                    self._wait_until_ready(index_name)
+                    self._invalidate_metadata()
+
+            return True
+        except Exception as e:
+            print(f"Error creating/accessing index: {str(e)}")
+            return False
+
+    def get_vectorstore(self, index_name, embedding):
+        from services.pinecone_store import PooledPineconeVectorStore
+
+        return PooledPineconeVectorStore(
+            index=self.get_index(index_name), embedding=embedding
+        )
+
+    def add_embeddings(self, index_name, ids, documents, embeddings):
+        index = self.get_index(index_name)
+        # PineconeVectorStore reads the chunk text back from the "text" key
+        index.upsert(
+            vectors=[
+                (
+                    id_,
+                    list(map(float, embedding)),
+                    {**doc.metadata, "text": doc.page_content},
+                )
+                for id_, doc, embedding in zip(ids, documents, embeddings)
+            ]
+        )
+        return list(ids)
+
+    def delete(self, index_name, ids):
+        index = self.get_index(index_name)
+        ids = list(ids)
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+            index.delete(ids=ids[start : start + PINECONE_DELETE_BATCH_SIZE])
+
+
+class LocalBackend(VectorBackend):
+    """
+    Indexes stored on local disk, one directory per index, searched
+    in-process with no network round-trip
+    """
+
+    name = "local"
+
+    def __init__(self, base_dir: str = LOCAL_VECTOR_STORE_DIR):
+        self.base_dir = base_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get_index(self, index_name: str) -> LocalVectorIndex:
+        """Load an index from disk (once per process)"""
+        validate_index_name(index_name)
+        with self._lock:
+            index = self._indexes.get(index_name)
+            if index is None:
+                index = LocalVectorIndex(os.path.join(self.base_dir, index_name))
+                self._indexes[index_name] = index
+            return index
+
+    def ensure_index(self, index_name):
+        try:
+            self.get_index(index_name)
+            return True
+        except Exception as e:
+            print(f"Error creating/accessing index: {str(e)}")
+            return False
+
+    def list_indexes(self):
+        if not os.path.isdir(self.base_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.base_dir)
+            if os.path.isdir(os.path.join(self.base_dir, name))
+        )
+
+    def get_vectorstore(self, index_name, embedding):
+        return LocalVectorStore(self.get_index(index_name), embedding)
+
+    def add_embeddings(self, index_name, ids, documents, embeddings):
+        return self.get_index(index_name).add(
+            ids,
+            [doc.page_content for doc in documents],
+            embeddings,
+            [doc.metadata for doc in documents],
+        )
+
+    def delete(self, index_name, ids):
+        self.get_index(index_name).delete(list(ids))
+
+
+_backend: Optional[VectorBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_vector_backend(name: str = VECTOR_BACKEND) -> VectorBackend:
+    """Create a vector backend by name ("pinecone" or "local")"""
+    if name == PineconeBackend.name:
+        return PineconeBackend()
+    if name == LocalBackend.name:
+        return LocalBackend()
+    raise ValueError(f"Unknown vector backend: {name}")
+
+
+def get_vector_backend() -> VectorBackend:
+    """Get the vector backend configured for this process"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_vector_backend()
+    return _backend
@@ -1,6 +1,36 @@
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from functools import lru_cache
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from services.embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+from services.embedding_service import QueryBatcher, get_embedding_engine
+from services.metrics import stage
+from services.vector_backends import get_vector_backend
+
+DEFAULT_INDEX_NAME = "langchain-integration-index"
+# Vectorstores kept open at once, least recently used dropped first
+VECTORSTORE_CACHE_SIZE = int(os.environ.get("VECTORSTORE_CACHE_SIZE", "32"))
+
+
+class TimedQueryEmbeddings(Embeddings):
+    """Times every query embedding (cache hits included) as a pipeline stage"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        with stage("query_embedding"):
+            return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        with stage("query_embedding"):
+            return await self.embeddings.aembed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
 
 
 class VectorStoreService:
@@ -9,53 +39,135 @@ class VectorStoreService:
     from connect_memory_with_llm.py
     """
 
-    def __init__(self):
-        self._vectorstore = None
+    def __init__(self, backend=None, cache_size=VECTORSTORE_CACHE_SIZE):
+        self.backend = backend or get_vector_backend()
+        self.cache_size = max(1, cache_size)
+        self._vectorstores = OrderedDict()  # index name -> vectorstore, LRU
         self._embedding_model = None
-        self._current_index = "langchain-integration-index"  # Default index
+        self._query_batcher = None
+        self._query_cache = None
+        self._query_embeddings = None
+        self._default_index = DEFAULT_INDEX_NAME
+        self._user_indexes = {}  # user id -> selected index name
+        self._index_listeners = []
+        self._lock = threading.Lock()
 
-    @lru_cache(maxsize=1)
     def _get_embedding_model(self):
-        """Get the embedding model (cached for performance)"""
+        """Get the process-wide shared embedding engine"""
         if self._embedding_model is None:
-            self._embedding_model = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
+            self._embedding_model = get_embedding_engine()
         return self._embedding_model
 
-    def get_vectorstore(self):
+    def _get_query_embeddings(self):
         """
-        Get the vector store from existing Pinecone index
-        Replicates the @st.cache_resource get_vectorstore() function
+        Get the embeddings used for retrieval: repeated queries are served
+        from the query cache, the rest go through the batching queue
         """
-        if self._vectorstore is None:
-            try:
-                # Initialize embedding model (same as used in create_memory_for_llm.py)
-                embedding_model = self._get_embedding_model()
+        if self._query_embeddings is None:
+            engine = self._get_embedding_model()
+            self._query_batcher = QueryBatcher(engine)
+            self._query_cache = QueryEmbeddingCache(engine.model_name)
+            self._query_embeddings = TimedQueryEmbeddings(
+                CachedQueryEmbeddings(self._query_batcher, self._query_cache)
+            )
+        return self._query_embeddings
 
-                # Use current index name
-                index_name = self._current_index
+    def embed_query(self, query):
+        """Embed a query the same way retrieval does"""
+        return self._get_query_embeddings().embed_query(query)
 
-                # Create vector store from existing index
-                self._vectorstore = PineconeVectorStore(
-                    index_name=index_name, embedding=embedding_model
-                )
+    async def aembed_query(self, query):
+        """Asynchronously embed a query the same way retrieval does"""
+        return await self._get_query_embeddings().aembed_query(query)
+
+    def warm_up_embeddings(self, text):
+        """Load the embedding model and run one forward pass"""
+        self._get_query_embeddings()
+        self._get_embedding_model().embed_query(text)
 
-            except Exception as e:
-                print(f"Error initializing vector store: {str(e)}")
-                return None
+    def warm_up_vectorstore(self):
+        """Open the default index's vector store (and the backend's client)"""
+        if self.get_vectorstore() is None:
+            raise RuntimeError(f"Could not open index {self._default_index}")
 
-        return self._vectorstore
+    def get_query_batcher_stats(self):
+        """Get batch size and queue wait metrics for query embedding"""
+        self._get_query_embeddings()
+        return self._query_batcher.get_stats()
 
-    def switch_index(self, index_name):
-        """Switch to a different Pinecone index"""
-        self._current_index = index_name
-        self._vectorstore = None  # Reset to force reload with new index
+    def get_query_cache_stats(self):
+        """Get hit/miss counters for the query embedding cache"""
+        self._get_query_embeddings()
+        return self._query_cache.get_stats()
 
-    def get_current_index(self):
-        """Get the current index name"""
-        return self._current_index
+    def get_vectorstore(self, index_name=None):
+        """
+        Get the vector store for an index (the default index when None) on the
+        configured backend. Vector stores for recently used indexes are kept
+        open, so requests for different indexes don't rebuild each other's.
+        """
+        index_name = index_name or self._default_index
+        with self._lock:
+            vectorstore = self._vectorstores.get(index_name)
+            if vectorstore is not None:
+                self._vectorstores.move_to_end(index_name)
+                return vectorstore
+
+        try:
+            # Initialize embedding model (same as used in create_memory_for_llm.py)
+            embedding_model = self._get_query_embeddings()
+
+            # Create vector store from existing index
+            with stage("vectorstore_open"):
+                vectorstore = self.backend.get_vectorstore(index_name, embedding_model)
+
+        except Exception as e:
+            print(f"Error initializing vector store: {str(e)}")
+            return None
+
+        evicted = []
+        with self._lock:
+            vectorstore = self._vectorstores.setdefault(index_name, vectorstore)
+            self._vectorstores.move_to_end(index_name)
+            while len(self._vectorstores) > self.cache_size:
+                evicted.append(self._vectorstores.popitem(last=False)[0])
+        for evicted_index in evicted:
+            self._notify(evicted_index)
+        return vectorstore
+
+    def add_index_listener(self, callback):
+        """Register a callback invoked with an index's name when its store is dropped"""
+        self._index_listeners.append(callback)
 
-    def reset_vectorstore(self):
-        """Reset the cached vector store (useful for testing)"""
-        self._vectorstore = None
+    def _notify(self, index_name):
+        for callback in self._index_listeners:
+            callback(index_name)
+
+    def switch_index(self, index_name, user_id=None):
+        """
+        Select the index a user chats with (or the default index for users
+        without a selection, when ``user_id`` is None)
+        """
+        with self._lock:
+            if user_id is None:
+                self._default_index = index_name
+            else:
+                self._user_indexes[user_id] = index_name
+
+    def get_current_index(self, user_id=None):
+        """Get the index selected by a user, or the default index"""
+        with self._lock:
+            return self._user_indexes.get(user_id, self._default_index)
+
+    def reset_vectorstore(self, index_name=None):
+        """Drop cached vector stores for an index, or all (useful for testing)"""
+        with self._lock:
+            if index_name is None:
+                dropped = list(self._vectorstores)
+                self._vectorstores.clear()
+            else:
+                dropped = (
+                    [index_name] if self._vectorstores.pop(index_name, None) else []
+                )
+        for dropped_index in dropped:
+            self._notify(dropped_index)
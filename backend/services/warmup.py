@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+# Load models and open clients in the background at startup
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+# Warm-up steps to run (see main.py); unknown names are ignored
+WARMUP_STEPS = [
+    step.strip()
+    for step in os.environ.get(
+        "WARMUP_STEPS", "embedding,vectorstore,llm,ingestion,auth,reranker"
+    ).split(",")
+    if step.strip()
+]
+# Text embedded and tokenized to exercise the models
+WARMUP_TEXT = "What does this document say about warming up?"
+
+
+class Warmup:
+    """
+    Runs warm-up steps once, side by side on background threads, and
+    reports readiness.
+
+    The service is ready when every step has finished. A failing step is
+    logged and reported but doesn't hold readiness back: whatever it
+    prepares is loaded again on first use.
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], object]]):
+        self.steps = dict(steps)
+        self._results = {name: {"status": "pending"} for name in self.steps}
+        self._started_at: Optional[float] = None
+        self._seconds: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start warming up (once); ready at once when there are no steps"""
+        with self._lock:
+            if self._thread is not None or self._done.is_set():
+                return
+            self._started_at = time.perf_counter()
+            if not self.steps:
+                self._seconds = 0.0
+                self._done.set()
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="warmup", daemon=True
+            )
+            self._thread.start()
+
+    def _run_step(self, name):
+        with self._lock:
+            self._results[name] = {"status": "running"}
+        started = time.perf_counter()
+        try:
+            self.steps[name]()
+            result = {"status": "done"}
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {str(e)}")
+            result = {"status": "failed", "error": str(e)}
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._results[name] = result
+
+    def _run(self):
+        try:
+            with ThreadPoolExecutor(
+                max_workers=len(self.steps), thread_name_prefix="warmup"
+            ) as executor:
+                list(executor.map(self._run_step, self.steps))
+        finally:
+            with self._lock:
+                self._seconds = round(time.perf_counter() - self._started_at, 3)
+            print(f"Warm-up finished in {self._seconds:.1f}s")
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until warm-up has finished; False on timeout"""
+        return self._done.wait(timeout)
+
+    def get_status(self):
+        """Readiness and per-step results"""
+        with self._lock:
+            if self._done.is_set():
+                status = "ready"
+            elif self._started_at is None:
+                status = "pending"
+            else:
+                status = "warming_up"
+            return {
+                "ready": status == "ready",
+                "status": status,
+                "seconds": self._seconds,
+                "steps": {name: dict(result) for name, result in self._results.items()},
+            }
@@ -1,3 +1,6 @@
+from unittest.mock import patch, MagicMock
+
+
 def test_health_check(client):
     """Test the health check endpoint"""
     response = client.get("/api/health")
@@ -12,12 +15,304 @@ def test_root_endpoint(client):
     assert "message" in response.json()
 
 
+def test_ready_endpoint_waits_for_warmup(client):
+    """Test the readiness probe fails until the warm-up has finished"""
+    import threading
+    import main
+    from services.warmup import Warmup
+
+    release = threading.Event()
+    warmup = Warmup({"embedding": lambda: release.wait(5)})
+    with patch.object(main, "warmup", warmup):
+        assert client.get("/api/ready").status_code == 503
+        warmup.start()
+        response = client.get("/api/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "warming_up"
+
+        release.set()
+        warmup.wait(5)
+        response = client.get("/api/ready")
+    assert response.status_code == 200
+    assert response.json()["steps"]["embedding"]["status"] == "done"
+
+
+def test_stats_endpoint(client):
+    """Test the pipeline stats endpoint"""
+    response = client.get("/api/stats")
+    assert response.status_code == 200
+    assert "batches" in response.json()["query_batcher"]
+    assert "hits" in response.json()["query_cache"]
+
+
+def test_chat_serves_cached_answer_for_repeat_query(client):
+    """Test a repeated query is answered without calling the LLM again"""
+    import main
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock()
+    main.answer_cache.invalidate(main.vector_service.get_current_index())
+    llm_response = {"result": "Refunds within 30 days", "source_documents": []}
+    try:
+        with patch.object(
+            main.vector_service, "get_vectorstore", return_value=MagicMock()
+        ), patch.object(
+            main.vector_service, "aembed_query", return_value=[0.6, 0.8]
+        ), patch.object(
+            main.llm_service, "aget_response", return_value=llm_response
+        ) as get_response:
+            first = client.post("/api/chat", json={"query": "refund policy?"})
+            second = client.post("/api/chat", json={"query": "Refund policy"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert first.json() == second.json()
+    assert second.json()["result"] == "Refunds within 30 days"
+    get_response.assert_called_once()
+
+
+def test_metrics_endpoint_reports_stages_and_caches(client):
+    """Test /metrics exports request latency, stage timings and cache hits"""
+    import main
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock()
+    main.answer_cache.invalidate(main.vector_service.get_current_index())
+    llm_response = {"result": "Refunds within 30 days", "source_documents": []}
+    try:
+        with patch.object(
+            main.vector_service, "get_vectorstore", return_value=MagicMock()
+        ), patch.object(
+            main.vector_service, "aembed_query", return_value=[0.6, 0.8]
+        ), patch.object(
+            main.llm_service, "aget_response", return_value=llm_response
+        ):
+            client.post("/api/chat", json={"query": "refund policy?"})
+            client.post("/api/chat", json={"query": "refund policy?"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'docbot_http_request_duration_seconds_count{method="POST",'
+        'route="/api/chat",status="200"}'
+    ) in response.text
+    assert 'docbot_stage_duration_seconds_count{stage="answer_cache_lookup"}' in (
+        response.text
+    )
+    assert 'docbot_stage_duration_seconds_count{stage="response_formatting"}' in (
+        response.text
+    )
+    assert 'docbot_cache_hits_total{cache="answer"}' in response.text
+    assert "docbot_http_requests_in_flight 1" in response.text
+
+
+def test_trace_context_is_continued(client):
+    """Test a traceparent header is continued in the response's traceparent"""
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    with patch("services.metrics.TRACE_CONTEXT", True):
+        response = client.get(
+            "/api/health",
+            headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+        )
+        untraced = client.get("/api/health")
+
+    assert response.headers["traceparent"].startswith(f"00-{trace_id}-")
+    assert not response.headers["traceparent"].endswith("00f067aa0ba902b7-01")
+    assert untraced.headers["traceparent"].split("-")[1] != trace_id
+    assert "traceparent" not in client.get("/api/health").headers
+
+
+def test_chat_stream_sends_tokens_then_sources(client):
+    """Test the streaming endpoint emits token, sources and done events"""
+    import main
+
+    async def astream_response(query, vectorstore, **kwargs):
+        yield "token", "Hello"
+        yield "token", " world"
+        yield "sources", [MagicMock(page_content="chunk", metadata={"page": 1})]
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock()
+    try:
+        with patch.object(
+            main.vector_service, "get_vectorstore", return_value=MagicMock()
+        ), patch.object(
+            main.vector_service, "aembed_query", return_value=[0.28, 0.96]
+        ), patch.object(
+            main.llm_service, "astream_response", side_effect=astream_response
+        ):
+            main.answer_cache.invalidate(main.vector_service.get_current_index())
+            response = client.post("/api/chat/stream", json={"query": "hi"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        line.split(": ", 1)[1]
+        for line in response.text.splitlines()
+        if line.startswith("event: ")
+    ]
+    assert events == ["token", "token", "sources", "done"]
+    assert '"page_content": "chunk"' in response.text
+
+
+def test_chat_stream_without_auth(client):
+    """Test streaming chat endpoint without authentication"""
+    response = client.post("/api/chat/stream", json={"query": "test question"})
+    assert response.status_code == 403  # Forbidden (no auth header)
+
+
 def test_upload_endpoint_without_auth(client):
     """Test upload endpoint without authentication"""
     response = client.post("/api/upload")
     assert response.status_code == 403  # Forbidden (no auth header)
 
 
+def test_upload_job_is_private_to_its_owner(client, tmp_path):
+    """Test upload jobs can only be read by the user who queued them"""
+    import main
+    from services.ingestion_queue import IngestionQueue
+
+    user = MagicMock(id=1)
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    queue = IngestionQueue(MagicMock(), data_dir=str(tmp_path))
+    queue._executor = MagicMock()  # keep the job queued
+    try:
+        with patch.object(main, "ingestion_queue", queue):
+            response = client.post(
+                "/api/upload",
+                files={"file": ("doc.pdf", b"%PDF-1.4", "application/pdf")},
+            )
+            assert response.status_code == 200
+            job_id = response.json()["details"]["job_id"]
+            assert response.json()["details"]["status"] == "queued"
+            # Known before processing, so clients can switch to it when done
+            index_name = response.json()["details"]["index_name"]
+            assert index_name.startswith("user-docs-")
+
+            response = client.get(f"/api/upload/jobs/{job_id}")
+            assert response.status_code == 200
+            assert response.json()["filename"] == "doc.pdf"
+            assert response.json()["index_name"] == index_name
+
+            user.id = 2
+            response = client.get(f"/api/upload/jobs/{job_id}")
+            assert response.status_code == 404
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_bulk_upload_queues_each_document(client, tmp_path):
+    """Test a bulk upload queues PDFs from files and archives separately"""
+    import io
+    import zipfile
+    import main
+    from services.ingestion_queue import IngestionQueue
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("manuals/a.pdf", b"%PDF-a")
+        zf.writestr("manuals/b.pdf", b"%PDF-b")
+        zf.writestr("notes.txt", b"skipped")
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock(id=1)
+    queue = IngestionQueue(MagicMock(), data_dir=str(tmp_path))
+    queue._executor = MagicMock()  # keep the jobs queued
+    try:
+        with patch.object(main, "ingestion_queue", queue):
+            response = client.post(
+                "/api/upload/bulk",
+                data={"index_name": "customer-docs"},
+                files=[
+                    ("files", ("docs.zip", archive.getvalue(), "application/zip")),
+                    ("files", ("c.pdf", b"%PDF-c", "application/pdf")),
+                    ("files", ("d.docx", b"nope", "application/octet-stream")),
+                ],
+            )
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["queued"], body["rejected"]) == (3, 1)
+    assert [f["filename"] for f in body["files"]] == [
+        "docs.zip/manuals/a.pdf",
+        "docs.zip/manuals/b.pdf",
+        "c.pdf",
+        "d.docx",
+    ]
+    job = queue.get_job(body["files"][0]["job_id"])
+    assert job["index_name"] == "customer-docs"
+    assert job["user_id"] == 1
+
+
+def test_bulk_upload_refused_whole_when_queue_is_full(client, tmp_path):
+    """Test a bulk upload larger than the queue's room queues nothing"""
+    import main
+    from services.ingestion_queue import IngestionQueue
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock(id=1)
+    queue = IngestionQueue(MagicMock(), data_dir=str(tmp_path), max_pending=2)
+    queue._executor = MagicMock()  # keep the jobs queued
+    try:
+        with patch.object(main, "ingestion_queue", queue):
+            response = client.post(
+                "/api/upload/bulk",
+                files=[
+                    ("files", (f"{name}.pdf", b"%PDF", "application/pdf"))
+                    for name in "abc"
+                ],
+            )
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 503
+    assert queue.get_stats() == {"workers": queue.workers, "pending": 0, "jobs": {}}
+
+
+def test_switch_index_is_per_user(client):
+    """Test one user switching index doesn't move other users' chats"""
+    import main
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock(id=41)
+    try:
+        response = client.post("/api/switch-index", json={"index_name": "docs-41"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert main.vector_service.get_current_index(41) == "docs-41"
+    assert main.vector_service.get_current_index(42) != "docs-41"
+
+
+def test_invalid_index_names_are_rejected(client):
+    """Test index names that could escape the data directory get a 400"""
+    import main
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: MagicMock(id=41)
+    try:
+        for name in ["../../etc", "Docs", "a" * 46, ""]:
+            response = client.post("/api/switch-index", json={"index_name": name})
+            assert response.status_code == 400
+            response = client.post(
+                "/api/chat", json={"query": "hi", "index_name": name}
+            )
+            assert response.status_code == 400
+        response = client.post(
+            "/api/upload/bulk",
+            data={"index_name": "../docs"},
+            files=[("files", ("a.pdf", b"%PDF-a", "application/pdf"))],
+        )
+        assert response.status_code == 400
+        # Other validation errors are unchanged
+        assert client.post("/api/chat", json={}).status_code == 422
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert main.vector_service.get_current_index(41) != "../../etc"
+
+
 def test_indexes_endpoint_without_auth(client):
     """Test indexes endpoint without authentication"""
     response = client.get("/api/indexes")
@@ -47,3 +342,30 @@ def test_auth_login_endpoint_invalid(client):
     login_data = {"email": "nonexistent@example.com", "password": "wrongpassword"}
     response = client.post("/api/auth/login", json=login_data)
     assert response.status_code == 401  # Unauthorized
+
+
+def test_authenticated_requests_reuse_cached_principal(client):
+    """Test repeat requests skip the user lookup until the user is deactivated"""
+    import uuid
+    import main
+
+    name = f"cached-{uuid.uuid4().hex[:8]}"
+    credentials = {"email": f"{name}@example.com", "password": "testpassword123"}
+    client.post("/api/auth/signup", json={"username": name, **credentials})
+    token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with patch.object(
+        main.AuthService,
+        "get_user_by_username",
+        wraps=main.AuthService.get_user_by_username,
+    ) as lookup:
+        assert client.get("/api/auth/me", headers=headers).json()["username"] == name
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+        assert lookup.call_count == 1
+
+        assert client.post("/api/auth/deactivate", headers=headers).status_code == 200
+        response = client.get("/api/auth/me", headers=headers)
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Inactive user"
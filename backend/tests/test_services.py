@@ -1,8 +1,332 @@
+import asyncio
 import os
-from unittest.mock import patch, MagicMock
+import threading
+import numpy as np
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from services.answer_cache import SemanticAnswerCache
+from services.embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+from services.embedding_service import (
+    EmbeddingEngine,
+    QueryBatcher,
+    get_embedding_engine,
+)
+from services.local_vector_store import LocalVectorIndex, LocalVectorStore
+from services.vector_backends import (
+    InvalidIndexName,
+    LocalBackend,
+    PineconeBackend,
+    validate_index_name,
+)
 from services.vector_service import VectorStoreService
 from services.llm_service import LLMService
+from services.chunk_embedding_store import ChunkEmbeddingStore
+from services.chunk_manifest import ChunkManifest, chunk_hash
+from services.context_packer import ContextPacker
 from services.document_processor import DocumentProcessor
+from services.ingestion_queue import IngestionQueue, IngestionQueueFull
+from services.lexical_index import LexicalIndex, get_lexical_index, tokenize
+from services.pdf_parser import iter_pdf_pages, prefetch
+from services.quantization import QuantizedCodes
+from services.reranker import CrossEncoderReranker, RerankingRetriever
+from services.retrieval import (
+    HybridRetriever,
+    build_retriever,
+    reciprocal_rank_fusion,
+)
+from services.upload_archives import (
+    count_archive_pdfs,
+    is_archive,
+    iter_archive_pdfs,
+)
+from services.upsert_writer import UPSERT_MAX_BATCH, UpsertWriter, estimate_bytes
+
+
+def make_pdf(page_texts):
+    """Build an in-memory PDF with one line of text per page"""
+    import io
+    from pypdf import PdfWriter
+    from pypdf.generic import DictionaryObject, NameObject, StreamObject
+
+    writer = PdfWriter()
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+    for text in page_texts:
+        page = writer.add_blank_page(612, 792)
+        content = StreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def lexical_indexes(tmp_path):
+    """Lexical index getter keeping indexes under a temporary directory"""
+    indexes = {}
+
+    def get(index_name):
+        if index_name not in indexes:
+            indexes[index_name] = LexicalIndex(str(tmp_path / "lexical" / index_name))
+        return indexes[index_name]
+
+    return get
+
+
+class TestEmbeddingEngine:
+    """Test shared Embedding Engine"""
+
+    def test_engine_is_shared(self):
+        """Test both services use the same process-wide engine"""
+        vector_service = VectorStoreService()
+        processor = DocumentProcessor()
+        assert vector_service._get_embedding_model() is get_embedding_engine()
+        assert processor._get_embedding_model() is get_embedding_engine()
+
+    def test_concurrent_calls_are_batched(self):
+        """Test calls queued during a forward pass run as one batch"""
+        engine = EmbeddingEngine()
+        started = threading.Event()
+        release = threading.Event()
+        batches = []
+
+        def embed_documents(texts):
+            batches.append(list(texts))
+            started.set()
+            release.wait(timeout=5)
+            return [[float(len(text))] for text in texts]
+
+        engine._model = MagicMock()
+        engine._model.embed_documents.side_effect = embed_documents
+
+        results = {}
+        first = threading.Thread(
+            target=lambda: results.update(a=engine.embed_query("a"))
+        )
+        first.start()
+        started.wait(timeout=5)
+
+        waiters = [
+            threading.Thread(
+                target=lambda t=text: results.update({t: engine.embed_query(t)})
+            )
+            for text in ["bb", "ccc"]
+        ]
+        for thread in waiters:
+            thread.start()
+        while len(engine._pending) < 2:
+            pass
+        release.set()
+        for thread in [first] + waiters:
+            thread.join(timeout=5)
+
+        assert batches[0] == ["a"]
+        assert sorted(batches[1]) == ["bb", "ccc"]
+        assert results == {"a": [1.0], "bb": [2.0], "ccc": [3.0]}
+
+
+class TestQueryBatcher:
+    """Test query micro-batching"""
+
+    def test_queries_within_window_share_a_batch(self):
+        """Test queries queued inside the window are embedded together"""
+        engine = MagicMock()
+        engine.embed_documents.side_effect = lambda texts: [
+            [float(len(text))] for text in texts
+        ]
+        batcher = QueryBatcher(engine, window_ms=200, max_batch_size=3)
+
+        futures = [batcher.submit(text) for text in ["a", "bb", "ccc"]]
+        assert [future.result(timeout=5) for future in futures] == [
+            [1.0],
+            [2.0],
+            [3.0],
+        ]
+        engine.embed_documents.assert_called_once_with(["a", "bb", "ccc"])
+
+        stats = batcher.get_stats()
+        assert stats["batches"] == 1
+        assert stats["queries"] == 3
+        assert stats["max_batch_size"] == 3
+        assert stats["batch_size_histogram"]["4"] == 1
+
+    def test_errors_propagate_to_callers(self):
+        """Test an engine failure is raised in every waiting caller"""
+        engine = MagicMock()
+        engine.embed_documents.side_effect = RuntimeError("model failed")
+        batcher = QueryBatcher(engine, window_ms=0)
+
+        with pytest.raises(RuntimeError, match="model failed"):
+            batcher.embed_query("a")
+
+    def test_cancelled_waiter_does_not_stop_the_batch(self):
+        """Test a waiter cancelled mid-batch doesn't strand the others"""
+        engine = MagicMock()
+        engine.embed_documents.side_effect = lambda texts: [
+            [float(len(text))] for text in texts
+        ]
+        batcher = QueryBatcher(engine, window_ms=200, max_batch_size=3)
+
+        async def run():
+            waiters = [
+                asyncio.ensure_future(batcher.aembed_query(text))
+                for text in ["a", "bb", "ccc"]
+            ]
+            await asyncio.sleep(0)
+            waiters[1].cancel()  # e.g. a client left /api/chat/stream
+            results = await asyncio.gather(*waiters, return_exceptions=True)
+            later = await asyncio.wait_for(batcher.aembed_query("dddd"), 5)
+            return results, later
+
+        results, later = asyncio.run(run())
+        assert results[0] == [1.0] and results[2] == [3.0]
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert later == [4.0]
+        engine.embed_documents.assert_any_call(["a", "ccc"])
+        assert batcher._worker.is_alive()
+
+
+class TestQueryEmbeddingCache:
+    """Test query embedding cache"""
+
+    def test_hits_on_normalized_query(self):
+        """Test queries differing only in case/whitespace share an entry"""
+        inner = MagicMock()
+        inner.embed_query.return_value = [0.5, 0.25]
+        cache = QueryEmbeddingCache("test-model", disk_path=None)
+        embeddings = CachedQueryEmbeddings(inner, cache)
+
+        assert embeddings.embed_query("What is the refund policy") == [0.5, 0.25]
+        assert embeddings.embed_query("  what is the REFUND policy ") == [0.5, 0.25]
+        inner.embed_query.assert_called_once()
+
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["bytes"] == 8
+
+    def test_evicts_by_entries_and_bytes(self):
+        """Test least recently used entries are evicted first"""
+        cache = QueryEmbeddingCache(
+            "test-model", max_entries=2, max_bytes=1024, disk_path=None
+        )
+        cache.put("a", [1.0])
+        cache.put("b", [2.0])
+        cache.get("a")
+        cache.put("c", [3.0])
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+        small = QueryEmbeddingCache(
+            "test-model", max_entries=10, max_bytes=8, disk_path=None
+        )
+        small.put("a", [1.0, 2.0])
+        small.put("b", [3.0, 4.0])
+        assert small.get("a") is None
+        assert small.get_stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """Test expired entries are treated as misses"""
+        cache = QueryEmbeddingCache("test-model", ttl_seconds=10, disk_path=None)
+        with patch("services.embedding_cache.time.time", return_value=1000.0):
+            cache.put("a", [1.0])
+        with patch("services.embedding_cache.time.time", return_value=1011.0):
+            assert cache.get("a") is None
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test entries are reloaded from the on-disk tier"""
+        path = str(tmp_path / "query_cache.db")
+        QueryEmbeddingCache("test-model", disk_path=path).put("a", [1.0, 2.0])
+
+        restarted = QueryEmbeddingCache("test-model", disk_path=path)
+        assert restarted.get("a").tolist() == [1.0, 2.0]
+        assert restarted.get_stats()["disk_hits"] == 1
+        assert QueryEmbeddingCache("other-model", disk_path=path).get("a") is None
+
+    @patch("services.embedding_cache.QUERY_CACHE_DISK_PRUNE_INTERVAL", 2)
+    def test_disk_tier_is_bounded(self, tmp_path):
+        """Test the on-disk tier drops expired rows and keeps the newest rows"""
+        path = str(tmp_path / "query_cache.db")
+        cache = QueryEmbeddingCache(
+            "test-model", ttl_seconds=10, disk_path=path, disk_max_entries=2
+        )
+        for now, text in enumerate(["a", "b", "c", "d"]):
+            with patch("services.embedding_cache.time.time", return_value=1000.0 + now):
+                cache.put(text, [float(now)])
+
+        def disk_rows():
+            return cache._disk.execute(
+                "SELECT COUNT(*) FROM query_embeddings"
+            ).fetchone()[0]
+
+        assert disk_rows() == 2
+        assert cache.get_stats()["disk_evictions"] == 2
+
+        # Expired rows are dropped when the file is opened again
+        with patch("services.embedding_cache.time.time", return_value=1012.5):
+            restarted = QueryEmbeddingCache(
+                "test-model", ttl_seconds=10, disk_path=path, disk_max_entries=2
+            )
+            assert restarted.get("c") is None
+            assert restarted.get("d").tolist() == [3.0]
+        assert restarted.get_stats()["disk_evictions"] == 1
+
+
+class TestSemanticAnswerCache:
+    """Test semantic answer cache"""
+
+    def test_serves_near_duplicate_queries_per_index(self):
+        """Test answers are served above the threshold on the same index only"""
+        cache = SemanticAnswerCache(threshold=0.95, enabled=True)
+        answer = {"result": "30 days", "source_documents": []}
+        cache.store("docs", [1.0, 0.0], answer)
+
+        assert cache.lookup("docs", [0.99, 0.05]) == answer
+        assert cache.lookup("docs", [0.5, 0.5]) is None
+        assert cache.lookup("other-docs", [1.0, 0.0]) is None
+        assert cache.get_stats()["hits"] == 1
+
+    def test_invalidate_drops_index_answers(self):
+        """Test writing to an index invalidates its cached answers"""
+        cache = SemanticAnswerCache(enabled=True)
+        cache.store("docs", [1.0, 0.0], {"result": "old", "source_documents": []})
+        cache.invalidate("docs")
+        assert cache.lookup("docs", [1.0, 0.0]) is None
+        assert cache.get_stats()["invalidations"] == 1
+
+    def test_bounded_entries(self):
+        """Test oldest answers are dropped beyond max_entries"""
+        cache = SemanticAnswerCache(max_entries=1, enabled=True)
+        cache.store("docs", [1.0, 0.0], {"result": "a", "source_documents": []})
+        cache.store("docs", [0.0, 1.0], {"result": "b", "source_documents": []})
+        assert cache.lookup("docs", [1.0, 0.0]) is None
+        assert cache.lookup("docs", [0.0, 1.0])["result"] == "b"
+
+    def test_bound_shared_across_indexes(self):
+        """Test max_entries bounds all indexes, evicting the least recently used"""
+        cache = SemanticAnswerCache(max_entries=2, enabled=True)
+        cache.store("a", [1.0, 0.0], {"result": "a", "source_documents": []})
+        cache.store("b", [1.0, 0.0], {"result": "b", "source_documents": []})
+        assert cache.lookup("a", [1.0, 0.0])["result"] == "a"
+        cache.store("c", [1.0, 0.0], {"result": "c", "source_documents": []})
+
+        assert cache.lookup("b", [1.0, 0.0]) is None
+        assert cache.lookup("a", [1.0, 0.0])["result"] == "a"
+        stats = cache.get_stats()
+        assert (stats["entries"], stats["indexes"]) == (2, 2)
+
+        cache.invalidate("a")
+        assert cache.get_stats()["entries"] == 1
 
 
 class TestVectorService:
@@ -11,15 +335,36 @@ class TestVectorService:
     def test_init(self):
         """Test VectorStoreService initialization"""
         service = VectorStoreService()
-        assert service._vectorstore is None
-        assert service._current_index == "langchain-integration-index"
+        assert len(service._vectorstores) == 0
+        assert service.get_current_index() == "langchain-integration-index"
 
     def test_switch_index(self):
-        """Test switching index"""
+        """Test switching index only changes that user's selection"""
         service = VectorStoreService()
-        service.switch_index("test-index")
-        assert service._current_index == "test-index"
-        assert service._vectorstore is None
+        service.switch_index("test-index", user_id=1)
+        assert service.get_current_index(1) == "test-index"
+        assert service.get_current_index(2) == "langchain-integration-index"
+        assert service.get_current_index() == "langchain-integration-index"
+
+    def test_vectorstores_cached_per_index(self):
+        """Test vector stores stay open per index in a bounded LRU"""
+        backend = MagicMock()
+        backend.get_vectorstore.side_effect = lambda name, embedding: MagicMock(
+            index_name=name
+        )
+        service = VectorStoreService(backend=backend, cache_size=2)
+        service._query_embeddings = MagicMock()
+        dropped = []
+        service.add_index_listener(dropped.append)
+
+        first = service.get_vectorstore("a")
+        service.get_vectorstore("b")
+        assert service.get_vectorstore("a") is first
+        service.get_vectorstore("c")  # evicts "b", the least recently used
+
+        assert dropped == ["b"]
+        assert list(service._vectorstores) == ["a", "c"]
+        assert backend.get_vectorstore.call_count == 3
 
 
 class TestLLMService:
@@ -39,6 +384,343 @@ class TestLLMService:
         service.update_prompt_template(new_template)
         assert service.custom_prompt_template == new_template
 
+    @patch("langchain.chains.RetrievalQA")
+    @patch("langchain_groq.ChatGroq")
+    def test_chain_and_client_are_reused(self, mock_groq, mock_retrieval_qa):
+        """Test the LLM client and chain are built once per index"""
+        service = LLMService()
+        vectorstore = MagicMock()
+
+        service.get_response("q1", vectorstore, index_name="docs")
+        service.get_response("q2", vectorstore, index_name="docs")
+        assert mock_groq.call_count == 1
+        assert mock_retrieval_qa.from_chain_type.call_count == 1
+
+        service.get_response("q3", vectorstore, index_name="other")
+        assert mock_retrieval_qa.from_chain_type.call_count == 2
+        assert mock_groq.call_count == 1
+
+        # Chains with free-form weight overrides are not cached
+        for weight in [0.5, 0.75, 0.5]:
+            service.get_response(
+                "q", vectorstore, index_name="docs", dense_weight=weight
+            )
+        assert mock_retrieval_qa.from_chain_type.call_count == 5
+        assert len(service._chains) == 2
+
+    @patch("langchain.chains.RetrievalQA")
+    @patch("langchain_groq.ChatGroq")
+    def test_chains_invalidated(self, mock_groq, mock_retrieval_qa):
+        """Test template updates and dropped vector stores rebuild chains"""
+        service = LLMService()
+        vector_service = VectorStoreService(backend=MagicMock())
+        vector_service._query_embeddings = MagicMock()
+        vector_service.add_index_listener(service.invalidate_chains)
+        index_name = vector_service.get_current_index()
+        vectorstore = vector_service.get_vectorstore(index_name)
+
+        service.get_response("q", vectorstore, index_name=index_name)
+        service.update_prompt_template("Short {context} {question}")
+        service.get_response("q", vectorstore, index_name=index_name)
+        assert mock_retrieval_qa.from_chain_type.call_count == 2
+
+        vector_service.reset_vectorstore()
+        assert service._chains == {}
+
+    @patch("langchain.chains.RetrievalQA")
+    @patch("langchain_groq.ChatGroq")
+    def test_async_chain_built_off_the_event_loop(self, mock_groq, mock_retrieval_qa):
+        """Test building a chain (index loads, re-ranker) doesn't block the loop"""
+        service = LLMService()
+        threads = []
+        mock_retrieval_qa.from_chain_type.return_value.ainvoke = AsyncMock(
+            return_value={"result": "ok", "source_documents": []}
+        )
+        build = service._build_retriever
+
+        def traced_build(*args):
+            threads.append(threading.get_ident())
+            return build(*args)
+
+        async def respond():
+            threads.append(threading.get_ident())
+            return await service.aget_response("q", MagicMock(), index_name="docs")
+
+        with patch.object(service, "_build_retriever", side_effect=traced_build):
+            assert asyncio.run(respond())["result"] == "ok"
+        assert len(threads) == 2 and threads[0] != threads[1]
+
+    def test_astream_response(self):
+        """Test streaming yields tokens followed by source documents"""
+        service = LLMService()
+        document = MagicMock(page_content="Refunds within 30 days")
+        vectorstore = MagicMock()
+        vectorstore.as_retriever.return_value.ainvoke = AsyncMock(
+            return_value=[document]
+        )
+        prompts = []
+
+        async def astream(prompt):
+            prompts.append(prompt)
+            for text in ["30", "", " days"]:
+                yield MagicMock(content=text)
+
+        service._llm = MagicMock()
+        service._llm.astream = astream
+
+        async def collect():
+            return [
+                item async for item in service.astream_response("refund?", vectorstore)
+            ]
+
+        items = asyncio.run(collect())
+        assert items[0][0] == "usage"
+        assert items[0][1]["context_passages"] == 1
+        assert items[0][1]["prompt_tokens"] > items[0][1]["context_tokens"]
+        assert items[1:] == [
+            ("token", "30"),
+            ("token", " days"),
+            ("sources", [document]),
+        ]
+        assert "Refunds within 30 days" in prompts[0]
+        assert "refund?" in prompts[0]
+
+
+class TestMetrics:
+    """Test the metrics registry, pipeline stage timing and trace context"""
+
+    def test_registry_renders_exposition_format(self):
+        """Test counters, gauges, histograms and collectors render as text"""
+        from services.metrics import MetricsRegistry
+
+        registry = MetricsRegistry()
+        tokens = registry.counter("tokens_total", "Tokens", ["kind"])
+        in_flight = registry.gauge("in_flight", "In flight")
+        latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        tokens.inc(5, kind="prompt")
+        tokens.inc(2, kind="prompt")
+        with in_flight.track():
+            assert in_flight.value() == 1
+        latency.observe(0.05)
+        latency.observe(0.5)
+        registry.register_collector(
+            lambda: [("hits_total", "counter", "Hits", [({"cache": "a"}, 3)])]
+        )
+
+        text = registry.render()
+        assert "# TYPE tokens_total counter" in text
+        assert 'tokens_total{kind="prompt"} 7' in text
+        assert "in_flight 0" in text
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="1"} 2' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+        assert "latency_seconds_count 2" in text
+        assert 'hits_total{cache="a"} 3' in text
+        with pytest.raises(ValueError):
+            tokens.inc(kind="prompt", model="x")
+        with pytest.raises(ValueError):
+            registry.counter("tokens_total", "Again")
+
+    def test_trace_context_propagation(self, capsys):
+        """Test stages continue the caller's trace and outgoing calls carry it"""
+        import json
+        import httpx
+        from services.metrics import (
+            STAGE_SECONDS,
+            current_traceparent,
+            inject_trace_headers,
+            parse_traceparent,
+            span,
+            stage,
+        )
+
+        header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        assert parse_traceparent("garbage") is None
+        assert current_traceparent() is None
+        before = STAGE_SECONDS.snapshot(stage="test_stage")["count"]
+        with patch("services.metrics.TRACE_CONTEXT", True):
+            with span("request", trace=parse_traceparent(header)):
+                with stage("test_stage"):
+                    request = httpx.Request("POST", "https://api.groq.com/")
+                    inject_trace_headers(request)
+        assert current_traceparent() is None
+        assert STAGE_SECONDS.snapshot(stage="test_stage")["count"] == before + 1
+
+        trace_id = "0af7651916cd43dd8448eb211c80319c"
+        assert request.headers["traceparent"].startswith(f"00-{trace_id}-")
+        spans = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        inner, outer = spans
+        assert (inner["name"], outer["name"]) == ("test_stage", "request")
+        assert {inner["trace_id"], outer["trace_id"]} == {trace_id}
+        assert outer["parent_id"] == "b7ad6b7169203331"
+        assert inner["parent_id"] == outer["span_id"]
+        assert request.headers["traceparent"].split("-")[2] == inner["span_id"]
+
+    def test_chain_run_times_retrieval_and_generation(self, tmp_path):
+        """Test a chat answer records its stages, tokens and in-flight count"""
+        from langchain_core.language_models.fake import FakeListLLM
+        from services.metrics import LLM_REQUESTS_IN_FLIGHT, LLM_TOKENS, STAGE_SECONDS
+        from services.retrieval import LexicalRetriever
+
+        index = LexicalIndex(str(tmp_path))
+        index.add(["a"], ["Refunds are accepted within 30 days"])
+        service = LLMService()
+        service._llm = FakeListLLM(responses=["Within 30 days"])
+        stages = ("retrieval", "context_packing", "generation")
+        before = {name: STAGE_SECONDS.snapshot(stage=name)["count"] for name in stages}
+        completion = LLM_TOKENS.value(kind="completion")
+
+        with patch(
+            "services.llm_service.build_retriever",
+            return_value=LexicalRetriever(index=index, k=2),
+        ):
+            response = asyncio.run(service.aget_response("refunds?", MagicMock()))
+
+        assert response["result"] == "Within 30 days"
+        for name in stages:
+            assert STAGE_SECONDS.snapshot(stage=name)["count"] == before[name] + 1
+        assert LLM_TOKENS.value(kind="completion") > completion
+        assert LLM_REQUESTS_IN_FLIGHT.value() == 0
+
+
+class TestWarmup:
+    """Test startup warm-up and readiness"""
+
+    def test_ready_once_every_step_finished(self):
+        """Test steps run in the background and failures don't block readiness"""
+        from services.warmup import Warmup
+
+        release = threading.Event()
+        calls = []
+
+        def fail():
+            raise RuntimeError("index unreachable")
+
+        warmup = Warmup(
+            {
+                "embedding": lambda: (release.wait(5), calls.append("embedding")),
+                "vectorstore": fail,
+            }
+        )
+        assert warmup.get_status()["status"] == "pending"
+        warmup.start()
+        assert not warmup.ready
+        assert warmup.get_status()["status"] == "warming_up"
+
+        release.set()
+        assert warmup.wait(5)
+        status = warmup.get_status()
+        assert status["ready"] and status["status"] == "ready"
+        assert status["steps"]["embedding"]["status"] == "done"
+        assert status["steps"]["vectorstore"] == {
+            "status": "failed",
+            "error": "index unreachable",
+            "seconds": status["steps"]["vectorstore"]["seconds"],
+        }
+        warmup.start()
+        assert calls == ["embedding"]
+
+    def test_ready_at_start_without_steps(self):
+        """Test a disabled warm-up is ready as soon as it starts"""
+        from services.warmup import Warmup
+
+        warmup = Warmup({})
+        assert not warmup.ready
+        warmup.start()
+        assert warmup.ready
+
+
+class TestDatabasePool:
+    """Test the instrumented connection pool and async session support"""
+
+    def test_pool_stats_count_checkouts_and_timeouts(self, tmp_path):
+        """Test checkouts, waits and pool timeouts are counted"""
+        import sqlalchemy
+        from database import InstrumentedQueuePool
+
+        engine = sqlalchemy.create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+        )
+        with engine.connect():
+            assert engine.pool.get_stats()["checked_out"] == 1
+            with pytest.raises(sqlalchemy.exc.TimeoutError):
+                engine.connect()
+
+        stats = engine.pool.get_stats()
+        assert stats["checked_out"] == 0
+        assert stats["checkouts"] == 1
+        assert stats["timeouts"] == 1
+        assert stats["waiting"] == 0
+        engine.dispose()
+        assert engine.pool.get_stats()["checkouts"] == 1
+
+    def test_async_database_url(self):
+        """Test sync drivers are swapped for their async counterparts"""
+        from database import async_database_url
+
+        assert (
+            async_database_url("postgresql+psycopg2://u:secret@db/app")
+            == "postgresql+asyncpg://u:secret@db/app"
+        )
+        assert (
+            async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+        )
+        with pytest.raises(ValueError):
+            async_database_url("mssql://db/app")
+
+    def test_session_runner_uses_run_sync_on_async_sessions(self):
+        """Test ORM code runs through run_sync on an async session"""
+        from database import SessionRunner
+
+        session = MagicMock()
+        session.run_sync = AsyncMock(return_value="user")
+        lookup = MagicMock()
+
+        result = asyncio.run(SessionRunner(session).run(lookup, "ann"))
+
+        assert result == "user"
+        session.run_sync.assert_awaited_once_with(lookup, "ann")
+
+
+class TestPrincipalCache:
+    """Test the per-token principal cache"""
+
+    def test_entries_expire_with_their_token(self):
+        """Test a cached user is never served past the token's expiry"""
+        import time
+        from models import User
+        from services.auth_service import PrincipalCache
+
+        cache = PrincipalCache(ttl_seconds=60)
+        user = User(id=1, username="ann", email="ann@example.com", is_active=True)
+        cache.put("fresh", user, time.time() + 30)
+        cache.put("expiring", user, time.time() - 1)
+
+        cached = cache.get("fresh")
+        assert cached.username == "ann"
+        assert cached is not user
+        assert cached.hashed_password is None
+        assert cache.get("expiring") is None
+
+    def test_invalidate_user(self):
+        """Test deactivating a user drops all of their tokens"""
+        from models import User
+        from services.auth_service import PrincipalCache
+
+        cache = PrincipalCache(ttl_seconds=60)
+        cache.put("a", User(id=1, username="ann", email="a@example.com"))
+        cache.put("b", User(id=1, username="ann", email="a@example.com"))
+        cache.put("c", User(id=2, username="bob", email="b@example.com"))
+
+        cache.invalidate_user(1)
+
+        assert cache.get("a") is None and cache.get("b") is None
+        assert cache.get("c").username == "bob"
+
 
 class TestDocumentProcessor:
     """Test Document Processor"""
@@ -48,7 +730,153 @@ class TestDocumentProcessor:
         processor = DocumentProcessor()
         assert processor.embedding_model is None
 
-    @patch("services.document_processor.Pinecone")
+    def test_process_pdf_streams_batches(self, tmp_path):
+        """Test pages are chunked, embedded and upserted in bounded batches"""
+        backend = LocalBackend(str(tmp_path))
+        processor = DocumentProcessor(
+            backend=backend,
+            manifest=ChunkManifest(str(tmp_path / "manifest.db")),
+            embedding_store=ChunkEmbeddingStore("test-model", str(tmp_path)),
+            lexical_indexes=lexical_indexes(tmp_path),
+        )
+        processor.embedding_model = MagicMock()
+        processor.embedding_model.embed_documents.side_effect = lambda texts: [
+            [1.0, 0.0, 0.0] for _ in texts
+        ]
+        backend._indexes["docs"] = LocalVectorIndex(str(tmp_path / "docs"), 3)
+        progress = []
+
+        with patch("services.document_processor.INGEST_BATCH_SIZE", 2):
+            result = processor.process_pdf_file(
+                make_pdf(["alpha", "beta", "gamma"]),
+                "doc.pdf",
+                "docs",
+                progress_callback=lambda **update: progress.append(update),
+            )
+
+        assert result["success"] is True
+        assert result["details"]["total_pages"] == 3
+        assert result["details"]["text_chunks"] == 3
+        batches = processor.embedding_model.embed_documents.call_args_list
+        assert [call.args[0] for call in batches] == [["alpha", "beta"], ["gamma"]]
+        assert progress[-1]["vectors_upserted"] == 3
+        assert len(backend.get_index("docs")) == 3
+        assert backend.get_index("docs").get_document(0).metadata["page"] == 0
+
+    def test_reupload_only_embeds_changed_chunks(self, tmp_path):
+        """Test re-ingesting a document skips unchanged chunks and drops removed ones"""
+        backend = LocalBackend(str(tmp_path))
+        processor = DocumentProcessor(
+            backend=backend,
+            manifest=ChunkManifest(str(tmp_path / "manifest.db")),
+            embedding_store=ChunkEmbeddingStore("test-model", str(tmp_path)),
+            lexical_indexes=lexical_indexes(tmp_path),
+        )
+        processor.embedding_model = MagicMock()
+        processor.embedding_model.embed_documents.side_effect = lambda texts: [
+            [1.0, 0.0, 0.0] for _ in texts
+        ]
+        backend._indexes["docs"] = LocalVectorIndex(str(tmp_path / "docs"), 3)
+
+        processor.process_pdf_file(
+            make_pdf(["alpha", "beta", "alpha"]), "a.pdf", "docs"
+        )
+        processor.process_pdf_file(make_pdf(["beta"]), "b.pdf", "docs")
+        processor.embedding_model.embed_documents.reset_mock()
+
+        result = processor.process_pdf_file(
+            make_pdf(["alpha", "gamma"]), "a.pdf", "docs"
+        )
+
+        assert result["details"]["chunks_unchanged"] == 1
+        assert result["details"]["chunks_added"] == 1
+        # "beta" is still part of b.pdf, so nothing is deleted yet
+        assert result["details"]["chunks_removed"] == 0
+        processor.embedding_model.embed_documents.assert_called_once_with(["gamma"])
+        index = backend.get_index("docs")
+        assert set(index._id_to_row) == {
+            chunk_hash(t) for t in ["alpha", "beta", "gamma"]
+        }
+
+        result = processor.process_pdf_file(make_pdf(["gamma"]), "b.pdf", "docs")
+        assert result["details"]["chunks_removed"] == 1
+        assert set(index._id_to_row) == {chunk_hash(t) for t in ["alpha", "gamma"]}
+        lexical = processor.lexical_indexes("docs")
+        assert set(lexical._id_to_row) == set(index._id_to_row)
+        assert lexical.similarity_search("beta") == []
+        assert lexical.similarity_search("gamma")[0].metadata["source"] == "a.pdf"
+
+    def test_stored_chunk_embeddings_are_reused_across_indexes(self, tmp_path):
+        """Test re-indexing a document reads embeddings from the disk store"""
+        backend = LocalBackend(str(tmp_path))
+        processor = DocumentProcessor(
+            backend=backend,
+            manifest=ChunkManifest(str(tmp_path / "manifest.db")),
+            embedding_store=ChunkEmbeddingStore("test-model", str(tmp_path)),
+            lexical_indexes=lexical_indexes(tmp_path),
+        )
+        processor.embedding_model = MagicMock()
+        processor.embedding_model.embed_documents.side_effect = lambda texts: [
+            [1.0, 0.0, 0.0] for _ in texts
+        ]
+        for name in ("first", "second"):
+            backend._indexes[name] = LocalVectorIndex(str(tmp_path / name), 3)
+
+        processor.process_pdf_file(make_pdf(["alpha", "beta"]), "a.pdf", "first")
+        progress = []
+        result = processor.process_pdf_file(
+            make_pdf(["alpha", "beta", "gamma"]),
+            "a.pdf",
+            "second",
+            progress_callback=lambda **update: progress.append(update),
+        )
+
+        assert result["details"]["chunks_added"] == 3
+        assert progress[-1]["chunks_cached"] == 2
+        assert progress[-1]["chunks_embedded"] == 1
+        calls = processor.embedding_model.embed_documents.call_args_list
+        assert [call.args[0] for call in calls] == [["alpha", "beta"], ["gamma"]]
+        assert len(backend.get_index("second")) == 3
+
+    def test_unreferenced_chunk_embeddings_are_reclaimed(self, tmp_path):
+        """Test embeddings no index uses any more are dropped and compacted"""
+        backend = LocalBackend(str(tmp_path))
+        store = ChunkEmbeddingStore(
+            "test-model", str(tmp_path), compact_ratio=0.3, compact_min_rows=1
+        )
+        processor = DocumentProcessor(
+            backend=backend,
+            manifest=ChunkManifest(str(tmp_path / "manifest.db")),
+            embedding_store=store,
+            lexical_indexes=lexical_indexes(tmp_path),
+        )
+        processor.embedding_model = MagicMock()
+        processor.embedding_model.embed_documents.side_effect = lambda texts: [
+            [1.0, 0.0, 0.0] for _ in texts
+        ]
+        for name in ("first", "second"):
+            backend._indexes[name] = LocalVectorIndex(str(tmp_path / name), 3)
+            processor.process_pdf_file(make_pdf(["alpha", "beta"]), "a.pdf", name)
+
+        # "beta" is still indexed in "second", so its embedding is kept
+        processor.process_pdf_file(make_pdf(["alpha"]), "a.pdf", "first")
+        assert store.get_many([chunk_hash("beta")])
+        assert store.get_stats() == {"embeddings": 2, "bytes": 24}
+
+        processor.process_pdf_file(make_pdf(["alpha"]), "a.pdf", "second")
+        assert store.get_many([chunk_hash("alpha"), chunk_hash("beta")]).keys() == {
+            chunk_hash("alpha")
+        }
+        assert store.get_stats() == {"embeddings": 1, "bytes": 12}
+
+    def test_process_pdf_rejects_invalid_file(self):
+        """Test unparseable uploads are reported as errors"""
+        processor = DocumentProcessor(backend=MagicMock())
+        result = processor.process_pdf_file(b"not a pdf", "doc.pdf")
+        assert result["success"] is False
+        assert "Error processing PDF" in result["error"]
+
+    @patch("pinecone.Pinecone")
     def test_get_available_indexes(self, mock_pinecone):
         """Test getting available indexes"""
         # Mock the Pinecone client
@@ -58,9 +886,904 @@ class TestDocumentProcessor:
         mock_client.list_indexes.return_value = [mock_index]
         mock_pinecone.return_value = mock_client
 
-        processor = DocumentProcessor()
+        processor = DocumentProcessor(backend=PineconeBackend())
 
         with patch.dict(os.environ, {"PINECONE_API_KEY": "test-key"}):
             result = processor.get_available_indexes()
             assert result["success"] is True
             assert "test-index" in result["indexes"]
+
+
+class TestContextPacker:
+    """Test token-budgeted context packing"""
+
+    def test_merges_overlapping_chunks_of_a_page(self):
+        """Test chunks split with overlap are joined without the repeated text"""
+        from langchain_core.documents import Document
+
+        page = {"source": "a.pdf", "page": 2}
+        first = Document(
+            page_content="Refunds are issued within 30 days of the return request.",
+            metadata=page,
+        )
+        second = Document(
+            page_content=(
+                "within 30 days of the return request. Shipping is not refunded."
+            ),
+            metadata=page,
+        )
+        other = Document(page_content="Unrelated text.", metadata={"page": 3})
+
+        passages = ContextPacker(token_budget=1000).pack([second, other, first])
+
+        assert [p.page_content for p in passages] == [
+            "Refunds are issued within 30 days of the return request. "
+            "Shipping is not refunded.",
+            "Unrelated text.",
+        ]
+        assert passages[1] is other
+
+    def test_drops_duplicates_and_respects_budget(self):
+        """Test near-duplicates are skipped and packing stops at the budget"""
+        from langchain_core.documents import Document
+
+        text = "the warranty covers parts and labour for two years"
+        documents = [
+            Document(page_content=text, metadata={"page": 0}),
+            Document(page_content=text + " in total", metadata={"page": 1}),
+            Document(page_content="returns " * 200, metadata={"page": 2}),
+            Document(page_content="contact support by email", metadata={"page": 3}),
+        ]
+
+        passages = ContextPacker(token_budget=50).pack(documents)
+
+        assert passages == [documents[0], documents[3]]
+
+
+class TestLexicalIndex:
+    """Test the BM25 lexical index"""
+
+    def test_tokenize_keeps_codes_whole(self):
+        """Test joined codes are indexed whole and by their parts"""
+        assert tokenize("Error ABC-123 in v2.1") == [
+            "error",
+            "abc-123",
+            "abc",
+            "123",
+            "in",
+            "v2.1",
+            "v2",
+            "1",
+        ]
+
+    def test_search_ranks_exact_terms(self, tmp_path):
+        """Test rare identifiers outrank common words"""
+        index = LexicalIndex(str(tmp_path))
+        index.add(
+            ["a", "b", "c"],
+            [
+                "the printer shows an error",
+                "the printer shows error 0x80070005",
+                "the scanner is offline",
+            ],
+            [{"page": 0}, {"page": 1}, {"page": 2}],
+        )
+
+        documents = index.similarity_search("what does 0x80070005 mean", k=2)
+        assert [document.id for document in documents] == ["b"]
+        assert documents[0].metadata == {"page": 1}
+        assert [row for row, _ in index.search("printer error", k=3)] == [0, 1]
+
+    def test_snapshot_and_deletes_survive_reload(self, tmp_path):
+        """Test postings snapshots and tombstones are restored from disk"""
+        index = LexicalIndex(str(tmp_path), snapshot_rows=2)
+        index.add(["a", "b"], ["alpha beta", "beta gamma"])
+        index.add(["c", "a"], ["gamma delta", "alpha again"])
+        index.delete(["b"])
+
+        reloaded = LexicalIndex(str(tmp_path), snapshot_rows=2)
+        assert len(reloaded) == 2
+        assert reloaded.similarity_search("beta") == [reloaded.get_document(0)]
+        assert [doc.id for doc in reloaded.similarity_search("gamma")] == ["c"]
+
+
+class TestRetrieval:
+    """Test dense, lexical and hybrid retrieval"""
+
+    def test_reciprocal_rank_fusion(self):
+        """Test chunks found by both retrievers rank first, weighted by source"""
+        from langchain_core.documents import Document
+
+        a, b, c = (Document(page_content=text) for text in ["a", "b", "c"])
+        assert reciprocal_rank_fusion([[a, b], [c, b]], [1.0, 1.0], 3) == [b, a, c]
+        assert reciprocal_rank_fusion([[a, b], [c, b]], [0.0, 1.0], 1) == [c]
+
+    def test_build_retriever_modes(self, tmp_path):
+        """Test hybrid retrieval uses dense results while there are no postings"""
+        vectorstore = MagicMock()
+        index = LexicalIndex(str(tmp_path))
+        with patch("services.retrieval.get_lexical_index", return_value=index):
+            # Dense by default; hybrid is opt-in
+            build_retriever(vectorstore, "docs", k=2)
+            vectorstore.as_retriever.assert_called_once_with(search_kwargs={"k": 2})
+
+            # The fallback is decided per query, so cached chains pick up
+            # postings added after they were built
+            retriever = build_retriever(
+                vectorstore, "docs", k=2, mode="hybrid", lexical_weight=2.0
+            )
+            assert isinstance(retriever, HybridRetriever)
+            assert retriever.lexical_weight == 2.0
+            vectorstore.similarity_search.return_value = []
+            assert retriever.invoke("alpha") == []
+            vectorstore.similarity_search.assert_called_once_with("alpha", k=2)
+
+            index.add(["a"], ["alpha"])
+            assert [doc.page_content for doc in retriever.invoke("alpha")] == ["alpha"]
+            with pytest.raises(ValueError):
+                build_retriever(vectorstore, "docs", mode="fuzzy")
+
+            with patch("services.retrieval.get_reranker"):
+                retriever = build_retriever(
+                    vectorstore, "docs", k=3, mode="hybrid", rerank=True
+                )
+            assert isinstance(retriever, RerankingRetriever)
+            assert retriever.k == 3
+            assert retriever.retriever.k == 30
+
+    def test_hybrid_retriever_searches_bm25_off_the_event_loop(self, tmp_path):
+        """Test async hybrid retrieval runs the BM25 search in a worker thread"""
+        index = LexicalIndex(str(tmp_path))
+        index.add(["a"], ["alpha"])
+        vectorstore = MagicMock()
+        vectorstore.asimilarity_search = AsyncMock(return_value=[])
+        threads = []
+        search = index.similarity_search
+
+        def similarity_search(query, k):
+            threads.append(threading.get_ident())
+            return search(query, k)
+
+        async def retrieve():
+            threads.append(threading.get_ident())
+            return await retriever.ainvoke("alpha")
+
+        with patch.object(index, "similarity_search", side_effect=similarity_search):
+            retriever = HybridRetriever(vectorstore=vectorstore, index=index, k=2)
+            documents = asyncio.run(retrieve())
+        assert [doc.page_content for doc in documents] == ["alpha"]
+        assert len(threads) == 2 and threads[0] != threads[1]
+
+
+class TestReranker:
+    """Test cross-encoder re-ranking"""
+
+    def make_reranker(self, **kwargs):
+        reranker = CrossEncoderReranker(**kwargs)
+        reranker._model = MagicMock()
+        # Longer chunks score higher
+        reranker._model.predict.side_effect = lambda pairs, batch_size: [
+            float(len(text)) for _, text in pairs
+        ]
+        return reranker
+
+    def test_rerank_scores_in_one_batch_and_caches(self):
+        """Test candidates are reordered by score and scores are reused"""
+        from langchain_core.documents import Document
+
+        reranker = self.make_reranker()
+        documents = [Document(page_content=text) for text in ["a", "ccc", "bb"]]
+
+        assert reranker.rerank("Query", documents, 2) == [documents[1], documents[2]]
+        assert reranker._model.predict.call_count == 1
+        assert len(reranker._model.predict.call_args.args[0]) == 3
+
+        assert reranker.rerank("query ", documents, 1) == [documents[1]]
+        assert reranker._model.predict.call_count == 1
+        assert reranker.get_stats()["cache_hits"] == 3
+
+    def test_rerank_keeps_retrieval_order_over_budget(self):
+        """Test slow scoring falls back to the retrieval order"""
+        import time
+        from langchain_core.documents import Document
+
+        reranker = self.make_reranker(budget_ms=10)
+        scored = reranker._model.predict.side_effect
+
+        def slow_predict(pairs, batch_size):
+            time.sleep(0.2)
+            return scored(pairs, batch_size)
+
+        reranker._model.predict.side_effect = slow_predict
+        documents = [Document(page_content=text) for text in ["a", "ccc", "bb"]]
+
+        assert reranker.rerank("query", documents, 2) == documents[:2]
+        assert reranker.get_stats()["fallbacks"] == 1
+        reranker._executor.shutdown(wait=True)
+        # The late pass still fills the cache for the next request
+        assert reranker.get_stats()["cache_entries"] == 3
+
+    def test_rerank_bounds_pending_passes(self):
+        """Test requests fall back without queueing while passes are pending"""
+        from langchain_core.documents import Document
+
+        reranker = self.make_reranker(budget_ms=10, max_pending=1)
+        scored = reranker._model.predict.side_effect
+        release = threading.Event()
+
+        def blocked_predict(pairs, batch_size):
+            release.wait(5)
+            return scored(pairs, batch_size)
+
+        reranker._model.predict.side_effect = blocked_predict
+        documents = [Document(page_content=text) for text in ["a", "ccc", "bb"]]
+
+        assert reranker.rerank("first", documents, 2) == documents[:2]
+        assert reranker.rerank("second", documents, 2) == documents[:2]
+        release.set()
+        reranker._executor.shutdown(wait=True)
+        assert reranker._model.predict.call_count == 1
+        assert reranker.get_stats()["fallbacks"] == 2
+        assert reranker._pending == 0
+
+
+class TestPineconeBackend:
+    """Test the shared Pinecone client and cached control-plane calls"""
+
+    @patch("pinecone.Pinecone")
+    def test_client_and_listing_are_shared(self, mock_pinecone):
+        """Test one client serves all calls and listings are cached"""
+        mock_index = MagicMock()
+        mock_index.name = "docs"
+        mock_pinecone.return_value.list_indexes.return_value = [mock_index]
+        backend = PineconeBackend()
+
+        assert backend.ensure_index("docs") is True
+        assert backend.list_indexes() == ["docs"]
+        assert backend.get_index("docs") is backend.get_index("docs")
+
+        mock_pinecone.assert_called_once()
+        mock_pinecone.return_value.list_indexes.assert_called_once()
+        mock_pinecone.return_value.describe_index.assert_called_once_with("docs")
+        mock_pinecone.return_value.Index.assert_called_once_with(
+            host=mock_pinecone.return_value.describe_index.return_value.host
+        )
+
+    def test_async_search_uses_the_pooled_client(self):
+        """Test async searches run the sync query in a worker thread"""
+        # Imported before Pinecone is patched, as on a real first request
+        import langchain_pinecone.vectorstores  # noqa: F401
+
+        threads = []
+
+        def query(**kwargs):
+            threads.append(threading.get_ident())
+            return {"matches": [{"id": "1", "score": 0.9, "metadata": {"text": "a"}}]}
+
+        embedding = MagicMock()
+        embedding.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+        with patch("pinecone.Pinecone") as mock_pinecone:
+            index = mock_pinecone.return_value.Index.return_value
+            index.config.api_key = "key"
+            index.query.side_effect = query
+            vectorstore = PineconeBackend().get_vectorstore("docs", embedding)
+
+        async def search():
+            threads.append(threading.get_ident())
+            return await vectorstore.asimilarity_search("q", k=1)
+
+        with patch(
+            "langchain_pinecone.vectorstores.PineconeAsyncioClient"
+        ) as mock_async_client:
+            documents = asyncio.run(search())
+        assert [doc.page_content for doc in documents] == ["a"]
+        assert len(threads) == 2 and threads[0] != threads[1]
+        mock_async_client.assert_not_called()
+
+    @patch("services.vector_backends.PINECONE_READY_POLL_SECONDS", 0)
+    @patch("pinecone.Pinecone")
+    def test_new_index_polled_until_ready(self, mock_pinecone):
+        """Test index creation waits for readiness instead of a fixed sleep"""
+        client = mock_pinecone.return_value
+        client.list_indexes.return_value = []
+        client.describe_index.side_effect = [
+            MagicMock(status=MagicMock(ready=False)),
+            MagicMock(status=MagicMock(ready=True)),
+        ]
+        backend = PineconeBackend()
+
+        assert backend.ensure_index("new-index") is True
+        assert client.create_index.call_args.kwargs["timeout"] == -1
+        assert client.describe_index.call_count == 2
+        # The listing is fetched again after the index was created
+        backend.list_indexes()
+        assert client.list_indexes.call_count == 3
+
+
+class TestUpsertWriter:
+    """Test pipelined upserts against the local backend"""
+
+    @staticmethod
+    def _vectors(count):
+        from langchain_core.documents import Document
+
+        ids = [f"id-{n}" for n in range(count)]
+        documents = [Document(page_content=f"chunk {n}") for n in range(count)]
+        return ids, documents, [[1.0, float(n), 0.0] for n in range(count)]
+
+    def test_batches_written_with_callbacks(self, tmp_path):
+        """Test every vector lands in the index in byte-bounded batches"""
+        backend = LocalBackend(str(tmp_path))
+        backend._indexes["docs"] = LocalVectorIndex(str(tmp_path / "docs"), 3)
+        done = []
+
+        with UpsertWriter(
+            backend, "docs", on_batch_done=done.extend, target_bytes=200
+        ) as writer:
+            ids, documents, embeddings = self._vectors(50)
+            writer.write(ids, documents, embeddings)
+        stats = writer.get_stats()
+
+        assert len(backend.get_index("docs")) == 50
+        assert sorted(done) == sorted(ids)
+        assert stats["vectors"] == 50
+        assert stats["batches"] > 1
+
+    def test_failed_batch_retried_with_same_embeddings(self, tmp_path):
+        """Test a transient upsert failure is retried without re-embedding"""
+        backend = LocalBackend(str(tmp_path))
+        backend._indexes["docs"] = LocalVectorIndex(str(tmp_path / "docs"), 3)
+        add_embeddings = backend.add_embeddings
+        calls = []
+
+        def flaky(index_name, ids, documents, embeddings):
+            calls.append(embeddings)
+            if len(calls) == 1:
+                raise ConnectionError("reset by peer")
+            return add_embeddings(index_name, ids, documents, embeddings)
+
+        backend.add_embeddings = flaky
+        with UpsertWriter(backend, "docs", backoff_seconds=0) as writer:
+            writer.write(*self._vectors(3))
+
+        assert len(backend.get_index("docs")) == 3
+        assert calls[0] == calls[1]
+        assert writer.get_stats()["retries"] == 1
+
+    def test_persistent_failure_raised(self):
+        """Test a batch that keeps failing surfaces its error"""
+        backend = MagicMock()
+        backend.add_embeddings.side_effect = ConnectionError("down")
+        writer = UpsertWriter(backend, "docs", max_retries=1, backoff_seconds=0)
+        writer.write(*self._vectors(3))
+        with pytest.raises(ConnectionError):
+            writer.flush()
+        writer.close()
+        assert backend.add_embeddings.call_count == 2
+
+    def test_oversized_batch_is_split(self, tmp_path):
+        """Test a batch rejected as too large is sent in halves, not retried"""
+        backend = LocalBackend(str(tmp_path))
+        backend._indexes["docs"] = LocalVectorIndex(str(tmp_path / "docs"), 3)
+        add_embeddings = backend.add_embeddings
+        sizes = []
+
+        class TooLarge(Exception):
+            status = 400
+
+        def limited(index_name, ids, documents, embeddings):
+            sizes.append(len(ids))
+            if len(ids) > 4:
+                raise TooLarge("Request size 2.3MB exceeds the maximum of 2MB")
+            return add_embeddings(index_name, ids, documents, embeddings)
+
+        backend.add_embeddings = limited
+        with UpsertWriter(backend, "docs", backoff_seconds=0) as writer:
+            writer.write(*self._vectors(10))
+
+        assert len(backend.get_index("docs")) == 10
+        assert sizes == [10, 5, 2, 3, 5, 2, 3]
+        assert writer.get_stats()["retries"] == 0
+
+    def test_payload_estimated_as_json(self):
+        """Test vectors are sized as JSON floats, not packed float32"""
+        from langchain_core.documents import Document
+
+        size = estimate_bytes(Document(page_content="text"), [0.1] * 384)
+        assert size >= 384 * 20
+        writer = UpsertWriter(MagicMock(), "docs")
+        for _ in range(20):
+            writer._adapt(writer.batch_size, elapsed_ms=1)
+        assert writer.batch_size == UPSERT_MAX_BATCH
+        writer.close()
+
+    def test_batch_size_adapts_to_latency(self):
+        """Test slow upserts shrink batches and fast full batches grow them"""
+        writer = UpsertWriter(MagicMock(), "docs", target_latency_ms=100)
+        writer._adapt(100, elapsed_ms=500)
+        assert writer.batch_size == 50
+        writer._adapt(50, elapsed_ms=10)
+        assert writer.batch_size == 75
+        writer.close()
+
+
+class TestPdfParser:
+    """Test streaming PDF parsing"""
+
+    def test_pages_parsed_lazily_from_memory(self):
+        """Test pages come back in order with PyPDFLoader-style metadata"""
+        pages = iter_pdf_pages(make_pdf(["first page", "second page"]), "doc.pdf")
+        page = next(pages)
+        assert page.page_content == "first page"
+        assert page.metadata == {
+            "source": "doc.pdf",
+            "total_pages": 2,
+            "page": 0,
+            "page_label": "1",
+        }
+        assert [page.page_content for page in pages] == ["second page"]
+
+    def test_parallel_parse_matches_sequential(self):
+        """Test large documents parsed on the process pool keep page order"""
+        content = make_pdf([f"page {n}" for n in range(5)])
+        parallel = iter_pdf_pages(
+            content, "doc.pdf", parallel_min_pages=1, pages_per_task=2
+        )
+        assert [page.page_content for page in parallel] == [
+            f"page {n}" for n in range(5)
+        ]
+
+    def test_prefetch_propagates_errors(self):
+        """Test a producer failure is raised in the consumer"""
+
+        def items():
+            yield 1
+            raise ValueError("bad page")
+
+        stream = prefetch(items(), max_buffered=1)
+        assert next(stream) == 1
+        with pytest.raises(ValueError):
+            next(stream)
+
+
+class TestUploadArchives:
+    """Test reading PDFs out of uploaded archives"""
+
+    def test_tarball_entries_streamed(self, tmp_path):
+        """Test PDFs are read from a compressed tarball one entry at a time"""
+        import io
+        import tarfile
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            for name, data in [("a.pdf", b"%PDF-a"), ("big.pdf", b"x" * 100)]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        archive.seek(0)
+
+        assert is_archive("docs.tar.gz") and not is_archive("docs.pdf")
+        assert count_archive_pdfs("docs.tar.gz", archive) == 2
+        entries = list(iter_archive_pdfs("docs.tar.gz", archive, max_entry_bytes=50))
+        assert entries == [("a.pdf", b"%PDF-a"), ("big.pdf", None)]
+
+
+class TestIngestionQueue:
+    """Test background ingestion jobs"""
+
+    def test_job_runs_with_progress(self, tmp_path):
+        """Test a queued upload is processed and its progress recorded"""
+        processor = MagicMock()
+
+        def process(file_content, filename, index_name, progress_callback):
+            progress_callback(stage="parsed", parsed_pages=2)
+            progress_callback(stage="upserting", vectors_upserted=5)
+            return {"success": True, "details": {"text_chunks": 5}}
+
+        processor.process_pdf_file.side_effect = process
+        queue = IngestionQueue(processor, data_dir=str(tmp_path), workers=1)
+
+        job = queue.enqueue(b"%PDF", "doc.pdf", user_id=7)
+        assert job["status"] in ("queued", "running", "completed")
+        queue.shutdown()
+
+        job = queue.get_job(job["id"])
+        assert job["status"] == "completed"
+        assert job["user_id"] == 7
+        assert job["progress"] == {
+            "stage": "completed",
+            "parsed_pages": 2,
+            "vectors_upserted": 5,
+        }
+        assert job["result"] == {"text_chunks": 5}
+        assert not os.listdir(tmp_path / "spool")
+
+    def test_unfinished_jobs_resume_on_start(self, tmp_path):
+        """Test jobs left queued by a previous process are run on start"""
+        processor = MagicMock()
+        processor.process_pdf_file.return_value = {"success": False, "error": "bad"}
+
+        # A job accepted by a process that stopped before running it
+        stopped = IngestionQueue(processor, data_dir=str(tmp_path))
+        stopped._executor = MagicMock()
+        job = stopped.enqueue(b"%PDF", "doc.pdf")
+
+        restarted = IngestionQueue(processor, data_dir=str(tmp_path))
+        restarted.start()
+        restarted.shutdown()
+        job = restarted.get_job(job["id"])
+        assert job["status"] == "failed"
+        assert job["error"] == "bad"
+
+    def test_failed_job_removes_spooled_upload(self, tmp_path):
+        """Test a job that raises doesn't leave its upload in the spool"""
+        processor = MagicMock()
+        processor.process_pdf_file.side_effect = RuntimeError("parser crashed")
+        queue = IngestionQueue(processor, data_dir=str(tmp_path), workers=1)
+
+        job = queue.enqueue(b"%PDF", "doc.pdf")
+        queue.shutdown()
+
+        job = queue.get_job(job["id"])
+        assert job["status"] == "failed"
+        assert job["error"] == "parser crashed"
+        assert not os.listdir(tmp_path / "spool")
+        assert queue.get_stats()["pending"] == 0
+
+    def test_enqueue_rejects_when_full(self, tmp_path):
+        """Test uploads are refused once too many jobs are waiting"""
+        queue = IngestionQueue(MagicMock(), data_dir=str(tmp_path), max_pending=0)
+        with pytest.raises(IngestionQueueFull):
+            queue.enqueue(b"%PDF", "doc.pdf")
+        queue.shutdown()
+
+    def test_reserved_room_is_all_or_nothing(self, tmp_path):
+        """Test a batch is refused as a whole when the queue can't hold it"""
+        queue = IngestionQueue(MagicMock(), data_dir=str(tmp_path), max_pending=3)
+        queue._executor = MagicMock()  # keep the jobs queued
+        with pytest.raises(IngestionQueueFull):
+            queue.reserve(4)
+        assert queue.get_stats()["pending"] == 0
+
+        queue.reserve(3)
+        queue.enqueue(b"%PDF", "a.pdf", reserved=True)
+        with pytest.raises(IngestionQueueFull):
+            queue.enqueue(b"%PDF", "b.pdf")
+        queue.release(2)
+        assert queue.get_stats()["pending"] == 1
+
+
+class TestChunkEmbeddingStore:
+    """Test the on-disk chunk embedding store"""
+
+    def test_put_get_and_reopen(self, tmp_path):
+        """Test embeddings are stored once per hash and survive a reopen"""
+        store = ChunkEmbeddingStore("org/model", str(tmp_path))
+        assert store.get_many(["a"]) == {}
+        store.put_many({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+        store.put_many({"a": [9.0, 9.0], "c": [5.0, 6.0]})
+
+        reopened = ChunkEmbeddingStore("org/model", str(tmp_path))
+        found = reopened.get_many(["a", "c", "missing"])
+        assert set(found) == {"a", "c"}
+        assert found["a"].tolist() == [1.0, 2.0]
+        assert reopened.get_stats() == {"embeddings": 3, "bytes": 24}
+        assert ChunkEmbeddingStore("other", str(tmp_path)).get_many(["a"]) == {}
+
+    def test_concurrent_appends(self, tmp_path):
+        """Test stores sharing a directory can append from several threads"""
+        stores = [ChunkEmbeddingStore("model", str(tmp_path)) for _ in range(4)]
+
+        def append(worker, store):
+            for n in range(25):
+                store.put_many({f"{worker}-{n}": [float(worker), float(n)]})
+
+        threads = [
+            threading.Thread(target=append, args=(worker, store))
+            for worker, store in enumerate(stores)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        found = stores[0].get_many([f"{w}-{n}" for w in range(4) for n in range(25)])
+        assert len(found) == 100
+        assert found["3-7"].tolist() == [3.0, 7.0]
+
+    def test_compact_drops_unkept_rows(self, tmp_path):
+        """Test compaction rewrites rows and open readers follow it"""
+        store = ChunkEmbeddingStore("model", str(tmp_path))
+        reader = ChunkEmbeddingStore("model", str(tmp_path))
+        store.put_many({"a": [1.0], "b": [2.0], "c": [3.0]})
+        assert reader.get_many(["c"])["c"].tolist() == [3.0]
+
+        assert store.compact(keep=["a", "c"]) == 1
+        assert reader.get_many(["a", "b", "c"]).keys() == {"a", "c"}
+        assert reader.get_many(["c"])["c"].tolist() == [3.0]
+        assert store.get_stats() == {"embeddings": 2, "bytes": 8}
+
+    def test_compact_if_needed_waits_for_dead_rows(self, tmp_path):
+        """Test discarded rows are only compacted past the dead-row thresholds"""
+        store = ChunkEmbeddingStore(
+            "model", str(tmp_path), compact_ratio=0.5, compact_min_rows=2
+        )
+        store.put_many({"a": [1.0], "b": [2.0], "c": [3.0], "d": [4.0]})
+
+        store.discard(["a"])
+        assert store.compact_if_needed() == 0
+        assert store.get_stats() == {"embeddings": 3, "bytes": 16}
+
+        store.discard(["b", "missing"])
+        assert store.compact_if_needed() == 2
+        assert store.get_stats() == {"embeddings": 2, "bytes": 8}
+        assert store.get_many(["c", "d"])["d"].tolist() == [4.0]
+        assert store.compact_if_needed() == 0
+
+
+class TestLocalVectorStore:
+    """Test local in-process vector backend"""
+
+    @staticmethod
+    def _embeddings():
+        embeddings = MagicMock()
+        vectors = {"apple": [1.0, 0.0, 0.0], "banana": [0.0, 1.0, 0.0]}
+        embeddings.embed_documents.side_effect = lambda texts: [
+            vectors.get(text, [0.0, 0.0, 1.0]) for text in texts
+        ]
+        embeddings.embed_query.side_effect = lambda text: vectors[text]
+        return embeddings
+
+    def test_add_and_search(self, tmp_path):
+        """Test cosine top-k search returns the closest documents first"""
+        store = LocalVectorStore(
+            LocalVectorIndex(str(tmp_path), dimension=3), self._embeddings()
+        )
+        store.add_texts(
+            ["apple", "banana", "cherry"],
+            metadatas=[{"page": 1}, {"page": 2}, {"page": 3}],
+            ids=["a", "b", "c"],
+        )
+
+        results = store.similarity_search_with_score("banana", k=2)
+        assert [doc.page_content for doc, _ in results][0] == "banana"
+        assert results[0][0].metadata == {"page": 2}
+        assert results[0][1] == pytest.approx(1.0)
+        assert len(results) == 2
+
+    def test_async_search_runs_off_the_event_loop(self, tmp_path):
+        """Test the async search scans the matrix in a worker thread"""
+        embeddings = self._embeddings()
+        embeddings.aembed_query = AsyncMock(return_value=[0.0, 1.0, 0.0])
+        index = LocalVectorIndex(str(tmp_path), dimension=3)
+        store = LocalVectorStore(index, embeddings)
+        store.add_texts(["apple", "banana"], ids=["a", "b"])
+        threads = []
+        search = index.search
+
+        def traced_search(*args):
+            threads.append(threading.get_ident())
+            return search(*args)
+
+        async def retrieve():
+            threads.append(threading.get_ident())
+            return await store.asimilarity_search("banana", k=1)
+
+        with patch.object(index, "search", side_effect=traced_search):
+            documents = asyncio.run(retrieve())
+        assert [doc.page_content for doc in documents] == ["banana"]
+        assert len(threads) == 2 and threads[0] != threads[1]
+
+    def test_delete_persist_and_compact(self, tmp_path):
+        """Test deletions and data survive a reload and compaction"""
+        store = LocalVectorStore(
+            LocalVectorIndex(str(tmp_path), dimension=3), self._embeddings()
+        )
+        store.add_texts(["apple", "banana", "cherry"], ids=["a", "b", "c"])
+        store.delete(["a"])
+
+        reloaded = LocalVectorIndex(str(tmp_path), dimension=3)
+        assert len(reloaded) == 2
+        reloaded.compact()
+        reloaded = LocalVectorIndex(str(tmp_path), dimension=3)
+        assert len(reloaded) == 2
+        assert reloaded._ids == ["b", "c"]
+        top_row, _ = reloaded.search([0.0, 1.0, 0.0], k=1)[0]
+        assert reloaded.get_document(top_row).page_content == "banana"
+
+    def test_backend_lists_and_reuses_indexes(self, tmp_path):
+        """Test the local backend creates, lists and caches indexes"""
+        backend = LocalBackend(str(tmp_path))
+        assert backend.list_indexes() == []
+        assert backend.ensure_index("docs") is True
+        assert backend.list_indexes() == ["docs"]
+        assert backend.get_index("docs") is backend.get_index("docs")
+
+    def test_index_names_are_validated(self, tmp_path):
+        """Test index names can't escape the data directory"""
+        backend = LocalBackend(str(tmp_path / "vectors"))
+        for name in ["../outside", "a/b", "Docs", "a" * 46, ""]:
+            with pytest.raises(InvalidIndexName):
+                backend.get_index(name)
+            with pytest.raises(InvalidIndexName):
+                get_lexical_index(name, namespace="local")
+        assert backend.ensure_index("../outside") is False
+        assert os.listdir(tmp_path) == []
+        assert validate_index_name("user-docs-1a2b3c4d") == "user-docs-1a2b3c4d"
+
+
+class TestIVFIndex:
+    """Test approximate nearest-neighbour search for local indexes"""
+
+    @staticmethod
+    def _vectors(rows, seed=0):
+        rng = np.random.default_rng(seed)
+        centers = rng.standard_normal((16, 8))
+        vectors = centers[rng.integers(0, 16, rows)] + 0.1 * rng.standard_normal(
+            (rows, 8)
+        )
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def _index(self, path, **ann_options):
+        options = {"nlist": 16, "nprobe": 4, "min_train_size": 200}
+        options.update(ann_options)
+        return LocalVectorIndex(
+            str(path), dimension=8, index_type="ivf", ann_options=options
+        )
+
+    @staticmethod
+    def _add(index, vectors, start=0):
+        ids = [str(start + i) for i in range(len(vectors))]
+        index.add(ids, [""] * len(vectors), vectors, [{}] * len(vectors))
+
+    def test_tombstones_compacted_in_background(self, tmp_path):
+        """Test enough deletions trigger a background compaction"""
+        vectors = self._vectors(400)
+        index = LocalVectorIndex(
+            str(tmp_path),
+            dimension=8,
+            index_type="ivf",
+            ann_options={"nlist": 16, "nprobe": 16, "min_train_size": 200},
+            compact_ratio=0.5,
+            compact_min_rows=10,
+        )
+        self._add(index, vectors)
+
+        index.delete([str(i) for i in range(150)])
+        assert index._compact_thread is None  # 150 of 400 rows dead
+        index.delete([str(i) for i in range(150, 250)])
+        index.wait_for_compaction()
+
+        assert index._ids == [str(i) for i in range(250, 400)]
+        assert sum(len(rows) for rows in index._ann._lists) == 150
+        top_row, _ = index.search(vectors[300], 1)[0]
+        assert index._ids[top_row] == "300"
+        reloaded = LocalVectorIndex(str(tmp_path), dimension=8)
+        assert len(reloaded._ids) == len(reloaded) == 150
+
+    def test_trains_once_large_enough_and_matches_exact(self, tmp_path):
+        """Test IVF search kicks in after min_train_size with high recall"""
+        index = self._index(tmp_path)
+        self._add(index, self._vectors(100))
+        assert not index._ann.is_trained
+
+        self._add(index, self._vectors(400, seed=1), start=100)
+        assert index._ann.is_trained
+
+        query = self._vectors(1, seed=2)[0]
+        exact = LocalVectorIndex(str(tmp_path), dimension=8, index_type="flat")
+        expected = {row for row, _ in exact.search(query, 5)}
+        found = {row for row, _ in index.search(query, 5, nprobe=16)}
+        assert found == expected
+
+    def test_incremental_inserts_persist_and_compact(self, tmp_path):
+        """Test new rows are searchable, reloaded and renumbered on compact"""
+        index = self._index(tmp_path, rebuild_growth=100.0)
+        vectors = self._vectors(300)
+        self._add(index, vectors)
+        self._add(index, vectors[:1] * 1.0, start=300)
+        row, score = index.search(vectors[0], 1, nprobe=1)[0]
+        assert score == pytest.approx(1.0, abs=1e-5)
+
+        reloaded = self._index(tmp_path, rebuild_growth=100.0)
+        assert len(reloaded._ann._assignments) == 301
+
+        reloaded.delete([str(i) for i in range(100)])
+        reloaded.compact()
+        assert len(reloaded._ann._assignments) == 201
+        top_row, _ = reloaded.search(vectors[150], 1, nprobe=16)[0]
+        assert reloaded._ids[top_row] == "150"
+
+    def test_rows_added_during_rebuild_are_assigned(self, tmp_path):
+        """Test rows added while clusters retrain end up in the new clusters"""
+        from services import ann_index
+
+        index = self._index(tmp_path, rebuild_growth=2.0)
+        vectors = self._vectors(450)
+        self._add(index, vectors[:200])
+        assert index._ann.is_trained
+
+        training = threading.Event()
+        release = threading.Event()
+        kmeans = ann_index.spherical_kmeans
+
+        def slow_kmeans(*args, **kwargs):
+            training.set()
+            release.wait(5)
+            return kmeans(*args, **kwargs)
+
+        with patch("services.ann_index.spherical_kmeans", slow_kmeans):
+            self._add(index, vectors[200:400], start=200)
+            assert training.wait(5)
+            self._add(index, vectors[400:], start=400)
+            release.set()
+            index._ann.wait_for_rebuild()
+
+        assert index._ann.trained_rows == 400
+        assigned = np.sort(np.concatenate(index._ann._lists))
+        np.testing.assert_array_equal(assigned, np.arange(450))
+
+        index.delete([str(i) for i in range(100)])
+        index.compact()
+        assert len(index._ann._assignments) == 350
+        top_row, _ = index.search(vectors[420], 1, nprobe=16)[0]
+        assert index._ids[top_row] == "420"
+
+
+class TestQuantization:
+    """Test quantized first-pass search with exact re-ranking"""
+
+    @pytest.mark.parametrize(
+        "quantization,options",
+        [("int8", {}), ("pq", {"subvectors": 4, "min_train_size": 256})],
+    )
+    def test_quantized_search_matches_exact(self, tmp_path, quantization, options):
+        """Test re-ranked quantized search finds the exact top-k"""
+        vectors = TestIVFIndex._vectors(600)
+        exact = LocalVectorIndex(str(tmp_path / "exact"), dimension=8)
+        TestIVFIndex._add(exact, vectors)
+
+        index = LocalVectorIndex(
+            str(tmp_path / quantization),
+            dimension=8,
+            quantization=quantization,
+            quantization_options=options,
+            rerank_factor=10,
+        )
+        TestIVFIndex._add(index, vectors)
+
+        query = TestIVFIndex._vectors(1, seed=3)[0]
+        assert [row for row, _ in index.search(query, 5)] == [
+            row for row, _ in exact.search(query, 5)
+        ]
+
+        stats = index.memory_stats()
+        assert stats["quantization"] == quantization
+        assert stats["code_bytes"] < stats["float32_bytes"]
+
+    def test_int8_codes_cover_rows_added_after_training(self):
+        """Test the int8 scale doesn't depend on the rows it was trained on"""
+        codes = QuantizedCodes(None, "int8", dimension=3)
+        # Trained on a single row with small components...
+        codes.sync(np.array([[0.1, 0.1, 0.98]], dtype=np.float32))
+        # ...a later row with a large one must not be clipped
+        vectors = np.array([[0.1, 0.1, 0.98], [1.0, 0.0, 0.0]], dtype=np.float32)
+        codes.sync(vectors)
+        scores = codes.score(np.array([1.0, 0.0, 0.0], dtype=np.float32))
+        assert scores == pytest.approx([0.1, 1.0], abs=0.01)
+
+    def test_codes_reload_and_compact(self, tmp_path):
+        """Test codes persist across reloads and follow compaction"""
+        vectors = TestIVFIndex._vectors(50)
+        index = LocalVectorIndex(str(tmp_path), dimension=8, quantization="int8")
+        TestIVFIndex._add(index, vectors)
+
+        reloaded = LocalVectorIndex(str(tmp_path), dimension=8, quantization="int8")
+        assert len(reloaded._codes.codes) == 50
+
+        reloaded.delete([str(i) for i in range(10)])
+        reloaded.compact()
+        assert len(reloaded._codes.codes) == 40
+        top_row, score = reloaded.search(vectors[20], 1)[0]
+        assert reloaded._ids[top_row] == "20"
+        assert score == pytest.approx(1.0, abs=1e-5)
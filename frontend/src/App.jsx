@@ -120,13 +120,27 @@ const App = () => {
     ])
   }
 
-  const handleUploadSuccess = (result) => {
-    showNotification(`Successfully uploaded ${result.details.filename}! Created ${result.details.text_chunks} text chunks.`, 'success')
+  const handleUploadSuccess = async (result) => {
+    const { filename, job_id: jobId } = result.details
+    showNotification(`Uploaded ${filename}, queued for processing...`, 'info')
     setShowUpload(false)
-    
-    // Switch to the newly created index
-    if (result.details.index_name) {
-      setCurrentIndex(result.details.index_name)
+
+    // The document is processed in the background; wait for its job
+    try {
+      const job = await APIService.waitForUploadJob(jobId)
+      if (job.status === 'failed') {
+        showNotification(`Processing ${filename} failed: ${job.error}`, 'error')
+        return
+      }
+      showNotification(`Processed ${filename}! Created ${job.result.text_chunks} text chunks.`, 'success')
+
+      // Switch to the newly created index
+      const indexName = job.result.index_name || result.details.index_name
+      if (indexName) {
+        setCurrentIndex(indexName)
+      }
+    } catch (error) {
+      showNotification(`Could not check on ${filename}: ${error.message}`, 'error')
     }
   }
 
@@ -50,6 +50,32 @@ class APIService {
     }
   }
 
+  async getUploadJob(jobId) {
+    const response = await fetch(`${this.baseURL}/api/upload/jobs/${jobId}`, {
+      headers: {
+        ...this.getAuthHeaders(),
+      },
+    })
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({ detail: 'Unknown error' }))
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`)
+    }
+
+    return await response.json()
+  }
+
+  // Poll a queued upload until it has been processed
+  async waitForUploadJob(jobId, intervalMs = 1000) {
+    while (true) {
+      const job = await this.getUploadJob(jobId)
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs))
+    }
+  }
+
   async healthCheck() {
     try {
       const response = await fetch(`${this.baseURL}/api/health`)